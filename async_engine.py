@@ -0,0 +1,844 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Асинхронный движок скачивания
+Все передачи данных (части файлов и фрагменты HLS/DASH всех задач) выполняются
+одним циклом событий asyncio на неблокирующих сокетах, поэтому сотни
+одновременных запросов не требуют сотен потоков ОС. Блокирующие операции
+yt-dlp (извлечение информации и форматы, которые качает сам yt-dlp)
+выполняются небольшим пулом потоков, а работа с диском (запись блоков файла,
+fallocate и fsync, хеширование, журнал задач) — отдельным пулом потоков
+записи, поэтому медленный диск не останавливает передачи других задач
+
+Движок работает в отдельном потоке; методы submit, pause, resume, cancel
+и close можно вызывать из любого потока
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import fragment_download
+import job_journal
+import segmented_download
+from async_http import AsyncConnectionPool
+from content_store import ContentHasher
+from download_archive import video_key, info_key
+from file_sink import FileSink
+from segmented_download import (CHUNK_SIZE, CONTENT_RANGE_RE, DownloadCancelled, RangeNotSupported, plan_segments,
+                                 progress_dict)
+from session_pool import YoutubeDLPool
+from vk_video_downloader import (DEFAULT_WORKERS, DownloadSettings, JobResult, build_ydl_opts,
+                                 download_info, extract_video_info, is_stale_url_error, metadata_cache_key,
+                                 report_prediction, store_content, _request_headers)
+from format_policy import BudgetExceeded
+from metrics import METRICS
+from retry_policy import DEFAULT_POLICY
+from scheduler import LOOKAHEAD
+from transfer_control import TransferControl, TransferPaused, remove_partial
+
+# Максимальное число одновременных HTTP-запросов всех задач
+MAX_TRANSFERS = 256
+# Число потоков для блокирующих операций yt-dlp
+EXTRACT_WORKERS = 4
+# Число потоков для записи на диск и обновления журнала задач
+DISK_WORKERS = 4
+
+
+class AsyncJob:
+    """Задача движка; future завершается JobResult"""
+
+    def __init__(self, url, output_dir=None, progress_hooks=(), on_prediction=None, metrics=None, priority=0):
+        self.url = url
+        self.output_dir = output_dir
+        self.priority = priority
+        self.metrics = metrics or METRICS.job(url)
+        self.progress_hooks = [self.metrics.progress_hook, *progress_hooks]
+        self.on_prediction = on_prediction
+        # Ожидаемый объём; None в reserved — бюджет ещё не резервировался
+        self.predicted = None
+        self.reserved = None
+        # Место в очереди планировщика settings.scheduler
+        self.ticket = None
+        self.future = None
+        self.cancelled = False
+        # Пауза: asyncio.Event для передач движка, TransferControl для загрузчика yt-dlp в потоке
+        self.resume_event = None
+        self.control = TransferControl()
+        # Ответы, которые сейчас читают передачи задачи: пауза их закрывает
+        self.responses = set()
+
+    def report(self, d):
+        for hook in self.progress_hooks:
+            hook(d)
+
+
+class AsyncEngine:
+    """Очередь задач, выполняемых в одном цикле событий"""
+
+    def __init__(self, settings=None, workers=DEFAULT_WORKERS, max_transfers=MAX_TRANSFERS,
+                 extract_workers=EXTRACT_WORKERS):
+        self.settings = settings or DownloadSettings()
+        if self.settings.ydl_pool is None:
+            self.settings.ydl_pool = YoutubeDLPool(max_idle=extract_workers)
+        self.workers = max(1, workers)
+        self.max_transfers = max_transfers
+        self.executor = ThreadPoolExecutor(max_workers=extract_workers)
+        self.disk = ThreadPoolExecutor(max_workers=DISK_WORKERS, thread_name_prefix='AsyncEngineDisk')
+        self.loop = None
+        self.closing = False
+        # Незавершённые задачи: при остановке их загрузки прерываются
+        self.lock = threading.Lock()
+        self.jobs = set()
+        self.thread = None
+        self.started = threading.Event()
+
+    def start(self):
+        """Запускает цикл событий в отдельном потоке"""
+        if self.thread is not None:
+            return self
+        self.thread = threading.Thread(target=self._thread_main, name='AsyncEngine', daemon=True)
+        self.thread.start()
+        self.started.wait()
+        return self
+
+    def submit(self, url, output_dir=None, progress_hooks=(), on_prediction=None, metrics=None, priority=0):
+        """
+        Ставит скачивание нормализованной ссылки в очередь и возвращает AsyncJob
+
+        on_prediction(байты или None) вызывается с ожидаемым объёмом перед скачиванием;
+        длительность этапов записывается в metrics (metrics.JobMetrics). С планировщиком
+        settings.scheduler скачивание ждёт слота с приоритетом priority
+        """
+        self.start()
+        job = AsyncJob(url, output_dir or self.settings.output_dir, progress_hooks, on_prediction, metrics,
+                       priority)
+        with self.lock:
+            self.jobs.add(job)
+        job.future = asyncio.run_coroutine_threadsafe(self._run(job), self.loop)
+        job.future.add_done_callback(lambda future: self._forget(job))
+        return job
+
+    def pause(self, job):
+        """Приостанавливает задачу, закрывая её соединения; продолжение — запросами Range"""
+        job.control.pause()
+        self.loop.call_soon_threadsafe(self._pause, job)
+
+    def resume(self, job):
+        job.control.resume()
+        self.loop.call_soon_threadsafe(lambda: job.resume_event and job.resume_event.set())
+
+    def cancel(self, job):
+        job.cancelled = True
+        job.control.cancel()
+        job.future.cancel()
+
+    def close(self):
+        """
+        Останавливает цикл событий и закрывает соединения
+
+        Незавершённые задачи прерываются, в том числе загрузки yt-dlp в потоках: их
+        .part-файлы закрываются, а в журнале они остаются незавершёнными и
+        продолжатся при следующем запуске
+        """
+        if self.loop is None or self.loop.is_closed():
+            return
+        self.closing = True
+        with self.lock:
+            jobs = list(self.jobs)
+        for job in jobs:
+            job.control.interrupt()
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+        self.disk.shutdown(wait=True)
+
+    async def _shutdown(self):
+        """Отменяет оставшиеся задачи цикла, дожидается их завершения и закрывает соединения пула"""
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.http.clear()
+
+    def _forget(self, job):
+        with self.lock:
+            self.jobs.discard(job)
+
+    def _pause(self, job):
+        if job.resume_event is not None:
+            job.resume_event.clear()
+        for response in list(job.responses):
+            response.abort()
+
+    def _thread_main(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        # Примитивы asyncio создаются внутри цикла (в Python 3.9 они привязываются к нему при создании)
+        self.loop.run_until_complete(self._init_loop())
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.http.clear()
+            self.loop.close()
+
+    async def _init_loop(self):
+        self.http = AsyncConnectionPool()
+        # С планировщиком информацию заранее извлекают LOOKAHEAD задач на слот скачивания
+        lookahead = LOOKAHEAD if self.settings.scheduler is not None else 0
+        self.job_slots = asyncio.Semaphore(self.workers * (1 + lookahead))
+        self.transfer_slots = asyncio.Semaphore(self.max_transfers)
+
+    async def _run(self, job):
+        job.resume_event = asyncio.Event()
+        if not job.control.paused:
+            job.resume_event.set()
+        async with self.job_slots:
+            try:
+                return await self._run_job(job)
+            finally:
+                if job.ticket is not None:
+                    self.settings.scheduler.leave(job.ticket)
+
+    async def _run_job(self, job):
+        started = time.monotonic()
+        settings = self.settings
+        job.metrics.begin()
+        journal_entry = None
+        if settings.journal:
+            journal_entry = await self._on_disk(settings.journal.begin, job.url, job.output_dir)
+        try:
+            info = await self._download(job, journal_entry, use_cache=True)
+        except asyncio.CancelledError:
+            # Задача, прерванная остановкой движка, остаётся в журнале для продолжения
+            if journal_entry is not None and not self.closing:
+                await self._on_disk(journal_entry.finish, job_journal.CANCELLED)
+            job.metrics.finish('cancelled')
+            raise
+        except BudgetExceeded as e:
+            if journal_entry is not None:
+                await self._on_disk(journal_entry.finish, job_journal.CANCELLED)
+            job.metrics.finish(JobResult.SKIPPED, e)
+            return JobResult(job.url, JobResult.SKIPPED, 0, time.monotonic() - started, str(e),
+                             job.predicted)
+        except Exception as e:
+            # Загрузка yt-dlp, прерванная остановкой движка, тоже остаётся в журнале
+            if journal_entry is not None and not job.control.interrupted:
+                await self._on_disk(journal_entry.finish, job_journal.FAILED)
+            if job.reserved and settings.budget is not None:
+                settings.budget.release(job.reserved)
+            job.metrics.finish(JobResult.FAILED, e)
+            return JobResult(job.url, JobResult.FAILED, 0, time.monotonic() - started, str(e),
+                             job.predicted)
+
+        downloaded = await self._on_disk(_file_size, info.get('filepath'))
+        if journal_entry is not None:
+            await self._on_disk(journal_entry.finish, job_journal.DONE)
+        if settings.archive is not None:
+            await self._on_disk(settings.archive.add, video_key(job.url), info_key(info))
+        if settings.content_store is not None:
+            await self._in_thread(store_content, settings, job.url, info)
+        job.metrics.finish(JobResult.OK, bytes_downloaded=downloaded)
+        return JobResult(job.url, JobResult.OK, downloaded, time.monotonic() - started,
+                         f"{info['title']}.{info.get('ext', 'mp4')}", job.predicted)
+
+    async def _download(self, job, journal_entry, use_cache):
+        """Извлекает информацию о видео и скачивает выбранный формат; возвращает info-словарь"""
+        info, filename, headers, cache_key = await self._in_thread(self._prepare, job, use_cache)
+        scheduler = self.settings.scheduler
+        if scheduler is not None and job.ticket is None:
+            job.ticket = scheduler.enter(job.priority, job.predicted)
+            await scheduler.wait_async(job.ticket)
+            job.metrics.scheduled()
+        try:
+            return await self._download_info(job, info, filename, headers, journal_entry)
+        except Exception as e:
+            # Только истёкшие или отозванные ссылки из кэша исправляются повторным извлечением;
+            # временные сбои сети и ошибки диска завершают задачу, запись кэша остаётся
+            if cache_key is None or not is_stale_url_error(e):
+                raise
+            self.settings.cache.invalidate(cache_key)
+            METRICS.count_retry('cache')
+            return await self._download(job, journal_entry, use_cache=False)
+
+    def _prepare(self, job, use_cache):
+        """
+        Блокирующая часть: информация о видео, имя файла и заголовки запросов
+
+        Ожидаемый объём сообщается и резервируется в бюджете один раз на задачу.
+        Последний элемент — ключ кэша, если информация взята из кэша, иначе None
+        """
+        settings = self.settings
+        cache = settings.cache if use_cache else None
+        ydl_opts = dict(build_ydl_opts(job.output_dir, settings.format_policy, settings.retry_policy),
+                        quiet=True, noprogress=True)
+        with settings.ydl_pool.lease(ydl_opts) as ydl:
+            cache_key = metadata_cache_key(ydl, job.url)
+            info = cache.get(cache_key) if cache else None
+            from_cache = info is not None
+            if info is None:
+                info = extract_video_info(ydl, job.url, settings.process_pool)
+                if settings.cache:
+                    settings.cache.put(cache_key, ydl.sanitize_info(info))
+            job.metrics.extracted()
+            if job.reserved is None:
+                job.predicted = report_prediction(ydl, job.url, info)
+                if job.on_prediction is not None:
+                    job.on_prediction(job.predicted)
+                if settings.budget is not None:
+                    settings.budget.reserve(job.predicted)
+                job.reserved = job.predicted or 0
+            headers = _request_headers(ydl, info) if info.get('url') else {}
+            return info, ydl.prepare_filename(info), headers, cache_key if from_cache else None
+
+    async def _download_info(self, job, info, filename, headers, journal_entry):
+        resume_state = None
+        on_checkpoint = None
+        if journal_entry is not None:
+            def target():
+                state = journal_entry.resume_state_for(info.get('format_id'), filename)
+                journal_entry.set_target(info.get('format_id'), filename)
+                return state
+
+            resume_state = await self._on_disk(target)
+            # Вызывается в потоках записи, после записи блоков, которые описывает состояние
+            on_checkpoint = journal_entry.checkpoint
+
+        supported = segmented_download.is_supported(info) or fragment_download.is_supported(info)
+        if self.settings.connections > 1 and supported:
+            throttle = self.settings.limiter.register() if self.settings.limiter else None
+            try:
+                transferred = await self._transfer(job, info, filename, headers, resume_state, on_checkpoint,
+                                                   throttle)
+            except (asyncio.CancelledError, DownloadCancelled):
+                if job.cancelled:
+                    await self._on_disk(remove_partial, filename)
+                raise
+            finally:
+                if throttle is not None:
+                    throttle.close()
+            if transferred:
+                info['filepath'] = filename
+                return info
+
+        return await self._in_thread(self._fallback, job, info, journal_entry)
+
+    async def _transfer(self, job, info, filename, headers, resume_state, on_checkpoint, throttle):
+        """Скачивает формат передачами движка; False, если поток они не поддерживают"""
+        if await self._on_disk(os.path.exists, filename):
+            # Файл уже скачан ранее
+            return True
+        if segmented_download.is_supported(info):
+            transfer = SegmentTransfer(self, job, info['url'], filename, headers, resume_state,
+                                       on_checkpoint, throttle)
+        else:
+            transfer = await FragmentTransfer.from_info(self, job, info, filename, headers,
+                                                        resume_state, on_checkpoint, throttle)
+            if transfer is None:
+                return False
+        await transfer.run()
+        info['content_hash'] = transfer.content_hash
+        return True
+
+    def _fallback(self, job, info, journal_entry):
+        """Скачивание загрузчиком yt-dlp в потоке пула (форматы, которые движок не поддерживает)"""
+        hooks = [job.control.progress_hook, *job.progress_hooks]
+        if journal_entry is not None:
+            hooks.append(journal_entry.progress_hook)
+        ydl_opts = dict(build_ydl_opts(job.output_dir, retry_policy=self.settings.retry_policy),
+                        quiet=True, noprogress=True)
+        throttle = self.settings.limiter.register() if self.settings.limiter else None
+        try:
+            with self.settings.ydl_pool.lease(ydl_opts, hooks) as ydl:
+                return download_info(ydl, info, 1, journal_entry, throttle, self.settings.process_pool,
+                                     retry_policy=self.settings.retry_policy, control=job.control)
+        finally:
+            if throttle is not None:
+                throttle.close()
+
+    async def _in_thread(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _on_disk(self, func, *args):
+        """Выполняет func(*args) — запись на диск или в журнал — в пуле потоков записи"""
+        return await asyncio.get_running_loop().run_in_executor(self.disk, func, *args)
+
+    async def fetch(self, url, headers, on_chunk, job, throttle=None, response=None, partial=False):
+        """
+        Читает тело ответа по частям, вызывая on_chunk(data); если он вернул сопрограмму, она дожидается
+
+        Перед каждой частью учитывается ограничение скорости. Пауза задачи закрывает
+        ответ, и чтение завершается TransferPaused: передача продолжается запросом Range
+        после возобновления, а приостановленная задача не держит ни соединений, ни мест
+        в transfer_slots. response — уже открытый ответ; partial — требовать ответ 206 на запрос Range
+        """
+        if response is None:
+            await job.resume_event.wait()
+        async with self.transfer_slots:
+            if response is None:
+                response = await self.http.open(url, headers)
+            if partial and response.status != 206:
+                response.close()
+                raise RangeNotSupported("Сервер перестал поддерживать загрузку по частям")
+            job.responses.add(response)
+            try:
+                async with response:
+                    if not job.resume_event.is_set():
+                        # Пауза наступила, пока отправлялся запрос
+                        response.abort()
+                    while True:
+                        chunk = await response.read(CHUNK_SIZE)
+                        if not chunk:
+                            return
+                        if throttle is not None:
+                            delay = throttle.reserve(len(chunk))
+                            if delay > 0:
+                                await asyncio.sleep(delay)
+                        pending = on_chunk(chunk)
+                        if pending is not None:
+                            await pending
+            except Exception:
+                if response.aborted:
+                    raise TransferPaused("Скачивание приостановлено")
+                raise
+            finally:
+                job.responses.discard(response)
+
+
+class SegmentTransfer:
+    """
+    Скачивание файла по частям (Range) в несколько одновременных запросов
+
+    Временные ошибки повторяются по политике settings.retry_policy для каждой
+    части отдельно, с первого незаписанного байта; так же части продолжаются после паузы.
+    Блоки файла и состояние в журнале записываются в потоках записи движка
+    """
+
+    def __init__(self, engine, job, url, filename, headers, resume_state=None, on_checkpoint=None,
+                 throttle=None):
+        self.engine = engine
+        self.job = job
+        self.url = url
+        self.filename = filename
+        self.headers = dict(headers or {})
+        self.resume_state = resume_state
+        self.on_checkpoint = on_checkpoint
+        self.throttle = throttle
+        # Хеш содержимого нужен только для хранилища с дедупликацией
+        self.hasher = ContentHasher() if engine.settings.content_store is not None else None
+        self.content_hash = None
+        self.retry_policy = engine.settings.retry_policy or DEFAULT_POLICY
+        self.connections = engine.settings.connections
+        self.total_size = None
+        self.segments = []
+        self.downloaded = 0
+        self.started = None
+
+    async def run(self):
+        tmp_filename = self.filename + '.part'
+        self.started = time.monotonic()
+        on_disk = self.engine._on_disk
+
+        # Пробный запрос первого байта: поддержка Range и размер файла
+        probe = await self.retry_policy.call_async(self.engine.http.open, self.url,
+                                                   dict(self.headers, Range='bytes=0-0'))
+        match = CONTENT_RANGE_RE.search(probe.headers.get('Content-Range') or '')
+        if probe.status != 206 or not match:
+            # Сервер отдаёт файл целиком — читаем его из этого же ответа
+            length = probe.headers.get('Content-Length')
+            self.total_size = int(length) if length and length.isdigit() else None
+            try:
+                sink = await on_disk(self._open_whole, tmp_filename)
+            except BaseException:
+                probe.close()
+                raise
+            completed = False
+            try:
+                await self._fetch_whole(sink, probe)
+                await on_disk(sink.truncate, self.downloaded)
+                completed = True
+            finally:
+                await on_disk(sink.close, completed)
+        else:
+            await probe.read()
+            probe.close()
+            self.total_size = int(match.group(3))
+            await self._run_segments(tmp_filename)
+
+        await on_disk(self._complete, tmp_filename)
+        self._report('finished')
+
+    async def _run_segments(self, tmp_filename):
+        on_disk = self.engine._on_disk
+        sink = await on_disk(self._open_segments, tmp_filename)
+        completed = False
+        try:
+            tasks = [asyncio.ensure_future(self._fetch_segment(sink, segment))
+                     for segment in self.segments if segment[0] + segment[2] <= segment[1]]
+            try:
+                await asyncio.gather(*tasks)
+                completed = True
+            finally:
+                for task in tasks:
+                    task.cancel()
+                # Отменённые части успевают записать остаток своих буферов
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await on_disk(self._checkpoint, True)
+        finally:
+            await on_disk(sink.close, completed)
+
+    def _open_whole(self, tmp_filename):
+        """Открывает .part-файл для загрузки без Range и выделяет под него место; в потоке записи"""
+        _make_parent_dir(self.filename)
+        sink = FileSink(tmp_filename, self.engine.settings.fsync_policy, hasher=self.hasher)
+        try:
+            if self.total_size:
+                sink.preallocate(self.total_size)
+        except BaseException:
+            sink.close(False)
+            raise
+        return sink
+
+    def _open_segments(self, tmp_filename):
+        """
+        Открывает .part-файл для загрузки по частям; в потоке записи
+
+        Продолжаемая загрузка хеширует уже записанные байты, новая — выделяет место под файл
+        """
+        _make_parent_dir(self.filename)
+        segments = self._resumed_segments(tmp_filename)
+        if segments:
+            self.segments = segments
+            self.downloaded = sum(done for _, _, done in segments)
+        else:
+            self.segments = [[start, end, 0] for start, end in plan_segments(self.total_size, self.connections)]
+
+        sink = FileSink(tmp_filename, self.engine.settings.fsync_policy, resume=bool(segments),
+                        hasher=self.hasher)
+        try:
+            if segments:
+                for start, _, done in segments:
+                    sink.hash_existing(start, done)
+            else:
+                sink.preallocate(self.total_size)
+        except BaseException:
+            sink.close(False)
+            raise
+        return sink
+
+    def _complete(self, tmp_filename):
+        """Переименовывает готовый .part-файл и считает хеш содержимого; в потоке записи"""
+        os.replace(tmp_filename, self.filename)
+        if self.hasher is not None:
+            self.content_hash = self.hasher.hexdigest(os.path.getsize(self.filename))
+
+    def _resumed_segments(self, tmp_filename):
+        state = self.resume_state
+        if not state or state.get('total_size') != self.total_size:
+            return None
+        if not os.path.exists(tmp_filename) or os.path.getsize(tmp_filename) != self.total_size:
+            return None
+        return [list(segment) for segment in state.get('segments') or []] or None
+
+    async def _fetch_whole(self, sink, response):
+        """Скачивает файл без поддержки Range; после ошибки файл приходится скачивать заново"""
+        attempt = 0
+        while True:
+            writer = sink.writer(0)
+            try:
+                await self.engine.fetch(self.url, self.headers, lambda data: self._write(writer, data, None),
+                                        self.job, self.throttle, response=response)
+                return
+            except TransferPaused:
+                self.downloaded = 0
+                response = None
+                await self.job.resume_event.wait()
+            except Exception as e:
+                attempt += 1
+                if not self.retry_policy.should_retry(e, attempt):
+                    raise
+                METRICS.count_retry('segment')
+                self.downloaded = 0
+                response = None
+                await asyncio.sleep(self.retry_policy.delay(attempt, e))
+            finally:
+                await self.engine._on_disk(writer.flush)
+
+    async def _fetch_segment(self, sink, segment):
+        """Скачивает часть [start, end, done], повторяя её после временных ошибок"""
+        attempt = 0
+        while True:
+            done = segment[2]
+            try:
+                await self._fetch_segment_once(sink, segment)
+                return
+            except TransferPaused:
+                await self.job.resume_event.wait()
+            except Exception as e:
+                if segment[0] + segment[2] > segment[1]:
+                    # Ошибка после последнего байта части
+                    return
+                attempt = 1 if segment[2] > done else attempt + 1
+                if not self.retry_policy.should_retry(e, attempt):
+                    raise
+                METRICS.count_retry('segment')
+                await asyncio.sleep(self.retry_policy.delay(attempt, e))
+
+    async def _fetch_segment_once(self, sink, segment):
+        start, end, done = segment
+        headers = dict(self.headers, Range=f'bytes={start + done}-{end}')
+        writer = sink.writer(start + done)
+        try:
+            await self.engine.fetch(self.url, headers, lambda data: self._write(writer, data, segment),
+                                    self.job, self.throttle, partial=True)
+        finally:
+            segment[2] += await self.engine._on_disk(writer.flush)
+
+    async def _write(self, writer, data, segment):
+        if writer.fills_block(len(data)):
+            # Блок уходит на диск в потоке записи; до её окончания эта часть не читает сеть
+            await self.engine._on_disk(self._write_block, writer, data, segment)
+        else:
+            writer.write(data)
+        self.downloaded += len(data)
+        self._report('downloading')
+
+    def _write_block(self, writer, data, segment):
+        # В состояние части засчитываются только байты, уже переданные ОС (file_sink.SegmentWriter)
+        flushed = writer.write(data)
+        if segment is not None:
+            segment[2] += flushed
+        self._checkpoint()
+
+    def _checkpoint(self, force=False):
+        if not self.on_checkpoint or not self.segments:
+            return
+        state = {'total_size': self.total_size, 'segments': [list(segment) for segment in self.segments]}
+        self.on_checkpoint(self.downloaded, self.total_size, state, force)
+
+    def _report(self, status):
+        if self.job.progress_hooks:
+            self.job.report(progress_dict(status, self.filename, self.downloaded, self.total_size, self.started))
+
+
+class FragmentTransfer:
+    """Скачивание фрагментов HLS/DASH с адаптивным окном и записью строго по порядку"""
+
+    def __init__(self, engine, job, fragment_urls, filename, headers, init_url=None, resume_state=None,
+                 on_checkpoint=None, throttle=None):
+        self.engine = engine
+        self.job = job
+        self.fragment_urls = fragment_urls
+        self.filename = filename
+        self.headers = dict(headers or {})
+        self.init_url = init_url
+        self.resume_state = resume_state
+        self.on_checkpoint = on_checkpoint
+        self.throttle = throttle
+        # Хеш содержимого нужен только для хранилища с дедупликацией
+        self.hasher = ContentHasher() if engine.settings.content_store is not None else None
+        self.content_hash = None
+        self.retry_policy = engine.settings.retry_policy or DEFAULT_POLICY
+        self.window = fragment_download.AdaptiveWindow()
+        self.is_mpegts = False
+        self.downloaded = 0
+        self.started = None
+
+    @classmethod
+    async def from_info(cls, engine, job, info, filename, headers, resume_state=None, on_checkpoint=None,
+                        throttle=None):
+        """Создаёт передачу по info-словарю yt-dlp; None, если поток не поддерживается"""
+        kwargs = dict(resume_state=resume_state, on_checkpoint=on_checkpoint, throttle=throttle)
+        if info.get('protocol') == 'http_dash_segments':
+            base_url = info.get('fragment_base_url') or ''
+            urls = []
+            for fragment in info['fragments']:
+                url = fragment.get('url') or (urljoin(base_url, fragment['path']) if fragment.get('path') else None)
+                if not url or fragment.get('byte_range'):
+                    return None
+                urls.append(url)
+            return cls(engine, job, urls, filename, headers, **kwargs)
+
+        async def fetch_playlist():
+            async with engine.transfer_slots:
+                response = await engine.http.open(info['url'], headers)
+                async with response:
+                    return (await response.read()).decode('utf-8', 'replace'), response.geturl()
+
+        policy = engine.settings.retry_policy or DEFAULT_POLICY
+        playlist, playlist_url = await policy.call_async(fetch_playlist)
+        try:
+            init_url, urls = fragment_download.parse_m3u8(playlist, playlist_url)
+        except fragment_download.UnsupportedStream:
+            return None
+        transfer = cls(engine, job, urls, filename, headers, init_url, **kwargs)
+        transfer.is_mpegts = init_url is None
+        return transfer
+
+    async def run(self):
+        tmp_filename = self.filename + '.part'
+        self.started = time.monotonic()
+        on_disk = self.engine._on_disk
+
+        out, first_index = await on_disk(self._open, tmp_filename)
+        completed = False
+        try:
+            if first_index == 0 and self.init_url:
+                init_data = await self.retry_policy.call_async(self._fetch, self.init_url)
+                await on_disk(out.write, init_data)
+                self.downloaded += len(init_data)
+            await self._download_fragments(out, first_index)
+            completed = True
+        finally:
+            await on_disk(out.close, completed)
+
+        if self.hasher is not None:
+            self.content_hash = await on_disk(self.hasher.hexdigest, self.downloaded)
+        if self.is_mpegts and os.path.splitext(self.filename)[1].lower() == '.mp4':
+            remuxed = await self.engine._in_thread(fragment_download.remux_mpegts, tmp_filename, self.filename)
+            if remuxed:
+                await on_disk(os.remove, tmp_filename)
+                self.content_hash = None
+            else:
+                await on_disk(os.replace, tmp_filename, self.filename)
+        else:
+            await on_disk(os.replace, tmp_filename, self.filename)
+        self._report('finished', self.downloaded)
+
+    def _open(self, tmp_filename):
+        """
+        Открывает .part-файл; в потоке записи
+
+        Возвращает FileSink и номер первого фрагмента, который нужно скачать: при продолжении
+        файл усекается до последнего целого фрагмента, а записанное хешируется заново
+        """
+        _make_parent_dir(self.filename)
+        resume = self._resumed_position(tmp_filename)
+        out = FileSink(tmp_filename, self.engine.settings.fsync_policy, resume=bool(resume),
+                       hasher=self.hasher)
+        if not resume:
+            return out, 0
+        first_index, offset = resume
+        try:
+            out.truncate(offset)
+            out.hash_existing(0, offset)
+        except BaseException:
+            out.close(False)
+            raise
+        self.downloaded = offset
+        return out, first_index
+
+    def _resumed_position(self, tmp_filename):
+        state = self.resume_state
+        if not state or state.get('count') != len(self.fragment_urls):
+            return None
+        if not os.path.exists(tmp_filename) or os.path.getsize(tmp_filename) < state.get('offset', 0):
+            return None
+        return state['fragment'], state['offset']
+
+    async def _download_fragments(self, out, first_index):
+        total = len(self.fragment_urls)
+        next_index = first_index
+        write_index = first_index
+        ready = {}
+        received = {}
+        attempts = {}
+        in_flight = {}
+
+        try:
+            while write_index < total:
+                while (next_index < total and len(in_flight) < self.window.size
+                       and next_index - write_index < fragment_download.MAX_BUFFERED):
+                    received[next_index] = bytearray()
+                    task = asyncio.ensure_future(self._fetch(self.fragment_urls[next_index], received[next_index]))
+                    in_flight[task] = next_index
+                    next_index += 1
+
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    index = in_flight.pop(task)
+                    try:
+                        data = task.result()
+                    except Exception as e:
+                        self.window.on_error()
+                        attempt = fragment_download._next_attempt(attempts, index, len(received[index]))
+                        if not self.retry_policy.should_retry(e, attempt):
+                            raise
+                        METRICS.count_retry('fragment')
+                        retry = asyncio.ensure_future(self._fetch(self.fragment_urls[index], received[index],
+                                                                  self.retry_policy.delay(attempt, e)))
+                        in_flight[retry] = index
+                        continue
+                    self.window.on_success(len(data))
+                    ready[index] = data
+                    del received[index]
+                    attempts.pop(index, None)
+
+                while write_index in ready:
+                    data = ready.pop(write_index)
+                    # Пока фрагмент пишется в потоке записи, остальные продолжают скачиваться
+                    await self.engine._on_disk(self._write_fragment, out, data, write_index + 1, total)
+                    write_index += 1
+                    self._report('downloading', self.downloaded * total // write_index)
+        finally:
+            for task in in_flight:
+                task.cancel()
+            if self.on_checkpoint and first_index < write_index < total:
+                # Позиция записи прерванной загрузки сохраняется без ограничения частоты
+                state = {'count': total, 'fragment': write_index, 'offset': self.downloaded}
+                await self.engine._on_disk(self.on_checkpoint, self.downloaded,
+                                           self.downloaded * total // write_index, state, True)
+
+    def _write_fragment(self, out, data, written, total):
+        """Дописывает фрагмент и отмечает в журнале, что записано written фрагментов; в потоке записи"""
+        out.write(data)
+        self.downloaded += len(data)
+        if self.on_checkpoint:
+            state = {'count': total, 'fragment': written, 'offset': self.downloaded}
+            self.on_checkpoint(self.downloaded, self.downloaded * total // written, state, written == total)
+
+    async def _fetch(self, url, received=None, delay=0):
+        """Скачивает фрагмент, дописывая его в received; начало, полученное прошлой попыткой, не запрашивается"""
+        if delay:
+            await asyncio.sleep(delay)
+        if received is None:
+            received = bytearray()
+        while True:
+            try:
+                return await self._fetch_rest(url, received)
+            except TransferPaused:
+                await self.job.resume_event.wait()
+
+    async def _fetch_rest(self, url, received):
+        if received:
+            headers = dict(self.headers, Range=f'bytes={len(received)}-')
+            try:
+                await self.engine.fetch(url, headers, received.extend, self.job, self.throttle, partial=True)
+                return received
+            except RangeNotSupported:
+                # Сервер отдаёт фрагмент целиком
+                del received[:]
+        await self.engine.fetch(url, self.headers, received.extend, self.job, self.throttle)
+        return received
+
+    def _report(self, status, total_estimate):
+        if self.job.progress_hooks:
+            self.job.report(progress_dict(status, self.filename, self.downloaded, total_estimate,
+                                          self.started, estimated=status != 'finished'))
+
+
+def _make_parent_dir(filename):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+def _file_size(path):
+    """Размер файла или 0, если его нет"""
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Асинхронный HTTP/1.1-клиент на потоках asyncio
+Поддерживает только GET, редиректы, chunked-ответы и keep-alive соединения,
+переиспользуемые между запросами к одному хосту. Все соединения обслуживаются
+одним циклом событий без отдельного потока на каждое
+"""
+
+import asyncio
+import email.parser
+import http.client
+import ssl
+import urllib.error
+from urllib.parse import urlsplit, urljoin
+
+from retry_policy import BREAKERS, host_key
+from session_pool import MAX_IDLE_PER_HOST, MAX_REDIRECTS, REDIRECT_CODES
+
+# Максимальная длина строки статуса или заголовка
+MAX_LINE = 65536
+
+
+class AsyncResponse:
+    """Ответ сервера; после полного чтения соединение возвращается в пул"""
+
+    def __init__(self, pool, key, reader, writer, status, reason, headers, url):
+        self.pool = pool
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.url = url
+        self.timeout = None
+        self.will_close = (headers.get('Connection', '').lower() == 'close')
+        self.chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        self.chunk_left = 0
+        length = headers.get('Content-Length')
+        self.length = int(length) if length and length.isdigit() and not self.chunked else None
+        if status in (204, 304):
+            self.length = 0
+        elif not self.chunked and self.length is None:
+            # Без длины тело заканчивается закрытием соединения
+            self.will_close = True
+        self.done = self.length == 0
+        self.aborted = False
+
+    async def read(self, amt=None):
+        """Читает до amt байт тела (всё тело, если amt не указан); b'' — конец тела"""
+        if amt is None:
+            chunks = []
+            while True:
+                chunk = await self.read(1 << 20)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+        if self.done:
+            return b''
+        try:
+            data = await asyncio.wait_for(self._read(amt), self.timeout)
+            if self.aborted:
+                raise ConnectionAbortedError("Соединение закрыто до конца ответа")
+        except (OSError, http.client.HTTPException, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            # Обрыв посреди тела — тоже сбой хоста для его автомата (но не закрытие самой программой)
+            if not self.aborted:
+                BREAKERS.failure(host_key(self.url))
+            raise
+        if self.done:
+            self._release()
+        return data
+
+    async def _read(self, amt):
+        if self.chunked:
+            if self.chunk_left == 0:
+                line = await self.reader.readline()
+                size = line.split(b';', 1)[0].strip()
+                if not size:
+                    raise http.client.IncompleteRead(b'')
+                self.chunk_left = int(size, 16)
+                if self.chunk_left == 0:
+                    # Пропускаем завершающие заголовки
+                    while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    self.done = True
+                    return b''
+            data = await self.reader.read(min(amt, self.chunk_left))
+            if not data:
+                raise http.client.IncompleteRead(b'')
+            self.chunk_left -= len(data)
+            if self.chunk_left == 0:
+                await self.reader.readexactly(2)
+            return data
+
+        if self.length is None:
+            data = await self.reader.read(amt)
+            if not data:
+                self.done = True
+            return data
+        data = await self.reader.read(min(amt, self.length))
+        if not data:
+            raise http.client.IncompleteRead(b'', self.length)
+        self.length -= len(data)
+        if self.length == 0:
+            self.done = True
+        return data
+
+    def geturl(self):
+        return self.url
+
+    def abort(self):
+        """Прерывает ответ (пауза задачи): ожидающее чтение завершается ошибкой, соединение закрывается"""
+        self.aborted = True
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def close(self):
+        """Закрывает ответ; недочитанное соединение нельзя переиспользовать, оно закрывается"""
+        if self.writer is None:
+            return
+        if self.done:
+            self._release()
+        else:
+            self.writer.close()
+            self.writer = None
+
+    def _release(self):
+        writer, self.writer = self.writer, None
+        if writer is None:
+            return
+        if self.will_close:
+            writer.close()
+        else:
+            self.pool._put(self.key, (self.reader, writer))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+
+class AsyncConnectionPool:
+    """Пул keep-alive соединений asyncio, сгруппированных по хосту"""
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle = {}
+        self.ssl_context = ssl.create_default_context()
+
+    async def open(self, url, headers=None, timeout=30):
+        """
+        Выполняет GET-запрос и возвращает AsyncResponse
+
+        Редиректы обрабатываются автоматически, ответы с кодом 4xx/5xx
+        вызывают urllib.error.HTTPError, как и urllib.request.urlopen.
+        Пока автомат хоста разомкнут (retry_policy.BREAKERS), запрос ждёт
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            host = host_key(url)
+            await BREAKERS.wait_async(host)
+            try:
+                response = await self._request(url, headers or {}, timeout)
+            except (OSError, http.client.HTTPException, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                BREAKERS.failure(host)
+                raise
+            BREAKERS.record(host, response.status)
+            if response.status in REDIRECT_CODES and response.headers.get('Location'):
+                await response.read()
+                response.close()
+                url = urljoin(url, response.headers['Location'])
+                continue
+            if response.status >= 400:
+                await response.read()
+                response.close()
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+            return response
+        raise urllib.error.URLError(f"Слишком много редиректов: {url}")
+
+    def clear(self):
+        """Закрывает все простаивающие соединения"""
+        idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for _, writer in connections:
+                writer.close()
+
+    async def _request(self, url, headers, timeout):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise urllib.error.URLError(f"Неподдерживаемая схема URL: {parts.scheme}")
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        host = parts.hostname if port in (80, 443) else f"{parts.hostname}:{port}"
+        request_headers = {'Host': host, 'Accept-Encoding': 'identity', 'Connection': 'keep-alive'}
+        request_headers.update(headers)
+        request = f"GET {path} HTTP/1.1\r\n" + ''.join(
+            f"{name}: {value}\r\n" for name, value in request_headers.items()) + "\r\n"
+
+        while True:
+            connection, reused = await self._get(key, timeout)
+            reader, writer = connection
+            try:
+                writer.write(request.encode('latin-1'))
+                await asyncio.wait_for(writer.drain(), timeout)
+                status, reason, response_headers = await asyncio.wait_for(self._read_head(reader), timeout)
+            except (ConnectionError, asyncio.IncompleteReadError, http.client.RemoteDisconnected):
+                writer.close()
+                # Сервер закрыл простаивавшее соединение — пробуем новое
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            response = AsyncResponse(self, key, reader, writer, status, reason, response_headers, url)
+            response.timeout = timeout
+            return response
+
+    async def _read_head(self, reader):
+        line = await reader.readline()
+        if not line:
+            raise http.client.RemoteDisconnected("Сервер закрыл соединение без ответа")
+        parts = line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+            raise http.client.BadStatusLine(line)
+
+        lines = []
+        while True:
+            header = await reader.readline()
+            if header in (b'\r\n', b'\n', b''):
+                break
+            if len(header) > MAX_LINE:
+                raise http.client.LineTooLong("header line")
+            lines.append(header.decode('latin-1'))
+        headers = email.parser.Parser(_class=http.client.HTTPMessage).parsestr(''.join(lines))
+        return int(parts[1]), parts[2] if len(parts) > 2 else '', headers
+
+    async def _get(self, key, timeout):
+        connections = self.idle.get(key)
+        while connections:
+            reader, writer = connections.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return (reader, writer), True
+            writer.close()
+
+        scheme, host, port = key
+        context = self.ssl_context if scheme == 'https' else None
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=context, limit=MAX_LINE), timeout)
+        return (reader, writer), False
+
+    def _put(self, key, connection):
+        connections = self.idle.setdefault(key, [])
+        if len(connections) < self.max_idle_per_host:
+            connections.append(connection)
+        else:
+            connection[1].close()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Общее ограничение скорости для всех загрузок процесса
+Глобальный лимит делится между активными загрузками поровну (с учётом
+их собственных лимитов), поэтому одно большое видео не забирает весь канал
+у множества коротких клипов. Лимиты можно менять во время работы
+"""
+
+import re
+import threading
+import time
+
+# Загрузка считается активной, если передавала данные за последние столько секунд
+ACTIVE_TIMEOUT = 2.0
+
+RATE_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)I?B?\s*$', re.IGNORECASE)
+RATE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_rate(text):
+    """
+    Разбирает скорость вида '500K', '2.5M', '1048576' в байты в секунду
+
+    0 или пустая строка означают отсутствие ограничения (None)
+    """
+    if text is None or not str(text).strip():
+        return None
+    match = RATE_RE.match(str(text))
+    if not match:
+        raise ValueError(f"Некорректная скорость: {text}")
+    rate = int(float(match.group(1)) * RATE_UNITS[match.group(2).upper()])
+    return rate or None
+
+
+def _as_rate(share):
+    """Округляет долю скорости; None остаётся отсутствием ограничения"""
+    return None if share is None else max(1, int(share))
+
+
+class TokenBucket:
+    """Корзина токенов: не более rate байт в секунду с запасом на одну секунду"""
+
+    def __init__(self, rate=None):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.tokens = float(rate or 0)
+        self.updated = time.monotonic()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = rate
+            if rate:
+                self.tokens = min(self.tokens, float(rate))
+
+    def reserve(self, num_bytes):
+        """Списывает num_bytes и возвращает, сколько секунд нужно подождать"""
+        with self.lock:
+            if not self.rate:
+                return 0.0
+            self._refill()
+            self.tokens -= num_bytes
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(float(self.rate), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class JobThrottle:
+    """Ограничитель скорости одной загрузки"""
+
+    def __init__(self, limiter, cap=None):
+        self.limiter = limiter
+        self.cap = cap
+        self.bucket = TokenBucket()
+        self.last_active = 0.0
+        self.active = False
+        self.listeners = []
+
+    @property
+    def rate(self):
+        """Текущая доля скорости этой загрузки, байт/с (None — без ограничений)"""
+        return self.bucket.rate
+
+    def consume(self, num_bytes):
+        """Учитывает полученные байты и ждёт, если загрузка превышает свою долю"""
+        delay = self.reserve(num_bytes)
+        if delay > 0:
+            time.sleep(delay)
+
+    def reserve(self, num_bytes):
+        """Как consume, но возвращает время ожидания вместо сна (для asyncio)"""
+        self.last_active = time.monotonic()
+        if not self.active:
+            self.limiter._set_active(self, True)
+        else:
+            self.limiter._expire_idle()
+        return self.bucket.reserve(num_bytes)
+
+    def set_active(self, active):
+        """Явно отмечает загрузку активной (для загрузчиков без побайтового учёта)"""
+        self.last_active = time.monotonic() if active else 0.0
+        self.limiter._set_active(self, active)
+
+    def set_cap(self, cap):
+        """Меняет собственный лимит загрузки"""
+        self.cap = cap
+        self.limiter._rebalance()
+
+    def add_listener(self, callback):
+        """Подписывает callback(rate) на изменения доли скорости загрузки"""
+        self.listeners.append(callback)
+        callback(self.rate)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def close(self):
+        """Снимает загрузку с учёта; её доля распределяется между остальными"""
+        self.limiter._unregister(self)
+
+    def _apply_rate(self, rate):
+        if rate == self.bucket.rate:
+            return
+        self.bucket.set_rate(rate)
+        for callback in list(self.listeners):
+            callback(rate)
+
+
+class BandwidthLimiter:
+    """Распределяет общий лимит скорости между загрузками процесса"""
+
+    def __init__(self, global_rate=None, job_rate=None):
+        self.lock = threading.RLock()
+        self.global_rate = global_rate
+        self.job_rate = job_rate
+        self.throttles = []
+        self.last_expire = 0.0
+
+    def register(self, cap=None):
+        """Создаёт ограничитель для новой загрузки; cap — её собственный лимит"""
+        throttle = JobThrottle(self, cap if cap is not None else self.job_rate)
+        with self.lock:
+            self.throttles.append(throttle)
+            self._rebalance()
+        return throttle
+
+    def set_global_rate(self, rate):
+        """Меняет общий лимит скорости (None — без ограничений)"""
+        with self.lock:
+            self.global_rate = rate
+            self._rebalance()
+
+    def set_job_rate(self, rate):
+        """Меняет лимит по умолчанию для каждой загрузки, в том числе уже идущих"""
+        with self.lock:
+            self.job_rate = rate
+            for throttle in self.throttles:
+                throttle.cap = rate
+            self._rebalance()
+
+    def _unregister(self, throttle):
+        with self.lock:
+            if throttle in self.throttles:
+                self.throttles.remove(throttle)
+                self._rebalance()
+
+    def _set_active(self, throttle, active):
+        with self.lock:
+            if throttle.active != active:
+                throttle.active = active
+                self._rebalance()
+
+    def _expire_idle(self):
+        """Снимает отметку активности с загрузок, которые давно не передавали данные"""
+        now = time.monotonic()
+        if now - self.last_expire < ACTIVE_TIMEOUT / 2:
+            return
+        with self.lock:
+            self.last_expire = now
+            changed = False
+            for throttle in self.throttles:
+                if throttle.active and now - throttle.last_active > ACTIVE_TIMEOUT:
+                    throttle.active = False
+                    changed = True
+            if changed:
+                self._rebalance()
+
+    def _rebalance(self):
+        """
+        Делит общий лимит между активными загрузками методом «наполнения сосудов»:
+        загрузки с собственным лимитом ниже равной доли получают свой лимит,
+        остаток поровну достаётся остальным
+        """
+        with self.lock:
+            active = [t for t in self.throttles if t.active]
+            idle = [t for t in self.throttles if not t.active]
+            remaining = self.global_rate
+            active.sort(key=lambda t: t.cap if t.cap else float('inf'))
+
+            for i, throttle in enumerate(active):
+                if remaining is None:
+                    share = throttle.cap
+                else:
+                    share = remaining / (len(active) - i)
+                    if throttle.cap:
+                        share = min(share, throttle.cap)
+                    remaining -= share
+                throttle._apply_rate(_as_rate(share))
+
+            # Неактивной загрузке при старте достаётся доля, как если бы она была активна
+            for throttle in idle:
+                share = self.global_rate / (len(active) + 1) if self.global_rate else None
+                if throttle.cap:
+                    share = min(share, throttle.cap) if share else throttle.cap
+                throttle._apply_rate(_as_rate(share))
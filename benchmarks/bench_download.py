@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Бенчмарк скачивания без сети на поддельном сервере VK/CDN (benchmarks/fake_server.py)
+Сценарии:
+  single      — download_vk_video, одно цельное видео
+  single-hls  — download_vk_video, одно видео HLS
+  batch       — download_batch, много коротких клипов (цельные и HLS вперемешку)
+  concurrent  — download_batch, несколько больших видео одновременно
+  mixed       — download_batch, много клипов и по одному большому видео на поток, равномерно по списку
+  gui         — DownloadThread графического интерфейса, одно цельное видео (нужен PyQt5)
+Каждый запуск сценария выполняется в отдельном процессе с пустой домашней папкой,
+поэтому процессорное время и пиковая память не смешиваются с сервером и друг с другом.
+Для сценария измеряются пропускная способность, время до первого байта
+(от начала сценария и медиана по видео от запроса страницы), медианное время
+от начала пакета до завершения видео, процессорное время на ГиБ и пиковый RSS. Результаты сохраняются в JSON (--json) и сравниваются
+с прошлым прогоном (--compare)
+Запуск: python benchmarks/bench_download.py [--scenario single batch] [--latency 20]
+        [--bandwidth 20M] [--error-rate 0.01] [--schedule fifo] [--json results.json]
+        [--compare old.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_server import FakeVKServer, add_server_arguments, config_from_args
+from format_policy import parse_size
+from version import __version__
+
+SCENARIOS = ('single', 'single-hls', 'batch', 'concurrent', 'mixed', 'gui')
+# Сценарии по умолчанию (gui требует PyQt5 и запускается явно)
+DEFAULT_SCENARIOS = ('single', 'single-hls', 'batch', 'concurrent')
+MIB = 1024 * 1024
+GIB = 1024 * MIB
+# Метрики сравнения: имя, подпись, True — больше значит лучше
+COMPARED_METRICS = (
+    ('throughput_mib_s', 'МиБ/с', True),
+    ('ttfb_s', 'до 1-го байта, с', False),
+    ('job_ttfb_median_s', 'до 1-го байта видео, с', False),
+    ('job_latency_median_s', 'до готовности видео, с', False),
+    ('cpu_s_per_gib', 'CPU с/ГиБ', False),
+    ('peak_rss_mib', 'RSS МиБ', False),
+)
+
+
+def big_videos(clips, workers):
+    """Номера больших видео сценария mixed: по одному на поток, равномерно по списку"""
+    step = (clips + workers) // workers
+    return {1 + i * step for i in range(workers)}
+
+def scenario_urls(server, scenario, clips, workers):
+    """Ссылки на страницы видео сценария"""
+    if scenario in ('single', 'gui'):
+        return [server.video_url(1)]
+    if scenario == 'single-hls':
+        return [server.video_url(1, hls=True)]
+    if scenario == 'mixed':
+        # При скачивании по порядку большие видео постепенно занимают все потоки и клипы ждут их
+        return [server.video_url(n) for n in range(1, workers + clips + 1)]
+    count = clips if scenario == 'batch' else workers
+    return [server.video_url(n, hls=n % 2 == 0) for n in range(1, count + 1)]
+
+def run_child(spec, verbose):
+    """Запускает сценарий в отдельном процессе и возвращает его измерения"""
+    with tempfile.TemporaryDirectory(prefix='vk_bench_') as tmp_dir:
+        home = os.path.join(tmp_dir, 'home')
+        os.makedirs(home)
+        spec = dict(spec, output_dir=os.path.join(tmp_dir, 'out'), result=os.path.join(tmp_dir, 'result.json'))
+        spec_path = os.path.join(tmp_dir, 'spec.json')
+        with open(spec_path, 'w', encoding='utf-8') as f:
+            json.dump(spec, f)
+        # Кэш, архив и журнал задач создаются в пустой домашней папке
+        env = dict(os.environ, HOME=home, USERPROFILE=home, QT_QPA_PLATFORM='offscreen')
+        output = None if verbose else subprocess.DEVNULL
+        code = subprocess.call([sys.executable, os.path.abspath(__file__), '--child', spec_path],
+                               env=env, stdout=output, stderr=output)
+        if not os.path.exists(spec['result']):
+            return {'error': f"процесс сценария завершился с кодом {code}"}
+        with open(spec['result'], encoding='utf-8') as f:
+            return json.load(f)
+
+def measure(server, scenario, args):
+    """Один запуск сценария: измерения процесса и счётчики сервера"""
+    server.config.media_size = args.clip_size if scenario in ('batch', 'mixed') else args.size
+    server.config.media_sizes = ({n: args.size for n in big_videos(args.clips, args.workers)}
+                                 if scenario == 'mixed' else {})
+    server.stats.reset()
+    urls = scenario_urls(server, scenario, args.clips, args.workers)
+    spec = {'scenario': scenario, 'urls': urls, 'workers': args.workers,
+            'connections': args.connections, 'engine': args.engine, 'schedule': args.schedule}
+    child = run_child(spec, args.verbose)
+    if 'error' in child:
+        return child
+    stats = server.stats.snapshot()
+
+    first_bytes = stats['first_bytes']
+    job_ttfb = [first_bytes[n] - stats['page_times'][n] for n in first_bytes if n in stats['page_times']]
+    result = {
+        'ok': child['ok'],
+        'failed': child['failed'],
+        'bytes': child['bytes'],
+        'seconds': child['seconds'],
+        'throughput_mib_s': child['bytes'] / MIB / child['seconds'] if child['seconds'] else None,
+        'ttfb_s': min(first_bytes.values()) - child['started'] if first_bytes else None,
+        'job_ttfb_median_s': statistics.median(job_ttfb) if job_ttfb else None,
+        'job_latency_median_s': child.get('job_latency_median_s'),
+        'cpu_s': child['cpu_s'],
+        'cpu_s_per_gib': child['cpu_s'] / (child['bytes'] / GIB) if child['bytes'] else None,
+        'peak_rss_mib': child['peak_rss_mib'],
+        'requests': stats['requests'],
+        'injected_errors': stats['errors'],
+        'served_bytes': stats['body_bytes'],
+    }
+    return result
+
+def median_result(runs):
+    """Медиана числовых метрик по повторам сценария"""
+    result = {}
+    for key in runs[0]:
+        values = [run[key] for run in runs if run.get(key) is not None]
+        result[key] = statistics.median(values) if values else None
+    return result
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def fmt(value, digits=2):
+    return '-' if value is None else f"{value:.{digits}f}"
+
+def print_results(results):
+    print(f"{'Сценарий':<12} {'ok/ошибок':>9} {'МиБ':>8} {'с':>7} {'МиБ/с':>8} {'1-й байт':>9} "
+          f"{'медиана':>8} {'готово':>8} {'CPU с/ГиБ':>10} {'RSS МиБ':>8} {'503':>5}")
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<12} {result['error']}")
+            continue
+        print(f"{name:<12} {result['ok']:>4.0f}/{result['failed']:<4.0f} {result['bytes'] / MIB:>8.1f} "
+              f"{result['seconds']:>7.2f} {fmt(result['throughput_mib_s']):>8} {fmt(result['ttfb_s'], 3):>9} "
+              f"{fmt(result['job_ttfb_median_s'], 3):>8} {fmt(result.get('job_latency_median_s')):>8} "
+              f"{fmt(result['cpu_s_per_gib']):>10} "
+              f"{fmt(result['peak_rss_mib'], 1):>8} {result['injected_errors']:>5.0f}")
+
+def print_comparison(old, new):
+    """Изменение метрик относительно прошлого прогона"""
+    print(f"\nСравнение с {old.get('version')} ({old.get('git') or '?'}, {old.get('timestamp')}):")
+    if old.get('server') != new['server'] or old.get('options') != new['options']:
+        print("  внимание: параметры сервера или сценариев отличаются, сравнение приблизительное")
+    for name, result in new['results'].items():
+        previous = old.get('results', {}).get(name)
+        if not previous or 'error' in previous or 'error' in result:
+            continue
+        changes = []
+        for key, label, higher_is_better in COMPARED_METRICS:
+            before, after = previous.get(key), result.get(key)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            better = change > 0 if higher_is_better else change < 0
+            mark = ('+' if better else '-') if abs(change) >= 5 else ' '
+            changes.append(f"{label} {fmt(before)}→{fmt(after)} ({change:+.0f}%){mark}")
+        print(f"  {name:<12} " + '; '.join(changes))
+
+
+def run_scenario(spec):
+    """Выполняется в процессе сценария; возвращает (успешно, ошибок)"""
+    from vk_video_downloader import (DownloadSettings, download_vk_video, download_batch, JobResult,
+                                     open_metadata_cache, open_download_archive, open_job_journal)
+    from bandwidth import BandwidthLimiter
+    from scheduler import JobScheduler
+
+    settings = DownloadSettings(
+        output_dir=spec['output_dir'],
+        connections=spec['connections'],
+        cache=open_metadata_cache(),
+        archive=open_download_archive(),
+        journal=open_job_journal(),
+        limiter=BandwidthLimiter(None, None),
+        scheduler=JobScheduler(spec['workers']) if spec['schedule'] == 'sjf' else None,
+    )
+    scenario = spec['scenario']
+    if scenario in ('single', 'single-hls'):
+        ok = download_vk_video(spec['urls'][0], settings)
+        return int(ok), int(not ok)
+    if scenario == 'gui':
+        return run_gui(spec, settings)
+
+    engine = None
+    if spec['engine'] == 'async':
+        from async_engine import AsyncEngine
+        engine = AsyncEngine(settings, spec['workers'])
+    results = download_batch(spec['urls'], spec['workers'], settings, engine)
+    if engine is not None:
+        engine.close()
+    ok = sum(1 for result in results if result.status == JobResult.OK)
+    return ok, len(results) - ok
+
+def run_gui(spec, settings):
+    """Скачивание потоком DownloadThread в цикле событий Qt, как в графическом интерфейсе"""
+    from PyQt5.QtCore import QCoreApplication
+    from vk_video_downloader_gui import DownloadThread
+    from session_pool import YoutubeDLPool
+
+    app = QCoreApplication([])
+    outcome = []
+    thread = DownloadThread(spec['urls'][0], spec['output_dir'], settings.journal, settings.limiter,
+                            YoutubeDLPool(max_idle=1), cache=settings.cache, archive=settings.archive)
+    thread.download_finished.connect(lambda success, message: (outcome.append(success), app.quit()))
+    thread.start()
+    app.exec_()
+    thread.wait()
+    return int(outcome == [True]), int(outcome != [True])
+
+def child_main(spec_path):
+    with open(spec_path, encoding='utf-8') as f:
+        spec = json.load(f)
+    # Импорт yt-dlp не входит в измерение
+    import yt_dlp  # noqa: F401
+    import vk_video_downloader  # noqa: F401
+
+    # Время завершения каждого видео берётся из строк метрик задач
+    from metrics import METRICS
+    METRICS.open_jsonl(spec['result'] + '.jobs')
+
+    started = time.time()
+    clock = time.perf_counter()
+    cpu = time.process_time()
+    ok, failed = run_scenario(spec)
+    seconds = time.perf_counter() - clock
+    cpu_s = time.process_time() - cpu
+
+    # Учитываются только готовые файлы: .part остаются от загрузок, завершившихся ошибкой
+    total = 0
+    for directory, _, files in os.walk(spec['output_dir']):
+        total += sum(os.path.getsize(os.path.join(directory, name)) for name in files
+                     if not name.endswith('.part'))
+    METRICS.close()
+    with open(spec['result'] + '.jobs', encoding='utf-8') as f:
+        latencies = [entry['time'] - started for entry in map(json.loads, f) if entry['status'] == 'ok']
+    with open(spec['result'], 'w', encoding='utf-8') as f:
+        json.dump({'ok': ok, 'failed': failed, 'bytes': total, 'seconds': seconds, 'started': started,
+                   'cpu_s': cpu_s, 'peak_rss_mib': peak_rss_mib(),
+                   'job_latency_median_s': statistics.median(latencies) if latencies else None}, f)
+
+def peak_rss_mib():
+    """Пиковый RSS текущего процесса в МиБ или None, если платформа его не сообщает"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux сообщает килобайты, macOS — байты
+    return peak / MIB if sys.platform == 'darwin' else peak / 1024
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк скачивания на поддельном сервере VK/CDN")
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=list(DEFAULT_SCENARIOS),
+                        help="сценарии (по умолчанию все, кроме gui)")
+    add_server_arguments(parser)
+    parser.add_argument('--clips', type=int, default=32, help="число клипов в сценариях batch и mixed")
+    parser.add_argument('--clip-size', type=parse_size, default=MIB,
+                        help="размер клипа в сценариях batch и mixed (по умолчанию 1M)")
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help="параллельных загрузок в batch и concurrent (по умолчанию 4)")
+    parser.add_argument('-n', '--connections', type=int, default=4,
+                        help="соединений на один файл (по умолчанию 4)")
+    parser.add_argument('--engine', choices=('threads', 'async'), default='threads',
+                        help="движок пакетного режима для batch и concurrent")
+    parser.add_argument('--schedule', choices=('sjf', 'fifo'), default='sjf',
+                        help="порядок скачивания в пакетных сценариях (по умолчанию sjf)")
+    parser.add_argument('--repeat', type=int, default=1, help="число повторов, берётся медиана")
+    parser.add_argument('--json', metavar='FILE', help="сохранить результаты в JSON")
+    parser.add_argument('--compare', metavar='FILE', help="сравнить с результатами прошлого прогона")
+    parser.add_argument('-v', '--verbose', action='store_true', help="показывать вывод сценариев")
+    parser.add_argument('--child', metavar='SPEC', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.child:
+        child_main(args.child)
+        sys.exit(0)
+
+    server = FakeVKServer(config_from_args(args)).start()
+    print(f"Сервер {server.base_url}: видео {args.size // MIB} МиБ, клипы {args.clip_size / MIB:g} МиБ, "
+          f"задержка {args.latency:g} мс, скорость соединения "
+          f"{f'{args.bandwidth / MIB:g} МиБ/с' if args.bandwidth else 'без ограничения'}, "
+          f"ошибок {args.error_rate:.0%}")
+    results = {}
+    for scenario in args.scenario:
+        runs = [measure(server, scenario, args) for _ in range(max(1, args.repeat))]
+        failed_runs = [run for run in runs if 'error' in run]
+        results[scenario] = failed_runs[0] if failed_runs else median_result(runs)
+    server.stop()
+
+    document = {
+        'version': __version__,
+        'git': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'server': dict(server.config.as_dict(), media_size=args.size, clip_size=args.clip_size),
+        'options': {'clips': args.clips, 'workers': args.workers, 'connections': args.connections,
+                    'engine': args.engine, 'schedule': args.schedule, 'repeat': args.repeat},
+        'results': results,
+    }
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(document, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.json}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), document)
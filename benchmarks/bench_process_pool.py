@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Сравнение извлечения информации о видео в потоках и в пуле рабочих процессов
+Локальный HTTP-сервер отдаёт тяжёлые HTML-страницы с видео, которые разбирает
+экстрактор generic yt-dlp. Кроме пропускной способности измеряется задержка
+«сердцебиения» — потока, который, как таймер прогресса GUI, просыпается каждые
+10 мс: чем сильнее извлечение занимает GIL, тем больше он опаздывает
+Запуск: python benchmarks/bench_process_pool.py [число страниц] [параллельных задач]
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from process_pool import WorkerProcessPool, default_processes
+from session_pool import YoutubeDLPool
+
+# Интервал «сердцебиения» в секундах
+HEARTBEAT_INTERVAL = 0.01
+# Число блоков разметки на странице (около 400 КБ HTML)
+PAGE_BLOCKS = 2000
+YDL_OPTS = {'quiet': True, 'noprogress': True, 'format': 'best', 'noplaylist': True}
+
+
+def make_page(number):
+    """Страница с видео, окружённым большим количеством разметки и скриптов"""
+    blocks = ''.join(
+        f'<div class="post" data-id="{number}_{i}"><a href="/wall-1_{i}">Запись {i}</a>'
+        f'<script>var cfg_{i} = {{"id": {i}, "title": "title {i}"}};</script></div>\n'
+        for i in range(PAGE_BLOCKS))
+    return (f'<html><head><title>Video {number}</title>'
+            f'<meta property="og:title" content="Video {number}"></head><body>{blocks}'
+            f'<video src="/video{number}.mp4"></video></body></html>').encode('utf-8')
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.page if self.path.startswith('/page') else b'\x00' * 1024
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html' if self.path.startswith('/page') else 'video/mp4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SilentLogger:
+    """Логгер, скрывающий предупреждения экстрактора generic"""
+
+    def debug(self, msg):
+        pass
+
+    info = warning = error = debug
+
+
+class Heartbeat:
+    """Поток, измеряющий опоздание пробуждений относительно HEARTBEAT_INTERVAL"""
+
+    def __init__(self):
+        self.delays = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.is_set():
+            started = time.perf_counter()
+            time.sleep(HEARTBEAT_INTERVAL)
+            self.delays.append(time.perf_counter() - started - HEARTBEAT_INTERVAL)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        delays = sorted(self.delays)
+        return delays[len(delays) // 2], delays[int(len(delays) * 0.99)], delays[-1]
+
+
+def extract_in_threads(urls, workers):
+    ydl_pool = YoutubeDLPool(max_idle=workers)
+
+    def extract(url):
+        with ydl_pool.lease(YDL_OPTS, logger=SilentLogger()) as ydl:
+            return ydl.extract_info(url, download=False)
+
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(extract, urls))
+
+def extract_in_processes(urls, workers, process_pool):
+    ydl_pool = YoutubeDLPool(max_idle=workers)
+
+    def extract(url):
+        with ydl_pool.lease(YDL_OPTS, logger=SilentLogger()) as ydl:
+            return process_pool.extract(ydl, url)
+
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(extract, urls))
+
+def run(name, func, urls, *args):
+    heartbeat = Heartbeat()
+    started = time.perf_counter()
+    results = func(urls, *args)
+    elapsed = time.perf_counter() - started
+    median, p99, worst = heartbeat.stop()
+    assert all(info.get('url') for info in results)
+    print(f"{name:10} {elapsed:7.2f} с  {len(urls) / elapsed:6.1f} стр/с  "
+          f"опоздание таймера: медиана {median * 1000:5.1f} мс, 99% {p99 * 1000:6.1f} мс, "
+          f"макс {worst * 1000:6.1f} мс")
+    return elapsed
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else default_processes()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    server.page = make_page(1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base}/page{i}.html" for i in range(count)]
+    print(f"Страниц: {count} по {len(server.page) // 1024} КБ, параллельных задач: {workers}, "
+          f"ядер: {default_processes()}")
+
+    process_pool = WorkerProcessPool(workers)
+    # Прогрев: запуск процессов и импорт yt-dlp не входят в измерение
+    extract_in_processes(urls[:workers], workers, process_pool)
+    extract_in_threads(urls[:1], 1)
+
+    threads = run("потоки", extract_in_threads, urls, workers)
+    processes = run("процессы", extract_in_processes, urls, workers, process_pool)
+    print(f"Ускорение: {threads / processes:.1f}x")
+    process_pool.close()
+    server.shutdown()
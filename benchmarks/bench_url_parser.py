@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Сравнение скорости разбора списка ссылок: normalize_vk_url и url_parser.parse_lines
+Запуск: python benchmarks/bench_url_parser.py [число строк]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vk_video_downloader import normalize_vk_url
+from url_parser import parse_lines
+
+# Шаблоны строк, похожие на выгрузку ссылок со страниц VK
+TEMPLATES = (
+    "https://vk.com/video-{owner}_{video}",
+    "https://m.vk.com/video{owner}_{video}?list=ln-abcdef",
+    "https://vkvideo.ru/video-{owner}_{video}",
+    "https://vk.com/clip-{owner}_{video}",
+    "https://vk.com/videos-{owner}?z=video-{owner}_{video}%2Fpl_cat_trends",
+    "-{owner}_{video}",
+    "https://vk.com/wall-{owner}_{video}",
+)
+
+
+def make_lines(count, seed=1):
+    """Синтетический список ссылок с повторами (около 10%)"""
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(count):
+        if lines and rng.random() < 0.1:
+            lines.append(rng.choice(lines))
+            continue
+        template = rng.choice(TEMPLATES)
+        lines.append(template.format(owner=rng.randint(1, 10 ** 9), video=rng.randint(1, 10 ** 9)))
+    return lines
+
+def bench_normalize(lines):
+    """Текущий способ: normalize_vk_url для каждой строки и дедупликация по строке"""
+    seen = set()
+    for line in lines:
+        try:
+            url = normalize_vk_url(line.strip())
+        except ValueError:
+            continue
+        if url:
+            seen.add(url)
+    return len(seen)
+
+def bench_parse_lines(lines):
+    """Новый способ: parse_lines с дедупликацией и подсчётом некорректных строк"""
+    invalid = []
+    count = sum(1 for _ in parse_lines(lines, lambda number, line: invalid.append(number)))
+    return count
+
+def run(name, func, lines, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(lines)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{name:20} {best:8.3f} с  {len(lines) / best / 1e6:6.2f} млн строк/с  (уникальных: {result})")
+    return best
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    lines = make_lines(count)
+    print(f"Строк: {count}")
+    old = run("normalize_vk_url", bench_normalize, lines)
+    new = run("parse_lines", bench_parse_lines, lines)
+    print(f"Ускорение: {old / new:.1f}x")
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Локальный сервер, заменяющий VK и CDN в бенчмарках
+Отдаёт страницы видео, которые разбирает экстрактор generic yt-dlp (экстрактор VK
+привязан к доменам vk.com и без сети не работает), цельные MP4 с поддержкой Range
+и HLS-плейлисты с фрагментами fMP4. Задержка ответа, пропускная способность
+соединения и доля ответов 503 настраиваются; сервер считает запросы, переданные
+байты и время первого байта каждого видео
+Запуск отдельно: python benchmarks/fake_server.py [--port 8800] [--latency 20] ...
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bandwidth import parse_rate
+from format_policy import parse_size
+
+# Размер блока записи ответа
+CHUNK_SIZE = 64 * 1024
+# Содержимое «видео»: повторяющийся мегабайт псевдослучайных байт
+PATTERN = random.Random(1).randbytes(1024 * 1024) if hasattr(random.Random, 'randbytes') \
+    else bytes(random.Random(1).getrandbits(8) for _ in range(1024 * 1024))
+# Длительность одного фрагмента HLS в секундах (для плейлиста)
+FRAGMENT_DURATION = 4.0
+
+RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)$')
+MEDIA_RE = re.compile(r'/media/(\d+)\.mp4$')
+FRAGMENT_RE = re.compile(r'/hls/(\d+)/(init\.mp4|seg(\d+)\.m4s)$')
+
+
+class ServerConfig:
+    """
+    Параметры поддельного сервера
+
+    latency — задержка перед каждым ответом в секундах; bandwidth — скорость
+    одного соединения в байтах/с (None — без ограничения); error_rate — доля
+    запросов медиаданных, на которые отвечается 503. media_sizes задаёт размер
+    отдельных видео по номеру вместо media_size
+    """
+
+    def __init__(self, media_size=16 * 1024 * 1024, fragment_size=512 * 1024, latency=0.0,
+                 bandwidth=None, error_rate=0.0, seed=1):
+        self.media_size = media_size
+        self.fragment_size = fragment_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.seed = seed
+        self.media_sizes = {}
+
+    def size_of(self, number):
+        return self.media_sizes.get(number, self.media_size)
+
+    def fragment_count(self, number=None):
+        return max(1, -(-self.size_of(number) // self.fragment_size))
+
+    def as_dict(self):
+        # Размеры отдельных видео задаёт сценарий бенчмарка, в параметры сервера они не входят
+        return {key: value for key, value in vars(self).items() if key != 'media_sizes'}
+
+
+class ServerStats:
+    """Счётчики запросов сервера; потокобезопасны"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+            self.body_bytes = 0
+            # Номер видео → время (time.time) первого запроса страницы и первого байта медиаданных
+            self.page_times = {}
+            self.first_bytes = {}
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'body_bytes': self.body_bytes,
+                'page_times': dict(self.page_times),
+                'first_bytes': dict(self.first_bytes),
+            }
+
+
+def media_bytes(offset, length):
+    """Фрагмент содержимого «видео» начиная с offset"""
+    chunks = []
+    while length > 0:
+        start = offset % len(PATTERN)
+        piece = PATTERN[start:start + length]
+        chunks.append(piece)
+        offset += len(piece)
+        length -= len(piece)
+    return b''.join(chunks)
+
+def progressive_page(number):
+    return (f'<html><head><title>Video {number}</title>'
+            f'<meta property="og:title" content="Video {number}"></head><body>'
+            f'<video src="/media/{number}.mp4"></video></body></html>').encode('utf-8')
+
+def hls_page(number):
+    return (f'<html><head><title>Clip {number}</title>'
+            f'<meta property="og:title" content="Clip {number}"></head><body>'
+            f'<video><source src="/hls/{number}/index.m3u8" type="application/x-mpegURL"></video>'
+            f'</body></html>').encode('utf-8')
+
+def hls_playlist(number, config):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', f'#EXT-X-TARGETDURATION:{int(FRAGMENT_DURATION)}',
+             '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-PLAYLIST-TYPE:VOD', '#EXT-X-MAP:URI="init.mp4"']
+    for index in range(config.fragment_count(number)):
+        lines += [f'#EXTINF:{FRAGMENT_DURATION:.1f},', f'seg{index}.m4s']
+    lines.append('#EXT-X-ENDLIST')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class FakeVKHandler(BaseHTTPRequestHandler):
+    # Keep-alive, как у настоящего CDN: все ответы содержат Content-Length
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        server = self.server
+        config = server.config
+        path = self.path.split('?', 1)[0]
+        if config.latency:
+            time.sleep(config.latency)
+        with server.stats.lock:
+            server.stats.requests += 1
+
+        page = re.match(r'/(video|hls)/(\d+)\.html$', path)
+        if page:
+            number = int(page.group(2))
+            with server.stats.lock:
+                server.stats.page_times.setdefault(number, time.time())
+            body = progressive_page(number) if page.group(1) == 'video' else hls_page(number)
+            return self.send_body(200, body, 'text/html; charset=utf-8', send_body)
+
+        playlist = re.match(r'/hls/(\d+)/index\.m3u8$', path)
+        if playlist:
+            return self.send_body(200, hls_playlist(int(playlist.group(1)), config),
+                                  'application/vnd.apple.mpegurl', send_body)
+
+        media = MEDIA_RE.match(path)
+        fragment = FRAGMENT_RE.match(path)
+        if not media and not fragment:
+            return self.send_body(404, b'not found', 'text/plain', send_body)
+        if server.inject_error():
+            with server.stats.lock:
+                server.stats.errors += 1
+            return self.send_body(503, b'overloaded', 'text/plain', send_body)
+
+        if media:
+            number = int(media.group(1))
+            size, offset = config.size_of(number), 0
+        elif fragment.group(2) == 'init.mp4':
+            number, size, offset = int(fragment.group(1)), 1024, 0
+        else:
+            number, size = int(fragment.group(1)), config.fragment_size
+            offset = 1024 + int(fragment.group(3)) * config.fragment_size
+        self.send_media(number, size, offset, send_body)
+
+    def send_body(self, status, body, content_type, send_body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_media(self, number, size, base_offset, send_body):
+        start, end = 0, size - 1
+        match = RANGE_RE.match(self.headers.get('Range') or '')
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if not send_body:
+            return
+
+        bandwidth = self.server.config.bandwidth
+        started = time.monotonic()
+        sent = 0
+        position = start
+        while position <= end:
+            chunk = media_bytes(base_offset + position, min(CHUNK_SIZE, end - position + 1))
+            try:
+                self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            stats = self.server.stats
+            with stats.lock:
+                if sent == 0:
+                    stats.first_bytes.setdefault(number, time.time())
+                stats.body_bytes += len(chunk)
+            sent += len(chunk)
+            position += len(chunk)
+            if bandwidth:
+                # Выдерживаем заданную скорость соединения
+                delay = sent / bandwidth - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeVKServer(ThreadingHTTPServer):
+    """Поддельный сервер VK/CDN в фоновом потоке; base_url — адрес вида http://127.0.0.1:порт"""
+
+    daemon_threads = True
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        super().__init__((host, port), FakeVKHandler)
+        self.config = config or ServerConfig()
+        self.stats = ServerStats()
+        self.random = random.Random(self.config.seed)
+        self.random_lock = threading.Lock()
+        self.base_url = f"http://{host}:{self.server_address[1]}"
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def inject_error(self):
+        if not self.config.error_rate:
+            return False
+        with self.random_lock:
+            return self.random.random() < self.config.error_rate
+
+    def video_url(self, number, hls=False):
+        """Ссылка на страницу видео: цельный MP4 или HLS"""
+        return f"{self.base_url}/{'hls' if hls else 'video'}/{number}.html"
+
+
+def add_server_arguments(parser):
+    """Ключи настройки сервера, общие для бенчмарков и отдельного запуска"""
+    parser.add_argument('--size', type=parse_size, default=16 * 1024 * 1024,
+                        help="размер одного видео, например 64M (по умолчанию 16M)")
+    parser.add_argument('--fragment-size', type=parse_size, default=512 * 1024,
+                        help="размер фрагмента HLS (по умолчанию 512K)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="задержка перед каждым ответом в миллисекундах")
+    parser.add_argument('--bandwidth', type=parse_rate, metavar='RATE',
+                        help="скорость одного соединения, например 20M")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="доля запросов медиаданных, на которые отвечается 503 (0..1)")
+    parser.add_argument('--seed', type=int, default=1, help="начальное значение генератора ошибок")
+
+def config_from_args(args):
+    return ServerConfig(args.size, args.fragment_size, args.latency / 1000, args.bandwidth,
+                        args.error_rate, args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Поддельный сервер VK/CDN для бенчмарков")
+    parser.add_argument('--port', type=int, default=8800, help="порт (по умолчанию 8800)")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    server = FakeVKServer(config_from_args(args), port=args.port)
+    print(f"Сервер запущен: {server.video_url(1)} (MP4), {server.video_url(1, hls=True)} (HLS)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
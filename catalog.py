@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Каталог видео без скачивания: индекс метаданных в формате JSONL
+Информация о видео извлекается пулом потоков (extract_info с download=False),
+и на каждую входную ссылку в файл дописывается одна строка JSON — название,
+длительность, владелец и список форматов с размерами, либо текст ошибки.
+Строки пишутся в порядке входных ссылок сразу, как только готовы все
+предыдущие, поэтому повторный запуск с тем же списком продолжает индекс
+с первой ненаписанной строки. В памяти одновременно держится не больше
+окна из workers * WINDOW_PER_WORKER задач, сколько бы видео ни было в списке
+"""
+
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from format_policy import estimate_sizes, format_size
+from url_parser import parse_video_ref
+
+# Поля info-словаря yt-dlp, попадающие в запись каталога
+INFO_FIELDS = ('title', 'duration', 'uploader', 'upload_date', 'timestamp', 'view_count')
+# Поля формата, попадающие в запись каталога (ссылки на CDN не сохраняются: они быстро истекают)
+FORMAT_FIELDS = ('format_id', 'ext', 'protocol', 'width', 'height', 'fps', 'vcodec', 'acodec', 'tbr')
+# Задач на один рабочий поток, которые могут ждать записи, пока не готова более ранняя строка
+WINDOW_PER_WORKER = 4
+
+
+def catalog_record(url, info):
+    """Компактная запись каталога по info-словарю yt-dlp"""
+    ref = parse_video_ref(url)
+    record = {'url': url, 'id': info.get('id'),
+              'owner_id': int(ref.owner_id) if ref is not None else info.get('uploader_id')}
+    for field in INFO_FIELDS:
+        if info.get(field) is not None:
+            record[field] = info[field]
+    record = {key: value for key, value in record.items() if value is not None}
+
+    formats = [dict(f) for f in info.get('formats') or [info]]
+    # Цельные MP4 VK приходят без размера; оценка берётся у форматов той же высоты
+    estimate_sizes(formats)
+    record['formats'] = []
+    for fmt in formats:
+        entry = {field: fmt[field] for field in FORMAT_FIELDS if fmt.get(field) is not None}
+        size = format_size(fmt)
+        if size:
+            entry['filesize' if fmt.get('filesize') else 'filesize_approx'] = int(size)
+        record['formats'].append(entry)
+    return record
+
+def error_record(url, error):
+    """Запись каталога для ссылки, информацию о которой получить не удалось"""
+    return {'url': url, 'error': str(error)}
+
+
+class CatalogWriter:
+    """
+    Дозапись строк каталога в файл JSONL
+
+    При открытии существующего файла считает записанные строки (done) и запоминает
+    ссылку последней из них (last_url); недописанная последняя строка прерванного
+    запуска отрезается. Каждая строка сбрасывается в ОС сразу после записи
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = 0
+        self.last_url = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path):
+            self._scan()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self.file.flush()
+        self.done += 1
+        self.last_url = record.get('url')
+
+    def close(self):
+        self.file.close()
+
+    def _scan(self):
+        """Читает файл построчно, не загружая его в память целиком"""
+        complete = 0
+        last_line = None
+        with open(self.path, 'rb+') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                complete += len(line)
+                self.done += 1
+                last_line = line
+            if f.tell() != complete:
+                f.truncate(complete)
+        if last_line is not None:
+            try:
+                self.last_url = json.loads(last_line).get('url')
+            except ValueError:
+                self.last_url = None
+
+
+def build_catalog(items, extract, writer, workers, on_record=None):
+    """
+    Дописывает в writer (CatalogWriter) по строке на каждую ссылку из items
+
+    items — итерируемый набор пар (ссылка, ошибка), читается лениво; для пар
+    без ошибки extract(ссылка) в одном из workers потоков возвращает info-словарь.
+    Первые writer.done ссылок уже есть в каталоге и пропускаются. on_record(номер,
+    запись) вызывается после записи каждой строки. Возвращает число новых записей
+    и число записей с ошибкой
+    """
+    def run(url):
+        try:
+            return catalog_record(url, extract(url))
+        except Exception as e:
+            return error_record(url, e)
+
+    skip = writer.done
+    window = max(1, workers) * WINDOW_PER_WORKER
+    # Задачи в порядке входных ссылок: готовая запись или Future
+    pending = deque()
+    written = failed = 0
+
+    def write_ready(keep):
+        """Записывает готовые строки по порядку, дожидаясь их, пока в очереди больше keep задач"""
+        nonlocal written, failed
+        while pending and (len(pending) > keep or isinstance(pending[0], dict) or pending[0].done()):
+            item = pending.popleft()
+            record = item if isinstance(item, dict) else item.result()
+            writer.write(record)
+            written += 1
+            failed += 'error' in record
+            if on_record is not None:
+                on_record(writer.done, record)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for index, (url, error) in enumerate(items, 1):
+            if index <= skip:
+                if index == skip and url != writer.last_url:
+                    print(f"Внимание: строка {skip} каталога относится к {writer.last_url}, а не к {url}; "
+                          "список ссылок изменился с прошлого запуска")
+                continue
+            pending.append(error_record(url, error) if error else executor.submit(run, url))
+            write_ready(window - 1)
+        write_ready(0)
+    return written, failed
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Хеш содержимого скачанных файлов и хранилище с дедупликацией
+Хеш считается по мере записи данных на диск, без повторного чтения файла.
+Части файла приходят из нескольких соединений не по порядку, поэтому файл
+делится на блоки HASH_BLOCK_SIZE: каждый блок хешируется SHA-256 отдельно,
+а хеш файла — SHA-256 от последовательности хешей блоков (та же схема, что у
+content_hash Dropbox). Хранилище держит по одному объекту на хеш — собственную
+копию файла только для чтения (reflink или полное копирование) — и заменяет
+скачанные файлы ссылками на него (reflink, если файловая система его
+поддерживает, иначе жёсткая ссылка). Манифест сопоставляет owner_id_video_id с хешем
+"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: reflink недоступен, остаются жёсткие ссылки
+    fcntl = None
+
+from download_archive import VIDEO_ID_RE
+
+# Размер блока, хешируемого отдельно
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+# Размер блока чтения при хешировании готовых файлов
+READ_SIZE = 1024 * 1024
+# ioctl FICLONE Linux: копия файла с общими блоками данных (btrfs, XFS)
+FICLONE = 0x40049409
+# Ошибки, означающие, что ссылку в этом месте создать нельзя (другая файловая система и т.п.)
+LINK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EMLINK)
+
+
+class ContentHasher:
+    """
+    Хеш файла, данные которого записываются по произвольным смещениям
+
+    update(offset, data) можно вызывать из нескольких потоков. Данные одного
+    блока, пришедшие раньше предыдущих, ждут в памяти, пока блок не заполнится
+    по порядку; обычно это только стыки частей файла
+    """
+
+    def __init__(self, block_size=HASH_BLOCK_SIZE):
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.blocks = {}     # индекс блока → [hashlib-объект, следующее смещение]
+        self.pending = {}    # индекс блока → {смещение: данные}
+        self.digests = {}    # индекс блока → хеш завершённого блока
+        # Данные перезаписаны или пришли повторно: хеш по ходу записи не получить
+        self.broken = False
+
+    def update(self, offset, data):
+        view = memoryview(data)
+        with self.lock:
+            while view:
+                index = offset // self.block_size
+                piece = view[:(index + 1) * self.block_size - offset]
+                self._feed(index, offset, piece)
+                offset += len(piece)
+                view = view[len(piece):]
+
+    def hexdigest(self, size):
+        """Хеш файла размером size или None, если записаны не все его байты"""
+        with self.lock:
+            if self.broken:
+                return None
+            digests = []
+            for index in range(-(-size // self.block_size)):
+                if index in self.digests:
+                    digests.append(self.digests[index])
+                    continue
+                state = self.blocks.get(index)
+                # Последний блок файла короче остальных
+                if state is None or state[1] != size:
+                    return None
+                digests.append(state[0].digest())
+            return hashlib.sha256(b''.join(digests)).hexdigest()
+
+    def _feed(self, index, offset, piece):
+        if index in self.digests:
+            self.broken = True
+            return
+        state = self.blocks.setdefault(index, [hashlib.sha256(), index * self.block_size])
+        if offset != state[1]:
+            pending = self.pending.setdefault(index, {})
+            if offset < state[1] or offset in pending:
+                self.broken = True
+            else:
+                pending[offset] = bytes(piece)
+            return
+        state[0].update(piece)
+        state[1] += len(piece)
+        pending = self.pending.get(index)
+        while pending and state[1] in pending:
+            data = pending.pop(state[1])
+            state[0].update(data)
+            state[1] += len(data)
+        if pending is not None and not pending:
+            del self.pending[index]
+        if state[1] == (index + 1) * self.block_size:
+            self.digests[index] = state[0].digest()
+            del self.blocks[index]
+
+
+def hash_file(path):
+    """Хеш готового файла по той же схеме, что и ContentHasher (с чтением файла)"""
+    hasher = ContentHasher()
+    offset = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                break
+            hasher.update(offset, chunk)
+            offset += len(chunk)
+    return hasher.hexdigest(offset)
+
+def manifest_key(video_url, info):
+    """Ключ манифеста owner_id_video_id по нормализованному URL или ID из info-словаря"""
+    match = VIDEO_ID_RE.match(video_url or '')
+    return match.group(1) if match else info.get('id')
+
+
+class ContentStore:
+    """
+    Хранилище объектов по хешу содержимого
+
+    objects/ab/<хеш> — по одному объекту на содержимое, manifest.jsonl — строка
+    {"key", "hash", "size", "path", "time"} на каждый добавленный файл.
+    Манифест при открытии целиком загружается в словарь ключ → хеш.
+    Объект никогда не делит inode с файлом, из которого создан, поэтому правка
+    этого файла на месте не меняет объект; жёсткие ссылки на объект, как и он сам,
+    доступны только для чтения
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.manifest_path = os.path.join(root, 'manifest.jsonl')
+        self.lock = threading.Lock()
+        self.hashes = {}
+        os.makedirs(self.objects_dir, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Строка, недописанная при аварийном завершении
+                        continue
+                    self.hashes[entry['key']] = entry['hash']
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def object_path(self, content_hash):
+        return os.path.join(self.objects_dir, content_hash[:2], content_hash)
+
+    def add(self, path, key, content_hash=None):
+        """
+        Добавляет скачанный файл path под ключом key
+
+        content_hash — хеш, посчитанный при скачивании; без него файл читается
+        целиком. Если объекта с таким содержимым ещё нет, он создаётся копией файла
+        (reflink, а без его поддержки — полной копией), а сам файл остаётся отдельным.
+        Файл с уже известным содержимым заменяется ссылкой на объект; если ссылку
+        создать нельзя (другой диск), он остаётся как есть. Ошибка создания объекта (например, нехватка
+        места) вызывает OSError, и файл не попадает в манифест. Возвращает True,
+        если файл заменён ссылкой на уже существовавший объект (место освобождено)
+        """
+        content_hash = content_hash or hash_file(path)
+        target = self.object_path(content_hash)
+        size = os.path.getsize(path)
+        deduplicated = False
+        with self.lock:
+            existed = os.path.exists(target) and os.path.getsize(target) == size
+            if not existed:
+                # Объекта нет или он повреждён (другой размер)
+                _store_object(path, target)
+            if not os.path.samefile(path, target):
+                # Файл, из которого объект только что создан, заменяется только reflink-копией:
+                # жёсткая ссылка снова связала бы его с объектом
+                deduplicated = _replace_with_link(target, path, hardlink=existed) and existed
+            with open(self.manifest_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'key': key, 'hash': content_hash, 'size': size,
+                                    'path': os.path.abspath(path), 'time': time.time()},
+                                   ensure_ascii=False) + '\n')
+            self.hashes[key] = content_hash
+        return deduplicated
+
+    def verify(self, key):
+        """Проверяет, что объект ключа key не изменился; None, если ключа или объекта нет"""
+        content_hash = self.hashes.get(key)
+        if content_hash is None or not os.path.exists(self.object_path(content_hash)):
+            return None
+        return hash_file(self.object_path(content_hash)) == content_hash
+
+
+def _store_object(src, target):
+    """Создаёт объект target — независимую копию src (reflink или копирование) только для чтения"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = target + '.tmp'
+    _remove_stale(tmp_path)
+    try:
+        if not _clone(src, tmp_path):
+            shutil.copyfile(src, tmp_path)
+        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp_path, target)
+    except BaseException:
+        _remove_stale(tmp_path)
+        raise
+
+def _replace_with_link(target, path, hardlink=True):
+    """
+    Заменяет файл path ссылкой на объект target; False, если ссылку создать нельзя
+
+    hardlink=False допускает только reflink-копию
+    """
+    # Ссылка создаётся рядом и атомарно подменяет файл
+    tmp_path = path + '.dedup'
+    _remove_stale(tmp_path)
+    if not (_link(target, tmp_path) if hardlink else _clone(target, tmp_path)):
+        return False
+    os.replace(tmp_path, path)
+    return True
+
+def _remove_stale(path):
+    """Удаляет файл, оставшийся от прерванной операции"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _clone(src, dst):
+    """Создаёт dst как reflink-копию src (общие блоки данных); False, если ФС это не поддерживает"""
+    if fcntl is None:
+        return False
+    with open(src, 'rb') as source, open(dst, 'xb') as target:
+        try:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            return True
+        except OSError as e:
+            error = e
+    # Пустой файл, созданный для клонирования, не нужен
+    os.remove(dst)
+    if error.errno not in LINK_ERRORS:
+        raise error
+    return False
+
+def _link(src, dst):
+    """Создаёт dst с содержимым src без копирования данных; False, если это невозможно"""
+    if _clone(src, dst):
+        return True
+    try:
+        os.link(src, dst)
+        return True
+    except OSError as e:
+        if e.errno not in LINK_ERRORS:
+            raise
+        return False
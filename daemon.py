@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Фоновый режим без графического интерфейса
+Один «тёплый» процесс с общими пулами соединений, кэшем и архивом принимает
+задачи через локальный HTTP/JSON API и передаёт прогресс через Server-Sent Events
+
+    POST /jobs                {"url": "...", "output_dir": "...", "priority": 0}  — добавить задачу
+    GET  /jobs                                                    — список задач
+    GET  /jobs/<id>                                               — состояние задачи
+    POST /jobs/<id>/pause | /resume | /cancel                     — управление задачей
+    GET  /events                                                  — поток событий (SSE)
+    GET  /metrics                                                 — метрики в формате Prometheus
+    GET  /scheduler                                               — очередь слотов скачивания
+"""
+
+import json
+import queue
+import threading
+import time
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from vk_video_downloader import (DEFAULT_WORKERS, DownloadSettings, JobResult, import_yt_dlp,
+                                 normalize_vk_url, build_ydl_opts, _download_job)
+from download_archive import video_key
+from metrics import METRICS, PROMETHEUS_CONTENT_TYPE
+from playlists import is_playlist_url, iter_playlist
+from progress_channel import ProgressSnapshot
+from transfer_control import TransferControl
+from scheduler import LOOKAHEAD
+from session_pool import YoutubeDLPool
+from url_parser import parse_video_ref
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8750
+# Минимальный интервал между событиями прогресса одной задачи, секунд
+PROGRESS_EVENT_INTERVAL = 0.5
+# Максимальное число событий в очереди одного подписчика; медленный подписчик теряет старые события
+MAX_SUBSCRIBER_EVENTS = 1000
+# Интервал комментариев-пингов в потоке событий, секунд
+KEEPALIVE_INTERVAL = 15
+# Сколько завершённых задач хранить для запросов состояния
+MAX_FINISHED_JOBS = 1000
+
+# Состояния задач
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+SKIPPED = 'skipped'
+FINISHED_STATES = (DONE, FAILED, CANCELLED, SKIPPED)
+
+
+class EventBus:
+    """Рассылка событий подписчикам потока /events"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = []
+
+    def subscribe(self):
+        subscriber = queue.Queue(MAX_SUBSCRIBER_EVENTS)
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def publish(self, event, data):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                # Освобождаем место, отбрасывая самое старое событие
+                try:
+                    subscriber.get_nowait()
+                    subscriber.put_nowait((event, data))
+                except (queue.Empty, queue.Full):
+                    pass
+
+
+class Job:
+    """Задача фонового режима"""
+
+    def __init__(self, job_id, url, output_dir=None, parent_id=None, priority=0):
+        self.id = job_id
+        self.url = url
+        self.output_dir = output_dir
+        self.parent_id = parent_id
+        # Больше — раньше получает слот скачивания (при планировщике settings.scheduler)
+        self.priority = priority
+        self.state = QUEUED
+        self.message = None
+        self.progress = ProgressSnapshot(QUEUED)
+        self.created_at = time.time()
+        self.finished_at = None
+        self.last_event = 0.0
+        self.cancelled = False
+        self.parked = False
+        self.resume_event = threading.Event()
+        self.resume_event.set()
+        # Пауза и отмена запущенной загрузки с закрытием её соединений
+        self.control = TransferControl()
+        # Длительность этапов (metrics.JobMetrics)
+        self.metrics = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'url': self.url,
+            'output_dir': self.output_dir,
+            'parent_id': self.parent_id,
+            'priority': self.priority,
+            'state': self.state,
+            'message': self.message,
+            'downloaded_bytes': self.progress.downloaded,
+            'total_bytes': self.progress.total,
+            'speed': self.progress.speed,
+            'eta': self.progress.eta,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobManager:
+    """Очередь задач, выполняемых пулом потоков в одном процессе"""
+
+    def __init__(self, settings=None, workers=DEFAULT_WORKERS):
+        self.settings = settings or DownloadSettings()
+        self.workers = max(1, workers)
+        self.yt_dlp = import_yt_dlp()
+        if self.yt_dlp is None:
+            raise RuntimeError("yt-dlp недоступен")
+        # С планировщиком часть потоков заранее извлекает информацию, пока workers задач скачивают
+        threads = self.workers * (1 + LOOKAHEAD) if self.settings.scheduler is not None else self.workers
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        if self.settings.ydl_pool is None:
+            self.settings.ydl_pool = YoutubeDLPool(self.yt_dlp, max_idle=threads)
+        self.events = EventBus()
+        self.lock = threading.Lock()
+        self.jobs = {}
+        # Незавершённые задачи по нормализованной ссылке: повторная ссылка не запускает вторую
+        # загрузку в тот же файл (с тем же .part-файлом и записью журнала)
+        self.active = {}
+        self.ids = itertools.count(1)
+        # Раскрытие плейлистов ждёт, пока в очереди не освободится место
+        self.queue_slots = threading.BoundedSemaphore(threads + self.workers)
+        # Сервер останавливается: новые загрузки не начинаются
+        self.closing = False
+
+    def submit(self, url, output_dir=None, parent_id=None, priority=0):
+        """
+        Добавляет задачу; возвращает пару (Job, True) или вызывает ValueError для некорректной ссылки
+
+        Если это видео уже в очереди или скачивается, новая задача не создаётся
+        и возвращается (существующая Job, False)
+        """
+        metrics = METRICS.job(url)
+        with metrics.phase('normalize'):
+            ref = parse_video_ref(url)
+            normalized_url = ref.url if ref is not None else normalize_vk_url(url)
+        if not normalized_url:
+            metrics.finish(JobResult.FAILED, error_class_name='InvalidURL')
+            raise ValueError(f"Некорректный URL: {url}")
+
+        with self.lock:
+            existing = self.active.get(normalized_url)
+            if existing is None:
+                job = Job(next(self.ids), normalized_url, output_dir or self.settings.output_dir, parent_id,
+                          priority)
+                job.metrics = metrics
+                self.jobs[job.id] = job
+                self.active[normalized_url] = job
+                self._forget_finished()
+        if existing is not None:
+            metrics.finish(JobResult.SKIPPED)
+            if parent_id is not None:
+                self.queue_slots.release()
+            return existing, False
+        self._publish_state(job)
+
+        archive = self.settings.archive
+        if archive is not None and video_key(normalized_url) in archive:
+            metrics.finish(JobResult.SKIPPED)
+            self._finish(job, SKIPPED, "Уже скачано")
+            if parent_id is not None:
+                self.queue_slots.release()
+        elif is_playlist_url(normalized_url):
+            # Вложенный плейлист не занимает место в очереди: его видео займут свои места сами
+            if parent_id is not None:
+                self.queue_slots.release()
+            # Отдельный поток: раскрытие ждёт освобождения очереди и не должно занимать загрузчик
+            threading.Thread(target=self._expand, args=(job,), daemon=True).start()
+        else:
+            self.executor.submit(self._run, job)
+        return job, True
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def pause(self, job):
+        if job.state in (QUEUED, RUNNING):
+            with self.lock:
+                job.resume_event.clear()
+            job.control.pause()
+            job.state = PAUSED
+            self._publish_state(job)
+
+    def resume(self, job):
+        if job.state != PAUSED:
+            return
+        job.state = RUNNING if job.progress.status != QUEUED else QUEUED
+        self._publish_state(job)
+        self._release(job)
+
+    def cancel(self, job):
+        if job.state in FINISHED_STATES:
+            return
+        job.cancelled = True
+        job.control.cancel()
+        if job.state in (QUEUED, PAUSED) and job.progress.status == QUEUED:
+            self._finish(job, CANCELLED, "Отменено пользователем")
+        self._release(job)
+
+    def scheduler_stats(self):
+        """Статистика очереди слотов скачивания или None, если задачи выполняются по порядку"""
+        scheduler = self.settings.scheduler
+        return scheduler.stats() if scheduler is not None else None
+
+    def shutdown(self):
+        """
+        Прерывает задачи и дожидается остановки потоков
+
+        Загрузки прерываются, а не отменяются: .part-файлы и записи журнала
+        сохраняются, и при следующем запуске задачи продолжатся. Задачи из очереди
+        записываются в журнал незавершёнными, не начиная скачивания
+        """
+        self.closing = True
+        for job in self.list():
+            if job.state not in FINISHED_STATES:
+                job.control.interrupt()
+                job.resume_event.set()
+        self.executor.shutdown(wait=True)
+
+    def _release(self, job):
+        """Снимает паузу; задача, отложенная во время паузы, снова ставится в очередь"""
+        with self.lock:
+            job.resume_event.set()
+            job.control.resume()
+            parked, job.parked = job.parked, False
+        if parked:
+            self.executor.submit(self._run, job)
+
+    def _expand(self, job):
+        """Раскрывает плейлист постранично, добавляя видео как отдельные задачи"""
+        job.metrics.begin()
+        job.state = RUNNING
+        job.progress = ProgressSnapshot(RUNNING)
+        self._publish_state(job)
+        count = 0
+        ydl_opts = dict(build_ydl_opts(job.output_dir, retry_policy=self.settings.retry_policy), quiet=True,
+                        noprogress=True)
+        try:
+            with self.settings.ydl_pool.lease(ydl_opts) as ydl:
+                for entry_url in iter_playlist(ydl, job.url):
+                    job.resume_event.wait()
+                    if job.cancelled or self.closing:
+                        break
+                    # Не забираем следующую страницу, пока очередь заполнена
+                    self.queue_slots.acquire()
+                    try:
+                        _, created = self.submit(entry_url, job.output_dir, job.id, job.priority)
+                    except ValueError:
+                        self.queue_slots.release()
+                        continue
+                    count += created
+        except Exception as e:
+            job.metrics.finish(JobResult.FAILED, e)
+            self._finish(job, FAILED, f"Не удалось получить список видео: {e}")
+            return
+        job.metrics.finish(CANCELLED if job.cancelled else JobResult.OK)
+        self._finish(job, CANCELLED if job.cancelled else DONE, f"Добавлено задач: {count}")
+
+    def _run(self, job):
+        with self.lock:
+            if not job.resume_event.is_set():
+                # Приостановленная до начала задача не занимает поток, пока её не возобновят
+                job.parked = True
+                return
+        try:
+            if job.cancelled:
+                job.metrics.finish(CANCELLED)
+                return
+            if self.closing:
+                # Задача продолжится при следующем запуске вместе с прерванными загрузками
+                journal = self.settings.journal
+                if journal is not None and self.settings.sink is None:
+                    journal.begin(job.url, job.output_dir)
+                job.metrics.finish(CANCELLED)
+                return
+            job.state = RUNNING
+            job.progress = ProgressSnapshot(RUNNING)
+            self._publish_state(job)
+
+            result = _download_job(self.yt_dlp, job.url, job.output_dir, self.settings,
+                                   progress_hooks=[lambda d: self._progress_hook(job, d)],
+                                   metrics=job.metrics, control=job.control, priority=job.priority)
+            if job.cancelled:
+                self._finish(job, CANCELLED, "Отменено пользователем")
+            elif job.control.interrupted:
+                self._finish(job, CANCELLED, "Прервано остановкой сервера")
+            elif result.status == JobResult.OK:
+                self._finish(job, DONE, result.message)
+            else:
+                self._finish(job, FAILED, result.message)
+        finally:
+            if job.parent_id is not None:
+                self.queue_slots.release()
+
+    def _progress_hook(self, job, d):
+        # Паузу и отмену выполняет job.control: загрузка на паузе не держит соединений
+        job.progress = ProgressSnapshot.from_hook(d)
+        now = time.monotonic()
+        if d['status'] == 'finished' or now - job.last_event >= PROGRESS_EVENT_INTERVAL:
+            job.last_event = now
+            self.events.publish('progress', job.to_dict())
+
+    def _finish(self, job, state, message=None):
+        job.state = state
+        job.message = message
+        job.finished_at = time.time()
+        with self.lock:
+            if self.active.get(job.url) is job:
+                del self.active[job.url]
+        self._publish_state(job)
+
+    def _publish_state(self, job):
+        self.events.publish('state', job.to_dict())
+
+    def _forget_finished(self):
+        """Удаляет самые старые завершённые задачи сверх MAX_FINISHED_JOBS"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+
+class APIRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов HTTP/JSON API"""
+
+    server_version = 'vk_video_downloader'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def manager(self):
+        return self.server.manager
+
+    def do_GET(self):
+        path = urlsplit(self.path).path.rstrip('/')
+        if path == '/jobs':
+            self._send_json(200, [job.to_dict() for job in self.manager.list()])
+        elif path == '/events':
+            self._stream_events()
+        elif path == '/scheduler':
+            self._send_json(200, self.manager.scheduler_stats())
+        elif path == '/metrics':
+            body = METRICS.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif path.startswith('/jobs/'):
+            job = self._find_job(path.split('/')[2])
+            if job:
+                self._send_json(200, job.to_dict())
+        else:
+            self._send_error(404, "Неизвестный адрес")
+
+    def do_POST(self):
+        parts = urlsplit(self.path).path.strip('/').split('/')
+        if parts == ['jobs']:
+            self._submit()
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] in ('pause', 'resume', 'cancel'):
+            job = self._find_job(parts[1])
+            if job:
+                getattr(self.manager, parts[2])(job)
+                self._send_json(200, job.to_dict())
+        else:
+            self._send_error(404, "Неизвестный адрес")
+
+    def _submit(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_error(400, "Тело запроса должно быть JSON-объектом")
+            return
+        if not isinstance(body, dict) or not isinstance(body.get('url'), str):
+            self._send_error(400, "Не указан url")
+            return
+        if not isinstance(body.get('output_dir') or '', str):
+            self._send_error(400, "output_dir должен быть строкой")
+            return
+        priority = body.get('priority', 0)
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            self._send_error(400, "priority должен быть целым числом")
+            return
+        try:
+            job, created = self.manager.submit(body['url'], body.get('output_dir'), priority=priority)
+        except ValueError as e:
+            self._send_error(400, str(e))
+            return
+        # Уже поставленное в очередь видео: возвращается существующая задача
+        self._send_json(201 if created else 200, job.to_dict())
+
+    def _find_job(self, job_id):
+        job = self.manager.get(int(job_id)) if job_id.isdigit() else None
+        if job is None:
+            self._send_error(404, "Задача не найдена")
+        return job
+
+    def _stream_events(self):
+        subscriber = self.manager.events.subscribe()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    self.wfile.write(b': keepalive\n\n')
+                else:
+                    payload = json.dumps(data, ensure_ascii=False)
+                    self.wfile.write(f"event: {event}\ndata: {payload}\n\n".encode('utf-8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.manager.events.unsubscribe(subscriber)
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send_json(status, {'error': message})
+
+    def log_message(self, format, *args):
+        # Не засоряем вывод строкой на каждый запрос
+        pass
+
+
+def serve(settings=None, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS, resume=()):
+    """
+    Запускает фоновый режим и обрабатывает запросы до Ctrl+C
+
+    resume — пары (url, папка) незавершённых задач, которые нужно продолжить
+    """
+    manager = JobManager(settings, workers)
+    for url, output_dir in resume:
+        try:
+            manager.submit(url, output_dir)
+        except ValueError:
+            pass
+
+    server = ThreadingHTTPServer((host, port), APIRequestHandler)
+    server.daemon_threads = True
+    server.manager = manager
+    print(f"Фоновый режим: http://{host}:{server.server_port} (Ctrl+C — остановить)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nОстановка...")
+    finally:
+        server.server_close()
+        manager.shutdown()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Архив уже скачанных видео
+Хранится в текстовом файле в формате --download-archive yt-dlp ("vk -123_456"),
+при запуске целиком загружается в множество, поэтому проверка выполняется за O(1)
+без сетевых запросов
+"""
+
+import os
+import re
+import threading
+
+# ID видео или клипа в нормализованном URL: owner_id_video_id
+VIDEO_ID_RE = re.compile(r'^https://vk\.com/(?:video|clip)(-?\d+_\d+)$')
+
+
+def video_key(normalized_url):
+    """Ключ архива по нормализованному URL или None, если ID из URL не извлечь"""
+    match = VIDEO_ID_RE.match(normalized_url or '')
+    return f"vk {match.group(1)}" if match else None
+
+def info_key(info):
+    """Ключ архива по info-словарю yt-dlp (для ссылок, по которым ID заранее неизвестен)"""
+    extractor = (info.get('extractor_key') or info.get('extractor') or '').lower()
+    video_id = info.get('id')
+    return f"{extractor} {video_id}" if extractor and video_id else None
+
+
+class DownloadArchive:
+    """Множество ключей скачанных видео с дозаписью в файл"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.keys = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.keys.update(line.strip() for line in f if line.strip())
+
+    def __contains__(self, key):
+        return key is not None and key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, *keys):
+        """Добавляет ключи в архив и сразу дописывает их в файл"""
+        with self.lock:
+            new_keys = [key for key in keys if key and key not in self.keys]
+            if not new_keys:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for key in new_keys:
+                    f.write(key + '\n')
+            self.keys.update(new_keys)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Менеджер загрузок графического интерфейса: таблица задач DownloadQueue
+Модель не получает сигналов от потоков загрузки. По таймеру она забирает
+номера изменившихся задач и сообщает представлению о них несколькими
+диапазонами строк, а новые задачи добавляет одной вставкой. Представление
+запрашивает данные только видимых строк, поэтому таблица остаётся отзывчивой
+на десятках тысяч задач
+"""
+
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QPlainTextEdit,
+                             QSpinBox, QTableView, QHeaderView, QAbstractItemView)
+from PyQt5.QtCore import Qt, QTimer, QAbstractTableModel, QModelIndex
+
+from download_queue import (DownloadQueue, QUEUED, RUNNING, PAUSED, DONE, FAILED, CANCELLED, SKIPPED)
+from segmented_download import format_bytes
+
+# Период обновления таблицы, мс
+REFRESH_MS = 200
+# Наибольшее число одновременных загрузок, которое можно выбрать
+MAX_CONCURRENT = 32
+# Если изменившиеся строки образуют больше диапазонов, обновляется один общий диапазон
+MAX_CHANGED_RANGES = 50
+# Названия состояний задачи в таблице
+STATE_TITLES = {
+    QUEUED: "В очереди",
+    RUNNING: "Скачивается",
+    PAUSED: "Пауза",
+    DONE: "Готово",
+    FAILED: "Ошибка",
+    CANCELLED: "Отменено",
+    SKIPPED: "Пропущено",
+}
+
+
+class DownloadQueueModel(QAbstractTableModel):
+    """Табличная модель над DownloadQueue: строка на задачу"""
+
+    COLUMNS = ("Ссылка", "Состояние", "Прогресс", "Скорость", "Размер")
+    URL, STATE, PROGRESS, SPEED, SIZE = range(len(COLUMNS))
+
+    def __init__(self, queue, parent=None):
+        super().__init__(parent)
+        self.queue = queue
+        # Число строк, о которых уже знает представление
+        self.rows = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.rows
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        job = self.queue.jobs[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == self.URL:
+                return job.url
+            if column == self.STATE:
+                return STATE_TITLES[job.state]
+            if column == self.PROGRESS:
+                fraction = job.fraction
+                if job.state == DONE:
+                    return "100%"
+                return f"{fraction * 100:.1f}%" if fraction is not None else ''
+            if column == self.SPEED:
+                return f"{format_bytes(job.speed)}/s" if job.speed else ''
+            if column == self.SIZE:
+                if job.total:
+                    return format_bytes(job.total)
+                return format_bytes(job.downloaded) if job.downloaded else ''
+        elif role == Qt.ToolTipRole and job.message:
+            return job.message
+        elif role == Qt.TextAlignmentRole and column in (self.PROGRESS, self.SPEED, self.SIZE):
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def refresh(self):
+        """Показывает новые задачи и изменения с прошлого вызова"""
+        changed = self.queue.take_changes()
+        known = self.rows
+        total = len(self.queue.jobs)
+        if total > known:
+            self.beginInsertRows(QModelIndex(), known, total - 1)
+            self.rows = total
+            self.endInsertRows()
+
+        # Новые строки представление и так запросит целиком
+        ranges = []
+        for row in changed:
+            if row >= known:
+                break
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1][1] = row
+            else:
+                ranges.append([row, row])
+        if len(ranges) > MAX_CHANGED_RANGES:
+            ranges = [[ranges[0][0], ranges[-1][1]]]
+        for first, last in ranges:
+            self.dataChanged.emit(self.index(first, self.STATE), self.index(last, self.SIZE))
+        return bool(changed) or total > known
+
+
+class DownloadManagerWindow(QWidget):
+    """
+    Окно менеджера загрузок: вставка списка ссылок и таблица задач
+
+    settings (vk_video_downloader.DownloadSettings) общие для всех задач; папку,
+    качество и пул процессов главное окно меняет в них на ходу, и они действуют
+    на задачи, которые ещё не начались. Закрытие окна только скрывает его,
+    загрузки продолжаются
+    """
+
+    def __init__(self, settings, limit, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.queue = DownloadQueue(settings, limit)
+        self.model = DownloadQueueModel(self.queue, self)
+        self.initUI(limit)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(REFRESH_MS)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+    def initUI(self, limit):
+        self.setWindowTitle("Менеджер загрузок")
+        self.resize(900, 600)
+        layout = QVBoxLayout(self)
+
+        self.urls_input = QPlainTextEdit()
+        self.urls_input.setPlaceholderText("Вставьте ссылки на видео или плейлисты, по одной в строке. "
+                                           "Через пробел после ссылки можно указать приоритет (больше — раньше)")
+        self.urls_input.setMaximumHeight(100)
+        layout.addWidget(self.urls_input)
+
+        buttons_layout = QHBoxLayout()
+        add_button = QPushButton("Добавить в очередь")
+        add_button.clicked.connect(self.add_urls)
+        buttons_layout.addWidget(add_button)
+
+        buttons_layout.addWidget(QLabel("Одновременно:"))
+        self.limit_input = QSpinBox()
+        self.limit_input.setRange(1, MAX_CONCURRENT)
+        self.limit_input.setValue(limit)
+        self.limit_input.setToolTip("Наибольшее число одновременных загрузок")
+        self.limit_input.valueChanged.connect(self.queue.set_limit)
+        buttons_layout.addWidget(self.limit_input)
+        buttons_layout.addStretch()
+
+        for title, action in (("Пауза", self.queue.pause), ("Продолжить", self.queue.resume),
+                              ("Отменить", self.queue.cancel)):
+            button = QPushButton(title)
+            button.clicked.connect(lambda checked, action=action: self.apply_to_selected(action))
+            buttons_layout.addWidget(button)
+        layout.addLayout(buttons_layout)
+
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setWordWrap(False)
+        # Фиксированная высота строк: представлению не нужно измерять каждую из тысяч строк
+        rows_header = self.table.verticalHeader()
+        rows_header.setSectionResizeMode(QHeaderView.Fixed)
+        rows_header.setDefaultSectionSize(self.table.fontMetrics().height() + 6)
+        rows_header.hide()
+        columns_header = self.table.horizontalHeader()
+        columns_header.setSectionResizeMode(QHeaderView.Interactive)
+        columns_header.setSectionResizeMode(DownloadQueueModel.URL, QHeaderView.Stretch)
+        layout.addWidget(self.table)
+
+        self.summary_label = QLabel("Задач нет")
+        layout.addWidget(self.summary_label)
+
+    def add_urls(self):
+        """Добавляет в очередь ссылки из поля ввода"""
+        added, duplicates = self.queue.add(self.urls_input.toPlainText().splitlines())
+        self.urls_input.clear()
+        self.refresh()
+        message = f"Добавлено задач: {added}"
+        if duplicates:
+            message += f", пропущено повторов: {duplicates}"
+        self.summary_label.setText(message)
+
+    def apply_to_selected(self, action):
+        """Вызывает action(номер задачи) для выделенных строк"""
+        for index in self.table.selectionModel().selectedRows():
+            action(index.row())
+        self.refresh()
+
+    def refresh(self):
+        if self.model.refresh():
+            counts = self.queue.summary()
+            parts = [f"{STATE_TITLES[state].lower()}: {count}" for state, count in counts.items() if count]
+            self.summary_label.setText("Задачи — " + ", ".join(parts) if parts else "Задач нет")
+
+    def showEvent(self, event):
+        self.refresh()
+        self.refresh_timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        # Скрытое окно не обновляется, изменения задач накапливаются до показа
+        self.refresh_timer.stop()
+        super().hideEvent(event)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Очередь загрузок для менеджера загрузок графического интерфейса
+Задача — компактная запись со слотами: ссылка, состояние и числа прогресса.
+Потоки загрузки только перезаписывают поля своей задачи и отмечают её номер
+в множестве изменённых, а интерфейс по таймеру забирает это множество
+(take_changes) и перерисовывает только изменённые строки. Поэтому частота
+обновления таблицы не зависит ни от числа задач, ни от скорости сети.
+Одновременно выполняется не больше limit задач; предел можно менять на ходу.
+При закрытии программы очередь останавливается (shutdown): запущенные загрузки
+прерываются с сохранением недокачанных файлов и остаются в журнале незавершёнными
+"""
+
+import heapq
+import itertools
+import threading
+
+from vk_video_downloader import (JobResult, build_ydl_opts, import_yt_dlp, normalize_vk_url,
+                                 split_priority, _download_job)
+from download_archive import video_key
+from playlists import is_playlist_url, iter_playlist
+from session_pool import YoutubeDLPool
+from transfer_control import DownloadCancelled, TransferControl
+from url_parser import parse_video_ref
+
+# Состояния задачи
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+SKIPPED = 'skipped'
+FINISHED_STATES = (DONE, FAILED, CANCELLED, SKIPPED)
+
+
+class QueueJob:
+    """Задача очереди загрузок"""
+
+    __slots__ = ('url', 'output_dir', 'priority', 'state', 'message', 'downloaded', 'total', 'speed',
+                 'control')
+
+    def __init__(self, url, output_dir=None, priority=0, state=QUEUED, message=None):
+        self.url = url
+        self.output_dir = output_dir
+        self.priority = priority
+        self.state = state
+        # Имя файла или текст ошибки
+        self.message = message
+        self.downloaded = 0
+        self.total = None
+        self.speed = None
+        # Появляется при запуске задачи: пауза и отмена с закрытием её соединений
+        self.control = None
+
+    @property
+    def fraction(self):
+        """Доля скачанного от 0 до 1 или None, если размер неизвестен"""
+        if not self.total:
+            return None
+        return min(1.0, self.downloaded / self.total)
+
+
+class DownloadQueue:
+    """
+    Задачи менеджера загрузок в порядке добавления; потокобезопасна
+
+    Задачи запускаются по убыванию приоритета, а при равном — по порядку добавления,
+    каждая в своём потоке, не больше limit одновременно. Приостановленная во время
+    скачивания задача сохраняет свой слот, приостановленная в очереди — не занимает его
+    """
+
+    def __init__(self, settings, limit):
+        self.settings = settings
+        self.limit = max(1, limit)
+        if settings.ydl_pool is None:
+            settings.ydl_pool = YoutubeDLPool(max_idle=self.limit)
+        self.yt_dlp = None
+        self.lock = threading.Lock()
+        self.jobs = []
+        # Номер последней задачи для каждой ссылки
+        self.seen = {}
+        self.heap = []
+        self.order = itertools.count()
+        self.running = 0
+        # Оповещает shutdown о завершении потоков задач
+        self.idle = threading.Condition(self.lock)
+        self.closed = False
+        self.changed = set()
+        self.counts = dict.fromkeys((QUEUED, RUNNING, PAUSED) + FINISHED_STATES, 0)
+
+    def add(self, lines, output_dir=None):
+        """
+        Добавляет задачи по строкам «ссылка или ID [приоритет]»
+
+        Пустые строки и комментарии (#) пропускаются, повторы видео, которые уже
+        в очереди или скачаны, отбрасываются (отменённые и неудавшиеся задачи можно
+        добавить снова), некорректные ссылки добавляются сразу с ошибкой. Возвращает
+        число добавленных задач и число отброшенных повторов
+        """
+        output_dir = output_dir or self.settings.output_dir
+        added = duplicates = 0
+        with self.lock:
+            for line in lines:
+                line = line.strip()
+                if not line or line[0] == '#':
+                    continue
+                raw_url, priority = split_priority(line)
+                ref = parse_video_ref(raw_url)
+                url = ref.url if ref is not None else normalize_vk_url(raw_url)
+                if not url:
+                    self._append(QueueJob(raw_url, output_dir, priority, FAILED, "Некорректный URL"))
+                elif url in self.seen and self.jobs[self.seen[url]].state not in (FAILED, CANCELLED):
+                    duplicates += 1
+                    continue
+                else:
+                    self.seen[url] = self._append(QueueJob(url, output_dir, priority))
+                    self._push(self.seen[url])
+                added += 1
+            self._dispatch()
+        return added, duplicates
+
+    def set_limit(self, limit):
+        """Меняет число одновременных задач; лишние запущенные задачи дорабатывают"""
+        with self.lock:
+            self.limit = max(1, limit)
+            # Иначе экземпляры YoutubeDL пересоздавались бы для каждой задачи
+            pool = self.settings.ydl_pool
+            pool.max_idle = max(pool.max_idle, self.limit)
+            self._dispatch()
+
+    def pause(self, index):
+        with self.lock:
+            job = self.jobs[index]
+            if job.state not in (QUEUED, RUNNING):
+                return
+            if job.control is not None:
+                job.control.pause()
+            self._set_state(index, PAUSED)
+
+    def resume(self, index):
+        with self.lock:
+            job = self.jobs[index]
+            if job.state != PAUSED:
+                return
+            if job.control is not None:
+                job.control.resume()
+                self._set_state(index, RUNNING)
+            else:
+                self._set_state(index, QUEUED)
+                self._push(index)
+                self._dispatch()
+
+    def cancel(self, index):
+        with self.lock:
+            job = self.jobs[index]
+            if job.state in FINISHED_STATES:
+                return
+            if job.control is not None:
+                # Запущенную задачу завершит её поток, когда закроются соединения
+                job.control.cancel()
+            else:
+                job.message = "Отменено пользователем"
+                self._set_state(index, CANCELLED)
+
+    def shutdown(self, timeout=None):
+        """
+        Останавливает очередь при закрытии программы
+
+        Новые задачи больше не запускаются, запущенные прерываются: их .part-файлы
+        и записи журнала с последним состоянием сохраняются, и при следующем запуске
+        загрузки продолжатся. Ждёт завершения потоков не дольше timeout секунд;
+        возвращает True, если все они завершились
+        """
+        with self.lock:
+            self.closed = True
+            for job in self.jobs:
+                if job.control is not None and job.state not in FINISHED_STATES:
+                    job.control.interrupt()
+            return self.idle.wait_for(lambda: self.running == 0, timeout)
+
+    def take_changes(self):
+        """Номера задач, изменившихся с прошлого вызова, по возрастанию"""
+        with self.lock:
+            changed, self.changed = self.changed, set()
+        return sorted(changed)
+
+    def summary(self):
+        """Число задач в каждом состоянии"""
+        with self.lock:
+            return dict(self.counts)
+
+    def _append(self, job):
+        self.jobs.append(job)
+        self.counts[job.state] += 1
+        return len(self.jobs) - 1
+
+    def _push(self, index):
+        job = self.jobs[index]
+        heapq.heappush(self.heap, (-job.priority, next(self.order), index))
+
+    def _set_state(self, index, state):
+        job = self.jobs[index]
+        self.counts[job.state] -= 1
+        self.counts[state] += 1
+        job.state = state
+        self.changed.add(index)
+
+    def _dispatch(self):
+        while not self.closed and self.heap and self.running < self.limit:
+            index = heapq.heappop(self.heap)[2]
+            job = self.jobs[index]
+            # Задачи, приостановленные или отменённые в очереди, удаляются из кучи здесь
+            if job.state != QUEUED or job.control is not None:
+                continue
+            job.control = TransferControl()
+            self.running += 1
+            self._set_state(index, RUNNING)
+            threading.Thread(target=self._run, args=(index,), daemon=True).start()
+
+    def _run(self, index):
+        job = self.jobs[index]
+        try:
+            state, message = self._execute(job, index)
+        except Exception as e:
+            state, message = FAILED, str(e)
+        if job.control.cancelled:
+            state, message = CANCELLED, "Отменено пользователем"
+        with self.lock:
+            job.message = message
+            job.speed = None
+            self._set_state(index, state)
+            self.running -= 1
+            self._dispatch()
+            self.idle.notify_all()
+
+    def _execute(self, job, index):
+        """Выполняет задачу; возвращает итоговое состояние и сообщение"""
+        archive = self.settings.archive
+        if archive is not None and video_key(job.url) in archive:
+            return SKIPPED, "Уже скачано"
+        if self.yt_dlp is None:
+            self.yt_dlp = import_yt_dlp()
+            if self.yt_dlp is None:
+                return FAILED, "yt-dlp недоступен"
+        if is_playlist_url(job.url):
+            return self._expand(job)
+
+        def progress_hook(d):
+            job.downloaded = d.get('downloaded_bytes') or 0
+            job.total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            job.speed = d.get('speed')
+            with self.lock:
+                self.changed.add(index)
+
+        result = _download_job(self.yt_dlp, job.url, job.output_dir, self.settings,
+                               progress_hooks=[progress_hook], control=job.control, priority=job.priority)
+        if result.status == JobResult.OK:
+            return DONE, result.message
+        if result.status == JobResult.SKIPPED:
+            return SKIPPED, result.message
+        return FAILED, result.message
+
+    def _expand(self, job):
+        """Раскрывает плейлист постранично, добавляя его видео в конец очереди"""
+        ydl_opts = dict(build_ydl_opts(job.output_dir, retry_policy=self.settings.retry_policy), quiet=True,
+                        noprogress=True)
+        count = 0
+        try:
+            with self.settings.ydl_pool.lease(ydl_opts) as ydl:
+                for entry_url in iter_playlist(ydl, job.url):
+                    job.control.wait()
+                    count += self.add([f"{entry_url} {job.priority}"], job.output_dir)[0]
+        except DownloadCancelled:
+            pass
+        except Exception as e:
+            return FAILED, f"Не удалось получить список видео: {e}"
+        return DONE, f"Добавлено задач: {count}"
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Запись скачиваемых файлов на диск
+Известный заранее размер выделяется сразу (fallocate), поэтому файл не
+фрагментируется, а нехватка места обнаруживается до начала скачивания.
+Части файла пишутся по своим смещениям (pwrite) крупными блоками, выровненными
+по границам WRITE_BUFFER_SIZE, без промежуточных файлов и склейки.
+Политика fsync определяет, когда данные принудительно сбрасываются на диск.
+Записываемые данные можно сразу передавать в хеш содержимого (content_store.ContentHasher)
+"""
+
+import errno
+import os
+import threading
+
+from bandwidth import RATE_RE, RATE_UNITS
+
+# Размер буфера записи одной части файла и граница выравнивания блоков
+WRITE_BUFFER_SIZE = 1024 * 1024
+# Флаги открытия: на Windows файл нужно явно открыть в двоичном режиме
+OPEN_FLAGS = getattr(os, 'O_BINARY', 0)
+
+
+class FsyncPolicy:
+    """
+    Когда сбрасывать данные файла на диск
+
+    on_complete — перед переименованием готового файла из .part;
+    every_bytes — дополнительно после каждых every_bytes записанных байт
+    """
+
+    def __init__(self, on_complete=False, every_bytes=None):
+        self.on_complete = on_complete or bool(every_bytes)
+        self.every_bytes = every_bytes
+
+    def __repr__(self):
+        if self.every_bytes:
+            return f"FsyncPolicy(every_bytes={self.every_bytes})"
+        return f"FsyncPolicy(on_complete={self.on_complete})"
+
+
+def parse_fsync_policy(text):
+    """Разбирает политику: 'never', 'complete' или объём вида '64M' (fsync каждые 64 МиБ)"""
+    value = (text or '').strip().lower()
+    if value in ('', 'never'):
+        return FsyncPolicy()
+    if value == 'complete':
+        return FsyncPolicy(on_complete=True)
+    match = RATE_RE.match(value)
+    every_bytes = int(float(match.group(1)) * RATE_UNITS[match.group(2).upper()]) if match else 0
+    if not every_bytes:
+        raise ValueError(f"Некорректная политика fsync: {text} (never, complete или объём, например 64M)")
+    return FsyncPolicy(every_bytes=every_bytes)
+
+
+class FileSink:
+    """
+    Файл загрузки, в который несколько потоков пишут по своим смещениям
+
+    resume=True открывает существующий .part-файл без усечения. Запись
+    потокобезопасна: os.pwrite не использует общую позицию файла.
+    Все записанные байты передаются в hasher, если он задан
+    """
+
+    def __init__(self, path, fsync_policy=None, resume=False, hasher=None):
+        self.path = path
+        self.fsync_policy = fsync_policy or FsyncPolicy()
+        self.hasher = hasher
+        flags = os.O_RDWR | os.O_CREAT | OPEN_FLAGS
+        if not resume:
+            flags |= os.O_TRUNC
+        self.fd = os.open(path, flags, 0o666)
+        self.position = os.path.getsize(path) if resume else 0
+        self.lock = threading.Lock()
+        self.unsynced = 0
+
+    def preallocate(self, size):
+        """Выделяет место под файл размером size; где fallocate нет, просто задаёт размер"""
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self.fd, 0, size)
+                return
+            except OSError as e:
+                # Файловая система без поддержки fallocate; нехватку места сообщаем сразу
+                if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                    raise
+        os.ftruncate(self.fd, size)
+
+    def truncate(self, size):
+        os.ftruncate(self.fd, size)
+        self.position = size
+
+    def write(self, data):
+        """Дописывает data после последней записанной позиции; возвращает число байт"""
+        self.write_at(self.position, data)
+        self.position += len(data)
+        return len(data)
+
+    def write_at(self, offset, data):
+        """Записывает data с позиции offset целиком"""
+        view = memoryview(data)
+        position = offset
+        while view:
+            written = _pwrite(self.fd, view, position, self.lock)
+            view = view[written:]
+            position += written
+        if self.hasher is not None:
+            self.hasher.update(offset, data)
+        self._count(len(data))
+
+    def hash_existing(self, offset, length):
+        """Передаёт в hasher байты, записанные до продолжения загрузки (их приходится прочитать)"""
+        if self.hasher is None:
+            return
+        end = offset + length
+        while offset < end:
+            data = _pread(self.fd, min(WRITE_BUFFER_SIZE, end - offset), offset, self.lock)
+            if not data:
+                return
+            self.hasher.update(offset, data)
+            offset += len(data)
+
+    def writer(self, offset):
+        """Буферизованная запись части файла начиная с offset (SegmentWriter)"""
+        return SegmentWriter(self, offset)
+
+    def close(self, completed=True):
+        """Закрывает файл; после успешной загрузки сбрасывает его на диск, если этого требует политика"""
+        if self.fd is None:
+            return
+        try:
+            if completed and self.fsync_policy.on_complete:
+                os.fsync(self.fd)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+    def _count(self, nbytes):
+        every = self.fsync_policy.every_bytes
+        if not every:
+            return
+        with self.lock:
+            self.unsynced += nbytes
+            if self.unsynced < every:
+                return
+            self.unsynced = 0
+        os.fsync(self.fd)
+
+
+class SegmentWriter:
+    """
+    Буфер записи одной части файла
+
+    Данные накапливаются и записываются блоками, которые заканчиваются на границах,
+    кратных WRITE_BUFFER_SIZE. write и flush возвращают число байт, переданных ОС:
+    только они считаются сохранёнными при продолжении прерванной загрузки
+    """
+
+    def __init__(self, sink, offset, buffer_size=WRITE_BUFFER_SIZE):
+        self.sink = sink
+        self.offset = offset
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+
+    def fills_block(self, nbytes):
+        """True, если write() данных длиной nbytes запишет блок на диск, а не только в буфер"""
+        boundary = (self.offset // self.buffer_size + 1) * self.buffer_size
+        return self.offset + len(self.buffer) + nbytes >= boundary
+
+    def write(self, data):
+        self.buffer += data
+        # Первый блок дописывается до ближайшей границы выравнивания, следующие — целиком
+        boundary = (self.offset // self.buffer_size + 1) * self.buffer_size
+        if self.offset + len(self.buffer) < boundary:
+            return 0
+        size = boundary - self.offset
+        size += (len(self.buffer) - size) // self.buffer_size * self.buffer_size
+        return self._write(size)
+
+    def flush(self):
+        return self._write(len(self.buffer))
+
+    def _write(self, size):
+        if not size:
+            return 0
+        self.sink.write_at(self.offset, memoryview(self.buffer)[:size])
+        del self.buffer[:size]
+        self.offset += size
+        return size
+
+
+def _pread(fd, size, offset, lock):
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, offset)
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+def _pwrite(fd, data, offset, lock):
+    if hasattr(os, 'pwrite'):
+        return os.pwrite(fd, data, offset)
+    # На Windows нет pwrite: позиция файла общая, поэтому seek и write выполняются под блокировкой
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.write(fd, data)
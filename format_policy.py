@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Политика выбора формата видео с ограничениями по разрешению и объёму
+FormatPolicy передаётся yt-dlp вместо строки 'best' (опция format принимает
+функцию выбора) и выбирает формат по списку, полученному при извлечении.
+TransferBudget ограничивает суммарный ожидаемый объём пакета загрузок
+"""
+
+import threading
+
+from bandwidth import RATE_RE, RATE_UNITS
+from segmented_download import format_bytes
+
+# yt-dlp оценивает размер HLS/DASH-форматов по битрейту и длительности только с этой опцией
+COMPAT_OPTS = ['manifest-filesize-approx']
+# Относительная «цена» кодеков при одинаковом разрешении: более эффективный кодек — меньше байт
+CODEC_COST = (('av01', 0), ('vp09', 1), ('vp9', 1), ('hev1', 2), ('hvc1', 2), ('h265', 2),
+              ('avc1', 3), ('h264', 3))
+# Цена неизвестного кодека
+UNKNOWN_CODEC_COST = 4
+PROGRESSIVE_PROTOCOLS = ('http', 'https')
+
+
+class BudgetExceeded(Exception):
+    """Ожидаемый объём загрузки превышает остаток бюджета пакета"""
+
+
+def parse_size(text):
+    """Разбирает размер вида '700M', '1.5G', '1048576' в байты; 0 или пустая строка — None"""
+    if text is None or not str(text).strip():
+        return None
+    match = RATE_RE.match(str(text))
+    if not match:
+        raise ValueError(f"Некорректный размер: {text}")
+    return int(float(match.group(1)) * RATE_UNITS[match.group(2).upper()]) or None
+
+def format_size(fmt):
+    """Известный или оценённый yt-dlp размер формата в байтах либо None"""
+    return fmt.get('filesize') or fmt.get('filesize_approx')
+
+def predicted_bytes(info):
+    """Ожидаемый объём загрузки выбранного формата (с учётом склеиваемых форматов) или None"""
+    requested = info.get('requested_formats')
+    if requested:
+        sizes = [format_size(f) for f in requested]
+        return None if None in sizes else sum(sizes)
+    return format_size(info)
+
+def codec_cost(fmt):
+    vcodec = (fmt.get('vcodec') or '').lower()
+    for prefix, cost in CODEC_COST:
+        if vcodec.startswith(prefix):
+            return cost
+    return UNKNOWN_CODEC_COST
+
+def is_progressive(fmt):
+    return fmt.get('protocol', 'https') in PROGRESSIVE_PROTOCOLS
+
+
+class FormatPolicy:
+    """
+    Функция выбора формата для опции format yt-dlp
+
+    max_height — наибольшая высота кадра; max_bytes — наибольший ожидаемый размер файла;
+    prefer_progressive — при одинаковом разрешении предпочитать цельный файл
+    (качается по частям и продолжается после обрыва) фрагментам HLS/DASH;
+    cheapest_codec — при одинаковом разрешении выбирать формат с наименьшим
+    объёмом (обычно более эффективный кодек). Как и 'best', выбираются только
+    форматы со звуком и видео в одном файле
+    """
+
+    def __init__(self, max_height=None, max_bytes=None, prefer_progressive=False, cheapest_codec=False):
+        self.max_height = max_height
+        self.max_bytes = max_bytes
+        self.prefer_progressive = prefer_progressive
+        self.cheapest_codec = cheapest_codec
+
+    def __bool__(self):
+        return bool(self.max_height or self.max_bytes or self.prefer_progressive or self.cheapest_codec)
+
+    def __repr__(self):
+        # Используется в ключах пула YoutubeDL и кэша метаданных, поэтому детерминирован
+        return (f"FormatPolicy(max_height={self.max_height}, max_bytes={self.max_bytes}, "
+                f"prefer_progressive={self.prefer_progressive}, cheapest_codec={self.cheapest_codec})")
+
+    def __call__(self, ctx):
+        """Выбор формата по контексту yt-dlp: ctx['formats'] упорядочены от худшего к лучшему"""
+        from yt_dlp.utils import ExtractorError
+
+        formats = [f for f in ctx['formats'] if f.get('url')]
+        complete = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') != 'none']
+        candidates = complete or formats
+        if not candidates:
+            return
+        estimate_sizes(candidates)
+
+        if self.max_height:
+            fitting = [f for f in candidates if (f.get('height') or 0) <= self.max_height]
+            # Если все форматы выше предела, берём наименьшее разрешение
+            candidates = fitting or [min(candidates, key=lambda f: f.get('height') or 0)]
+        if self.max_bytes:
+            fitting = [f for f in candidates if (format_size(f) or 0) <= self.max_bytes]
+            if not fitting:
+                smallest = min(format_size(f) for f in candidates)
+                raise ExtractorError(
+                    f"Нет формата размером до {format_bytes(self.max_bytes)} "
+                    f"(наименьший — около {format_bytes(smallest)})", expected=True)
+            candidates = fitting
+
+        yield max(candidates, key=self._rank(ctx['formats']))
+
+    def _rank(self, formats):
+        order = {id(f): index for index, f in enumerate(formats)}
+
+        def key(fmt):
+            size = format_size(fmt)
+            return (fmt.get('height') or 0,
+                    is_progressive(fmt) if self.prefer_progressive else 0,
+                    (-codec_cost(fmt), -(size or 0)) if self.cheapest_codec else (0, 0),
+                    order[id(fmt)])
+        return key
+
+
+def estimate_sizes(formats):
+    """
+    Дополняет форматы без размера оценкой filesize_approx
+
+    Цельные MP4 VK не содержат ни размера, ни битрейта, поэтому их размер берётся
+    у HLS/DASH-формата той же высоты, а если такого нет — пересчитывается
+    от ближайшего по высоте формата пропорционально площади кадра
+    """
+    known = [f for f in formats if format_size(f) and f.get('height')]
+    if not known:
+        return
+    for fmt in formats:
+        height = fmt.get('height')
+        if format_size(fmt) or not height:
+            continue
+        reference = min(known, key=lambda f: (abs(f['height'] - height), format_size(f)))
+        fmt['filesize_approx'] = int(format_size(reference) * (height / reference['height']) ** 2)
+
+
+class TransferBudget:
+    """Общий лимит ожидаемого объёма для задач пакета; потокобезопасен"""
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.planned = 0
+        self.unknown = 0
+        self.lock = threading.Lock()
+
+    def reserve(self, nbytes):
+        """Резервирует ожидаемый объём задачи; BudgetExceeded, если он не помещается в остаток"""
+        with self.lock:
+            if nbytes is None:
+                # Размер неизвестен: задача не ограничивается, но учитывается отдельно
+                self.unknown += 1
+                return
+            if self.max_bytes is not None and self.planned + nbytes > self.max_bytes:
+                raise BudgetExceeded(f"Превышен бюджет пакета: нужно {format_bytes(nbytes)}, "
+                                     f"осталось {format_bytes(self.max_bytes - self.planned)}")
+            self.planned += nbytes
+
+    def release(self, nbytes):
+        """Возвращает в бюджет неиспользованную часть резерва (например, после ошибки)"""
+        if not nbytes:
+            return
+        with self.lock:
+            self.planned = max(0, self.planned - nbytes)
@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Параллельное скачивание фрагментов HLS/DASH с адаптивным окном запросов
+Размер окна подбирается по схеме AIMD: растёт, пока растёт скорость,
+и сокращается вдвое при ошибках и ограничении скорости со стороны сервера
+"""
+
+import os
+import time
+import threading
+import shutil
+import subprocess
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from content_store import ContentHasher
+from file_sink import FileSink
+from segmented_download import progress_dict, CHUNK_SIZE
+from session_pool import HTTP_POOL
+from metrics import METRICS
+from retry_policy import DEFAULT_POLICY
+from transfer_control import DownloadCancelled, TransferControl, TransferPaused, remove_partial
+
+# Границы окна одновременно скачиваемых фрагментов
+MIN_WINDOW = 1
+INITIAL_WINDOW = 2
+MAX_WINDOW = 16
+# Максимальное число готовых фрагментов, ожидающих записи по порядку
+MAX_BUFFERED = MAX_WINDOW * 2
+
+
+class UnsupportedStream(Exception):
+    """Поток нельзя скачать встроенным загрузчиком (шифрование, live и т.п.)"""
+
+
+def is_supported(info):
+    """Проверяет, что выбранный yt-dlp формат — HLS или DASH из отдельных фрагментов"""
+    protocol = info.get('protocol') or ''
+    if info.get('is_live') or info.get('requested_formats'):
+        return False
+    if protocol in ('m3u8', 'm3u8_native'):
+        return bool(info.get('url'))
+    if protocol == 'http_dash_segments':
+        return bool(info.get('fragments'))
+    return False
+
+def parse_m3u8(text, base_url):
+    """
+    Разбирает медиаплейлист HLS
+
+    Возвращает кортеж (url init-сегмента или None, список url фрагментов)
+    """
+    init_url = None
+    fragments = []
+    ended = False
+    lines = [line.strip() for line in text.splitlines()]
+    if not lines or lines[0] != '#EXTM3U':
+        raise UnsupportedStream("Некорректный плейлист HLS")
+
+    for line in lines[1:]:
+        if not line:
+            continue
+        if line.startswith('#EXT-X-STREAM-INF'):
+            raise UnsupportedStream("Мастер-плейлист HLS вместо медиаплейлиста")
+        if line.startswith('#EXT-X-KEY') and 'METHOD=NONE' not in line:
+            raise UnsupportedStream("Зашифрованный поток HLS")
+        if line.startswith('#EXT-X-BYTERANGE'):
+            raise UnsupportedStream("Фрагменты HLS с диапазонами байтов")
+        if line.startswith('#EXT-X-MAP'):
+            uri = line.split('URI="', 1)[1].split('"', 1)[0] if 'URI="' in line else None
+            if not uri or 'BYTERANGE' in line:
+                raise UnsupportedStream("Неподдерживаемый init-сегмент HLS")
+            init_url = urljoin(base_url, uri)
+        elif line.startswith('#EXT-X-ENDLIST'):
+            ended = True
+        elif not line.startswith('#'):
+            fragments.append(urljoin(base_url, line))
+
+    if not ended:
+        raise UnsupportedStream("Прямая трансляция HLS")
+    if not fragments:
+        raise UnsupportedStream("Пустой плейлист HLS")
+    return init_url, fragments
+
+def _next_attempt(attempts, index, received):
+    """
+    Номер неудачной попытки фрагмента подряд
+
+    attempts хранит для фрагмента пару (попытка, полученные байты); если после
+    прошлой ошибки байт стало больше, фрагмент продвинулся и счёт начинается заново
+    """
+    attempt, last_received = attempts.get(index, (0, 0))
+    attempt = 1 if received > last_received else attempt + 1
+    attempts[index] = (attempt, received)
+    return attempt
+
+def remux_mpegts(src, dst):
+    """Перепаковывает MPEG-TS в MP4 через ffmpeg. Возвращает False, если ffmpeg недоступен"""
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return False
+    subprocess.check_call([ffmpeg, '-y', '-loglevel', 'error', '-i', src,
+                           '-c', 'copy', '-f', 'mp4', '-bsf:a', 'aac_adtstoasc', dst])
+    return True
+
+
+class AdaptiveWindow:
+    """
+    Окно одновременных запросов с аддитивным ростом и мультипликативным уменьшением
+
+    Каждые size успешных фрагментов замеряется скорость: если она выросла,
+    окно увеличивается на единицу, если заметно упала — уменьшается на единицу.
+    Ошибка или ограничение со стороны сервера сокращают окно вдвое
+    """
+
+    def __init__(self, initial=INITIAL_WINDOW, minimum=MIN_WINDOW, maximum=MAX_WINDOW):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.size = max(minimum, min(initial, maximum))
+        self.epoch_bytes = 0
+        self.epoch_count = 0
+        self.epoch_started = time.monotonic()
+        self.last_throughput = None
+
+    def on_success(self, num_bytes):
+        """Учитывает успешно скачанный фрагмент"""
+        self.epoch_bytes += num_bytes
+        self.epoch_count += 1
+        if self.epoch_count < self.size:
+            return
+
+        elapsed = max(time.monotonic() - self.epoch_started, 1e-6)
+        throughput = self.epoch_bytes / elapsed
+        if self.last_throughput is None or throughput >= self.last_throughput * 1.05:
+            self.size = min(self.maximum, self.size + 1)
+        elif throughput < self.last_throughput * 0.8:
+            self.size = max(self.minimum, self.size - 1)
+        self.last_throughput = throughput
+        self._new_epoch()
+
+    def on_error(self):
+        """Учитывает ошибку или ограничение скорости со стороны сервера"""
+        self.size = max(self.minimum, self.size // 2)
+        self.last_throughput = None
+        self._new_epoch()
+
+    def _new_epoch(self):
+        self.epoch_bytes = 0
+        self.epoch_count = 0
+        self.epoch_started = time.monotonic()
+
+
+class FragmentDownloader:
+    """
+    Скачивает фрагменты параллельно и записывает их в файл строго по порядку
+
+    После записи каждого фрагмента позиция передаётся в on_checkpoint;
+    сохранённое состояние можно передать как resume_state, чтобы продолжить
+    загрузку из .part-файла со следующего фрагмента. Фрагменты пишутся
+    целиком, а на диск сбрасываются по fsync_policy (file_sink.FsyncPolicy).
+    С hash_content=True по ходу записи считается хеш содержимого (content_hash);
+    после перепаковки MPEG-TS он не известен (None). Временные ошибки повторяются
+    по retry_policy для каждого фрагмента отдельно, начиная с недополученного байта.
+    Пауза и отмена — через control (transfer_control.TransferControl), как в SegmentedDownloader
+    """
+
+    def __init__(self, fragment_urls, filename, headers=None, progress_hooks=None,
+                 init_url=None, timeout=30, window=None, resume_state=None, on_checkpoint=None,
+                 throttle=None, fsync_policy=None, hash_content=False, retry_policy=None, control=None):
+        self.fragment_urls = fragment_urls
+        self.filename = filename
+        self.headers = dict(headers or {})
+        self.progress_hooks = list(progress_hooks or [])
+        self.init_url = init_url
+        self.timeout = timeout
+        self.window = window or AdaptiveWindow()
+        self.resume_state = resume_state
+        self.on_checkpoint = on_checkpoint
+        self.throttle = throttle
+        self.fsync_policy = fsync_policy
+        self.retry_policy = retry_policy or DEFAULT_POLICY
+        self.control = control or TransferControl()
+        self.hasher = ContentHasher() if hash_content else None
+        self.content_hash = None
+        self.is_mpegts = False
+        self.downloaded = 0
+        self.started = None
+        # Прерывает паузы перед повторами, когда загрузка завершается ошибкой или отменяется
+        self.abort = threading.Event()
+
+    @classmethod
+    def from_info(cls, info, filename, headers=None, progress_hooks=None, timeout=30, **kwargs):
+        """Создаёт загрузчик по info-словарю формата yt-dlp"""
+        if info.get('protocol') == 'http_dash_segments':
+            base_url = info.get('fragment_base_url') or ''
+            urls = []
+            for fragment in info['fragments']:
+                url = fragment.get('url') or (urljoin(base_url, fragment['path']) if fragment.get('path') else None)
+                if not url or fragment.get('byte_range'):
+                    raise UnsupportedStream("Неподдерживаемый фрагмент DASH")
+                urls.append(url)
+            # Первый фрагмент DASH является init-сегментом и идёт в начало файла
+            return cls(urls, filename, headers, progress_hooks, timeout=timeout, **kwargs)
+
+        def fetch_playlist():
+            with HTTP_POOL.open(info['url'], headers, timeout) as response:
+                return response.read().decode('utf-8', 'replace'), response.geturl()
+
+        playlist, playlist_url = (kwargs.get('retry_policy') or DEFAULT_POLICY).call(fetch_playlist)
+        init_url, urls = parse_m3u8(playlist, playlist_url)
+        downloader = cls(urls, filename, headers, progress_hooks, init_url, timeout, **kwargs)
+        # Без init-сегмента фрагменты HLS — это MPEG-TS, который нужно перепаковать
+        downloader.is_mpegts = init_url is None
+        return downloader
+
+    def download(self):
+        """Скачивает все фрагменты и возвращает размер файла в байтах"""
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_filename = self.filename + '.part'
+        self.started = time.monotonic()
+        self.control.add_listener(self.abort.set)
+        try:
+            self._download_part(tmp_filename)
+        except Exception:
+            if self.control.discards_partial:
+                remove_partial(self.filename)
+            raise
+        finally:
+            self.control.remove_listener(self.abort.set)
+
+        if self.hasher is not None:
+            self.content_hash = self.hasher.hexdigest(self.downloaded)
+        if self.is_mpegts and os.path.splitext(self.filename)[1].lower() == '.mp4':
+            if remux_mpegts(tmp_filename, self.filename):
+                os.remove(tmp_filename)
+                self.content_hash = None
+            else:
+                # Как и yt-dlp без ffmpeg, оставляем MPEG-TS под именем .mp4
+                os.replace(tmp_filename, self.filename)
+        else:
+            os.replace(tmp_filename, self.filename)
+
+        self._report('finished', self.downloaded)
+        return self.downloaded
+
+    def _download_part(self, tmp_filename):
+        """Скачивает фрагменты в tmp_filename, продолжая прерванную загрузку, если это возможно"""
+        resume = self._resumed_position(tmp_filename)
+        # Фрагмент передаётся ОС одной записью, поэтому записанная в журнал позиция всегда в файле
+        out = FileSink(tmp_filename, self.fsync_policy, resume=bool(resume), hasher=self.hasher)
+        completed = False
+        try:
+            if resume:
+                first_index, offset = resume
+                out.truncate(offset)
+                out.hash_existing(0, offset)
+                self.downloaded = offset
+            else:
+                first_index = 0
+                if self.init_url:
+                    init_data = self.retry_policy.call(self._fetch, self.init_url)
+                    out.write(init_data)
+                    self.downloaded += len(init_data)
+            self._download_fragments(out, first_index)
+            completed = True
+        finally:
+            out.close(completed)
+
+    def stream(self, sink):
+        """
+        Скачивает фрагменты и передаёт их в sink (stream_sink) по порядку, без файла на диске
+
+        MPEG-TS и фрагментированный MP4 можно читать с любого фрагмента, поэтому
+        поток передаётся как есть. Возвращает число переданных байт
+        """
+        self.started = time.monotonic()
+        if self.init_url:
+            init_data = self.retry_policy.call(self._fetch, self.init_url)
+            sink.write(init_data)
+            self.downloaded += len(init_data)
+        self._download_fragments(sink)
+        self._report('finished', self.downloaded)
+        return self.downloaded
+
+    def _resumed_position(self, tmp_filename):
+        """(индекс фрагмента, смещение в файле) из сохранённого состояния или None"""
+        state = self.resume_state
+        if not state or state.get('count') != len(self.fragment_urls):
+            return None
+        if not os.path.exists(tmp_filename) or os.path.getsize(tmp_filename) < state.get('offset', 0):
+            return None
+        return state['fragment'], state['offset']
+
+    def _download_fragments(self, out, first_index=0):
+        total = len(self.fragment_urls)
+        next_index = first_index    # следующий фрагмент для запуска
+        write_index = first_index   # следующий фрагмент для записи
+        ready = {}           # готовые, но ещё не записанные фрагменты
+        received = {}        # уже полученные байты фрагментов, которые скачиваются или ждут повтора
+        attempts = {}
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.window.maximum) as executor:
+            try:
+                while write_index < total:
+                    # Заполняем окно, не уходя слишком далеко вперёд от записи
+                    while (next_index < total and len(in_flight) < self.window.size
+                           and next_index - write_index < MAX_BUFFERED):
+                        received[next_index] = bytearray()
+                        future = executor.submit(self._fetch, self.fragment_urls[next_index],
+                                                 received[next_index])
+                        in_flight[future] = next_index
+                        next_index += 1
+
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = in_flight.pop(future)
+                        try:
+                            data = future.result()
+                        except Exception as e:
+                            self.window.on_error()
+                            attempt = _next_attempt(attempts, index, len(received[index]))
+                            if not self.retry_policy.should_retry(e, attempt):
+                                raise
+                            METRICS.count_retry('fragment')
+                            # Пауза выполняется в потоке пула и не задерживает запись готовых фрагментов
+                            retry = executor.submit(self._fetch, self.fragment_urls[index], received[index],
+                                                    self.retry_policy.delay(attempt, e))
+                            in_flight[retry] = index
+                            continue
+                        self.window.on_success(len(data))
+                        ready[index] = data
+                        del received[index]
+                        attempts.pop(index, None)
+
+                    # Записываем все фрагменты, идущие подряд
+                    while write_index in ready:
+                        data = ready.pop(write_index)
+                        out.write(data)
+                        self.downloaded += len(data)
+                        write_index += 1
+                        estimate = self.downloaded * total // write_index
+                        self._report('downloading', estimate)
+                        if self.on_checkpoint:
+                            state = {'count': total, 'fragment': write_index, 'offset': self.downloaded}
+                            self.on_checkpoint(self.downloaded, estimate, state, write_index == total)
+            finally:
+                self.abort.set()
+                for future in in_flight:
+                    future.cancel()
+                if self.on_checkpoint and first_index < write_index < total:
+                    # Позиция записи прерванной загрузки сохраняется без ограничения частоты
+                    state = {'count': total, 'fragment': write_index, 'offset': self.downloaded}
+                    self.on_checkpoint(self.downloaded, self.downloaded * total // write_index, state, True)
+
+    def _fetch(self, url, received=None, delay=0):
+        """
+        Скачивает фрагмент, дописывая его в received (bytearray); возвращает received
+
+        Если received уже содержит начало фрагмента от прерванной попытки или паузы,
+        запрашивается только остаток (Range)
+        """
+        if delay and self.abort.wait(delay):
+            raise DownloadCancelled("Скачивание прервано")
+        if received is None:
+            received = bytearray()
+        while True:
+            try:
+                return self._fetch_rest(url, received)
+            except TransferPaused:
+                # Соединение закрыто паузой; остаток фрагмента запрашивается после продолжения
+                self.control.wait()
+
+    def _fetch_rest(self, url, received):
+        headers = self.headers
+        if received:
+            headers = dict(headers, Range=f'bytes={len(received)}-')
+        with self.control.open(url, headers, self.timeout) as response:
+            if received and response.status != 206:
+                # Сервер отдаёт фрагмент целиком
+                del received[:]
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    return received
+                if self.throttle:
+                    self.throttle.consume(len(chunk))
+                received += chunk
+
+    def _report(self, status, total_estimate):
+        if not self.progress_hooks:
+            return
+        d = progress_dict(status, self.filename, self.downloaded, total_estimate,
+                          self.started, estimated=status != 'finished')
+        for hook in self.progress_hooks:
+            hook(d)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Журнал задач скачивания (SQLite в режиме WAL)
+Для каждой задачи хранит URL, выбранный формат, путь к файлу и прогресс,
+чтобы после падения программы незавершённые загрузки можно было продолжить
+с места остановки
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Состояния задач
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# Минимальный интервал между записями прогресса одной задачи, секунд
+CHECKPOINT_INTERVAL = 1.0
+
+
+class JournalEntry:
+    """Запись журнала об одной задаче"""
+
+    def __init__(self, journal, job_id, url, format_id=None, output_path=None, resume_state=None):
+        self.journal = journal
+        self.job_id = job_id
+        self.url = url
+        self.format_id = format_id
+        self.output_path = output_path
+        self.resume_state = resume_state
+        self.last_checkpoint = 0.0
+        self.last_progress = 0.0
+
+    def resume_state_for(self, format_id, output_path):
+        """
+        Сохранённое состояние загрузки, если задача продолжается тем же форматом
+        и её .part-файл на месте, иначе None
+        """
+        if (self.resume_state and self.format_id == format_id and self.output_path == output_path
+                and os.path.exists(output_path + '.part')):
+            return self.resume_state
+        return None
+
+    def set_target(self, format_id, output_path):
+        """Запоминает выбранный формат и путь к итоговому файлу"""
+        if (format_id, output_path) != (self.format_id, self.output_path):
+            self.resume_state = None
+        self.format_id = format_id
+        self.output_path = output_path
+        self.journal._update(self.job_id, format_id=format_id, output_path=output_path)
+
+    def checkpoint(self, bytes_done, total_bytes=None, resume_state=None, force=False):
+        """Записывает прогресс не чаще раза в CHECKPOINT_INTERVAL секунд"""
+        now = time.monotonic()
+        if not force and now - self.last_checkpoint < CHECKPOINT_INTERVAL:
+            return
+        self.last_checkpoint = now
+        self.resume_state = resume_state
+        self.journal._update(self.job_id, bytes_done=bytes_done, total_bytes=total_bytes,
+                             resume_state=json.dumps(resume_state) if resume_state is not None else None)
+
+    def progress_hook(self, d):
+        """progress_hook для yt-dlp: записывает только число скачанных байт"""
+        now = time.monotonic()
+        if d['status'] != 'downloading' or now - self.last_progress < CHECKPOINT_INTERVAL:
+            return
+        self.last_progress = now
+        self.journal._update(self.job_id, bytes_done=d.get('downloaded_bytes') or 0,
+                             total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'))
+
+    def finish(self, state=DONE):
+        """Отмечает задачу завершённой"""
+        self.journal._update(self.job_id, state=state)
+
+
+class JobJournal:
+    """Журнал задач с упреждающей записью"""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                output_dir TEXT,
+                format_id TEXT,
+                output_path TEXT,
+                bytes_done INTEGER NOT NULL DEFAULT 0,
+                total_bytes INTEGER,
+                resume_state TEXT,
+                state TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        self.db.commit()
+
+    def begin(self, url, output_dir=None):
+        """
+        Начинает задачу для URL; если по нему есть незавершённая задача,
+        возвращает её вместе с сохранённым состоянием загрузки
+        """
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id, format_id, output_path, resume_state FROM jobs "
+                "WHERE url = ? AND state = ? ORDER BY id DESC LIMIT 1", (url, RUNNING)).fetchone()
+            if row:
+                self.db.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now, row[0]))
+                self.db.commit()
+                resume_state = json.loads(row[3]) if row[3] else None
+                return JournalEntry(self, row[0], url, row[1], row[2], resume_state)
+
+            cursor = self.db.execute(
+                "INSERT INTO jobs (url, output_dir, state, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (url, output_dir, RUNNING, now, now))
+            self.db.commit()
+            return JournalEntry(self, cursor.lastrowid, url)
+
+    def unfinished(self):
+        """Список (url, output_dir) задач, прерванных падением или закрытием программы"""
+        with self.lock:
+            return self.db.execute(
+                "SELECT url, output_dir FROM jobs WHERE state = ? ORDER BY id", (RUNNING,)).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with self.lock:
+            self.db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+            self.db.commit()
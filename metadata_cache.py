@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Дисковый кэш результатов извлечения информации о видео (extract_info)
+Записи хранятся в SQLite, ограничены по времени жизни и общему размеру (LRU)
+и становятся недействительными раньше срока, если истекают подписанные ссылки CDN
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+# Время жизни записи по умолчанию, секунд
+DEFAULT_TTL = 60 * 60
+# Максимальный суммарный размер записей по умолчанию, байт
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Запас до истечения подписанной ссылки, после которого запись уже не выдаётся
+EXPIRY_MARGIN = 5 * 60
+# Параметры запроса, в которых CDN передаёт время истечения ссылки (unix time)
+EXPIRY_PARAMS = ('expires', 'expire')
+
+
+def signed_url_expiry(info):
+    """Минимальное время истечения подписанных ссылок в info-словаре или None"""
+    urls = [info.get('url')]
+    urls.extend(f.get('url') for f in info.get('formats') or [])
+    urls.extend(f.get('url') for f in info.get('requested_formats') or [])
+
+    expiry = None
+    for url in urls:
+        if not url:
+            continue
+        query = parse_qs(urlparse(url).query)
+        for param in EXPIRY_PARAMS:
+            value = (query.get(param) or [''])[0]
+            # Отсекаем значения, не похожие на unix time
+            if value.isdigit() and int(value) > 1000000000:
+                expiry = int(value) if expiry is None else min(expiry, int(value))
+    return expiry
+
+
+class MetadataCache:
+    """Кэш info-словарей yt-dlp, ключ — нормализованный URL видео"""
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS metadata (
+                url TEXT PRIMARY KEY,
+                info TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS metadata_accessed ON metadata (accessed_at)")
+        self.db.commit()
+
+    def get(self, url):
+        """Возвращает сохранённый info-словарь или None, если записи нет или она устарела"""
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT info, expires_at FROM metadata WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self.db.execute("DELETE FROM metadata WHERE url = ?", (url,))
+                self.db.commit()
+                return None
+            self.db.execute("UPDATE metadata SET accessed_at = ? WHERE url = ?", (now, url))
+            self.db.commit()
+        return json.loads(row[0])
+
+    def put(self, url, info):
+        """Сохраняет info-словарь (должен быть сериализуем в JSON, см. YoutubeDL.sanitize_info)"""
+        now = time.time()
+        expires_at = now + self.ttl
+        url_expiry = signed_url_expiry(info)
+        if url_expiry is not None:
+            expires_at = min(expires_at, url_expiry - EXPIRY_MARGIN)
+        if expires_at <= now:
+            return
+
+        data = json.dumps(info, ensure_ascii=False)
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO metadata (url, info, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (url, data, len(data), expires_at, now))
+            self._evict(now)
+            self.db.commit()
+
+    def invalidate(self, url):
+        """Удаляет запись, например после ошибки скачивания по устаревшим ссылкам"""
+        with self.lock:
+            self.db.execute("DELETE FROM metadata WHERE url = ?", (url,))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def _evict(self, now):
+        """Удаляет устаревшие записи и самые давно использованные сверх лимита размера"""
+        self.db.execute("DELETE FROM metadata WHERE expires_at <= ?", (now,))
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM metadata").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, size in self.db.execute("SELECT url, size FROM metadata ORDER BY accessed_at").fetchall():
+            self.db.execute("DELETE FROM metadata WHERE url = ?", (url,))
+            total -= size
+            if total <= self.max_bytes:
+                break
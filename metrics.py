@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Метрики скачивания: длительность этапов задач и счётчики
+Для каждой задачи измеряются этапы — нормализация ссылки, ожидание в очереди,
+извлечение информации, ожидание слота скачивания, время до первого байта,
+передача данных и постобработка.
+Этапы собираются в гистограммы, счётчики учитывают задачи по статусам, байты,
+повторные попытки и ошибки по классам. Метрики отдаются в текстовом формате
+Prometheus (/metrics фонового режима или отдельный сервер) и пишутся в JSONL-файл
+по строке на задачу
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Этапы задачи в порядке выполнения
+PHASES = ('normalize', 'queue', 'extract', 'schedule', 'first_byte', 'transfer', 'postprocess')
+# Границы корзин гистограмм этапов, секунд
+PHASE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+# Префикс имён метрик Prometheus
+PREFIX = 'vkdl'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def error_class(error):
+    """
+    Класс ошибки для счётчика: имя класса исходного исключения
+
+    yt-dlp заворачивает ошибки в DownloadError, поэтому берётся исходное исключение;
+    у ошибок HTTP добавляется код ответа
+    """
+    cause = error
+    exc_info = getattr(error, 'exc_info', None)
+    if exc_info and exc_info[1] is not None:
+        cause = exc_info[1]
+    name = type(cause).__name__
+    # HTTPError urllib (code) и сетевого слоя yt-dlp (status)
+    code = getattr(cause, 'status', None) or getattr(cause, 'code', None)
+    if name == 'HTTPError' and code:
+        return f"{name} {code}"
+    return name
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами, как histogram в Prometheus"""
+
+    def __init__(self, buckets=PHASE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class JobMetrics:
+    """
+    Измерения одной задачи
+
+    Создаётся при получении ссылки (до нормализации); begin() отмечает начало
+    выполнения, extracted() — окончание извлечения информации, scheduled() — выдачу
+    слота скачивания планировщиком (scheduler.JobScheduler), progress_hook
+    (обработчик прогресса yt-dlp) — первый байт и окончание передачи.
+    finish() вычисляет этапы и передаёт задачу в реестр
+    """
+
+    def __init__(self, registry, url):
+        self.registry = registry
+        self.url = url
+        self.created = time.monotonic()
+        self.phases = {}
+        self.begun = None
+        self.extracted_at = None
+        self.scheduled_at = None
+        self.first_byte_at = None
+        self.transferred_at = None
+        self.finished = False
+
+    @contextmanager
+    def phase(self, name):
+        """Измеряет этап, выполняемый блоком with (например, нормализацию ссылки)"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.monotonic() - started
+
+    def begin(self):
+        self.begun = time.monotonic()
+        with self.registry.lock:
+            self.registry.active += 1
+
+    def extracted(self):
+        """Информация о видео получена, дальше — скачивание"""
+        if self.extracted_at is None:
+            self.extracted_at = time.monotonic()
+
+    def scheduled(self):
+        """Задача дождалась слота скачивания"""
+        if self.scheduled_at is None:
+            self.scheduled_at = time.monotonic()
+
+    def progress_hook(self, d):
+        if d['status'] == 'downloading' and self.first_byte_at is None and d.get('downloaded_bytes'):
+            self.first_byte_at = time.monotonic()
+        elif d['status'] == 'finished':
+            # При склейке видео и звука передача заканчивается последним файлом
+            self.transferred_at = time.monotonic()
+
+    def finish(self, status, error=None, bytes_downloaded=0, error_class_name=None):
+        """
+        Завершает задачу со статусом status ('ok', 'failed', 'skipped', 'cancelled')
+
+        error — исключение или текст ошибки; error_class_name задаёт класс ошибки явно
+        """
+        if self.finished:
+            return
+        self.finished = True
+        ended = time.monotonic()
+        if self.begun is not None:
+            self.phases['queue'] = self.begun - (self.created + self.phases.get('normalize', 0.0))
+            if self.extracted_at is not None:
+                self.phases['extract'] = self.extracted_at - self.begun
+                requested_at = self.extracted_at
+                if self.scheduled_at is not None:
+                    self.phases['schedule'] = self.scheduled_at - self.extracted_at
+                    requested_at = self.scheduled_at
+                if self.first_byte_at is not None:
+                    self.phases['first_byte'] = self.first_byte_at - requested_at
+                    if self.transferred_at is not None:
+                        self.phases['transfer'] = self.transferred_at - self.first_byte_at
+                        self.phases['postprocess'] = ended - self.transferred_at
+            elif error is not None:
+                # Ошибка до получения информации о видео
+                self.phases['extract'] = ended - self.begun
+
+        if error is not None and error_class_name is None:
+            error_class_name = error_class(error) if isinstance(error, BaseException) else 'Error'
+        self.registry.record({
+            'time': time.time(),
+            'url': self.url,
+            'status': status,
+            'bytes': bytes_downloaded,
+            'seconds': ended - self.created,
+            'phases': {name: self.phases[name] for name in PHASES if name in self.phases},
+            'error_class': error_class_name,
+            'error': str(error) if error is not None else None,
+        })
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса; потокобезопасен"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {name: Histogram() for name in PHASES}
+        self.jobs = {}
+        self.failures = {}
+        self.retries = {}
+        self.bytes_total = 0
+        self.active = 0
+        self.jsonl = None
+        self.collectors = []
+
+    def job(self, url):
+        """Измерения новой задачи"""
+        return JobMetrics(self, url)
+
+    def count_retry(self, kind):
+        """Учитывает повторную попытку (kind: 'fragment', 'cache' и т.п.)"""
+        with self.lock:
+            self.retries[kind] = self.retries.get(kind, 0) + 1
+
+    def add_collector(self, collector):
+        """
+        Добавляет источник дополнительных метрик Prometheus
+
+        collector() возвращает список (имя, тип, описание, [(суффикс, метки, значение)])
+        """
+        with self.lock:
+            self.collectors.append(collector)
+
+    def open_jsonl(self, path):
+        """Дописывает в файл path строку JSON на каждую завершённую задачу"""
+        with self.lock:
+            if self.jsonl is not None:
+                self.jsonl.close()
+            self.jsonl = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def close(self):
+        with self.lock:
+            if self.jsonl is not None:
+                self.jsonl.close()
+                self.jsonl = None
+
+    def record(self, entry):
+        """Добавляет завершённую задачу в гистограммы, счётчики и JSONL"""
+        with self.lock:
+            if 'queue' in entry['phases']:
+                # Задача начинала выполняться (begin) и больше не активна
+                self.active -= 1
+            for name, seconds in entry['phases'].items():
+                self.phases[name].observe(max(0.0, seconds))
+            self.jobs[entry['status']] = self.jobs.get(entry['status'], 0) + 1
+            self.bytes_total += entry['bytes'] or 0
+            if entry['error_class'] and entry['status'] == 'failed':
+                self.failures[entry['error_class']] = self.failures.get(entry['error_class'], 0) + 1
+            if self.jsonl is not None:
+                self.jsonl.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def render_prometheus(self):
+        """Текущие значения в текстовом формате Prometheus"""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ','.join(f'{key}="{_escape(str(label))}"' for key, label in labels)
+                lines.append(f"{PREFIX}_{name}{suffix}{{{label_text}}} {value}" if label_text
+                             else f"{PREFIX}_{name}{suffix} {value}")
+
+        with self.lock:
+            metric('jobs_total', 'counter', "Завершённые задачи по статусу",
+                   [('', [('status', status)], count) for status, count in sorted(self.jobs.items())])
+            metric('jobs_active', 'gauge', "Выполняемые задачи", [('', [], self.active)])
+            metric('downloaded_bytes_total', 'counter', "Скачано байт завершёнными задачами",
+                   [('', [], self.bytes_total)])
+            metric('retries_total', 'counter', "Повторные попытки по виду",
+                   [('', [('kind', kind)], count) for kind, count in sorted(self.retries.items())])
+            metric('failures_total', 'counter', "Задачи, завершившиеся ошибкой, по классу ошибки",
+                   [('', [('error_class', name)], count) for name, count in sorted(self.failures.items())])
+            samples = []
+            for name in PHASES:
+                histogram = self.phases[name]
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    samples.append(('_bucket', [('phase', name), ('le', f"{bound:g}")], count))
+                samples.append(('_bucket', [('phase', name), ('le', '+Inf')], histogram.count))
+                samples.append(('_sum', [('phase', name)], f"{histogram.sum:.6f}"))
+                samples.append(('_count', [('phase', name)], histogram.count))
+            metric('phase_seconds', 'histogram', "Длительность этапов задач, секунд", samples)
+            collectors = list(self.collectors)
+        for collector in collectors:
+            for name, kind, help_text, samples in collector():
+                metric(name, kind, help_text, samples)
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Отдаёт /metrics в формате Prometheus"""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0].rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(host='127.0.0.1', port=9750, registry=None):
+    """Запускает в фоновом потоке HTTP-сервер с /metrics; возвращает сервер"""
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    server.registry = registry or METRICS
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Общий реестр метрик процесса
+METRICS = MetricsRegistry()
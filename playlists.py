@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Ленивое раскрытие плейлистов, альбомов и видеозаписей сообществ VK
+Списки видео запрашиваются у yt-dlp постранично и отдаются генератором,
+поэтому скачивание начинается после первой страницы, а весь список
+(десятки тысяч записей) никогда не хранится в памяти
+"""
+
+import re
+from urllib.parse import urlsplit, parse_qs
+
+# Плейлист или видеозаписи владельца в формате, который понимает yt-dlp:
+# vk.com/video/playlist/-123_4, vkvideo.ru/playlist/-123_4, vk.com/video/@name, vkvideo.ru/@name
+PLAYLIST_URL_RE = re.compile(
+    r'^(?:https?://)?(?:(?:m|new|www)\.)?(?:vk\.(?:com|ru)/video/|vkvideo\.ru/)'
+    r'(?:playlist/-?\d+_-?\d+|@[^/?#]+)', re.IGNORECASE)
+# Старые ссылки на видеозаписи владельца и его альбомы: vk.com/videos-123, vk.com/videos-123?section=album_4
+OWNER_VIDEOS_RE = re.compile(r'^(?:https?://)?(?:(?:m|new|www)\.)?vk\.(?:com|ru)/videos(-?\d+)/?(?:[?#]|$)',
+                             re.IGNORECASE)
+ALBUM_SECTION_RE = re.compile(r'^album_(\d+)$')
+# Видео, открытое в окне поверх списка: vk.com/videos-123?z=video-123_456 — это ссылка на одно видео
+MODAL_VIDEO_RE = re.compile(r'[?&#]z=(?:video|clip)-?\d+_\d+', re.IGNORECASE)
+# Максимальная вложенность плейлистов (плейлист со ссылками на другие плейлисты)
+MAX_DEPTH = 3
+
+
+def playlist_url(url):
+    """
+    Ссылка на список видео в виде, который понимает yt-dlp, или None,
+    если url указывает не на плейлист, альбом или видеозаписи владельца
+    """
+    if not url:
+        return None
+    url = url.strip()
+    if MODAL_VIDEO_RE.search(url):
+        return None
+    if PLAYLIST_URL_RE.match(url):
+        return url if '://' in url else 'https://' + url
+
+    match = OWNER_VIDEOS_RE.match(url)
+    if not match:
+        return None
+    owner_id = match.group(1)
+    section = (parse_qs(urlsplit(url if '://' in url else 'https://' + url).query).get('section') or [''])[0]
+    album = ALBUM_SECTION_RE.match(section)
+    if album:
+        return f"https://vk.com/video/playlist/{owner_id}_{album.group(1)}"
+    # Числовой ID владельца заменяем коротким именем: club123 для сообществ, id123 для пользователей
+    owner = f"club{owner_id[1:]}" if owner_id.startswith('-') else f"id{owner_id}"
+    return f"https://vk.com/video/@{owner}"
+
+def is_playlist_url(url):
+    """Проверяет, что url указывает на список видео, а не на одно видео"""
+    return playlist_url(url) is not None
+
+def iter_playlist(ydl, url):
+    """
+    Генератор ссылок на видео из плейлиста
+
+    Страницы списка запрашиваются по мере продвижения по генератору;
+    если url не является списком, возвращается ссылка на само видео.
+    Плейлисты глубже MAX_DEPTH уровней вложенности пропускаются с предупреждением
+    """
+    info = ydl.extract_info(playlist_url(url) or url, download=False, process=False)
+    yield from _iter_entries(ydl, info, url, MAX_DEPTH)
+
+def _iter_entries(ydl, info, url, depth):
+    kind = info.get('_type', 'video')
+    if kind in ('playlist', 'multi_video'):
+        # entries — генератор экстрактора: следующая страница загружается только при необходимости
+        for entry in info.get('entries') or ():
+            if entry:
+                yield from _iter_entries(ydl, entry, url, depth)
+    elif kind in ('url', 'url_transparent'):
+        entry_url = info.get('url')
+        if is_playlist_url(entry_url):
+            if depth > 0:
+                nested = ydl.extract_info(playlist_url(entry_url), download=False, process=False)
+                yield from _iter_entries(ydl, nested, entry_url, depth - 1)
+            else:
+                # Ссылка на список — не видео: скачивание по ней закончилось бы непонятной ошибкой
+                ydl.report_warning(f"Плейлист {entry_url} пропущен: вложенность плейлистов больше {MAX_DEPTH}")
+        elif entry_url:
+            yield entry_url
+    else:
+        yield info.get('webpage_url') or url
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Извлечение информации о видео и постобработка в пуле рабочих процессов
+Разбор HTML/JSON в экстракторах yt-dlp и работа его загрузчика с постпроцессорами
+выполняются в отдельных процессах и не конкурируют за GIL с потоками загрузки
+и интерфейсом. Сообщения yt-dlp и прогресс передаются обратно через общий канал
+(multiprocessing.Queue) и вызывают обычные обработчики в потоке, ждущем задачу
+"""
+
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from session_pool import YoutubeDLPool
+
+# Опции yt-dlp, которые не передаются в рабочий процесс: там свои обработчики
+LOCAL_PARAMS = ('logger', 'progress_hooks', 'postprocessor_hooks')
+# Поля прогресса, передаваемые из рабочего процесса (info_dict слишком велик)
+PROGRESS_KEYS = ('status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'elapsed',
+                 'eta', 'speed', 'filename', 'tmpfilename', 'fragment_index', 'fragment_count')
+# Число задач, одновременно ожидающих рабочие процессы (ячейки отмены и лимита скорости)
+MAX_TASKS = 256
+
+# Виды сообщений канала
+_LOG = 'log'
+_PROGRESS = 'progress'
+_DONE = 'done'
+
+# Состояние рабочего процесса, задаётся в _init_worker
+_events = None
+_cancelled = None
+_rates = None
+_ydl_pool = None
+
+
+def portable_params(params):
+    """Опции YoutubeDL без обработчиков и логгера, пригодные для передачи в другой процесс"""
+    return {key: value for key, value in params.items() if key not in LOCAL_PARAMS}
+
+def default_processes():
+    """Размер пула по умолчанию — число ядер процессора"""
+    return os.cpu_count() or 1
+
+
+class WorkerProcessPool:
+    """
+    Пул процессов для extract_info и process_info yt-dlp
+
+    Методы extract и process блокируют вызывающий поток до завершения задачи,
+    как и соответствующие методы YoutubeDL. Процессы запускаются при первой задаче
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes or default_processes()
+        self.lock = threading.Lock()
+        self.executor = None
+        self.events = None
+        self.tasks = {}
+        self.ids = itertools.count(1)
+        self.free_slots = list(range(MAX_TASKS))
+        self.slot_available = threading.Semaphore(MAX_TASKS)
+
+    def extract(self, ydl, url):
+        """Аналог ydl.extract_info(url, download=False); возвращает sanitize_info-словарь"""
+        return self._call(_extract, ydl, (url,))
+
+    def process(self, ydl, info):
+        """
+        Аналог ydl.process_info(info): загрузчик и постпроцессоры yt-dlp в рабочем процессе
+
+        Прогресс передаётся обработчикам ydl; исключение в обработчике отменяет
+        задачу в процессе. Ограничение скорости ydl.params['ratelimit'] передаётся
+        процессу при каждом сообщении о прогрессе. Поля, добавленные yt-dlp
+        (filepath и т.п.), копируются в info
+        """
+        info.update(self._call(_process, ydl, (ydl.sanitize_info(info),)))
+        return info
+
+    def close(self):
+        """Останавливает рабочие процессы"""
+        with self.lock:
+            executor, self.executor = self.executor, None
+            events = self.events
+        if executor is not None:
+            executor.shutdown(wait=True)
+            events.put(None)
+
+    def _start(self):
+        with self.lock:
+            if self.executor is None:
+                # spawn одинаково работает на всех платформах и безопасен при запущенных потоках
+                context = multiprocessing.get_context('spawn')
+                self.events = context.Queue()
+                self.cancelled = context.Array('b', MAX_TASKS, lock=False)
+                self.rates = context.Array('d', MAX_TASKS, lock=False)
+                self.executor = ProcessPoolExecutor(
+                    self.processes, context, _init_worker, (self.events, self.cancelled, self.rates))
+                threading.Thread(target=self._read_events, args=(self.events,), daemon=True).start()
+            return self.executor, self.events
+
+    def _discard(self, executor, events):
+        """Забывает сломанный пул: следующая задача запустит новые процессы и новый канал"""
+        with self.lock:
+            if self.executor is not executor:
+                return
+            self.executor = None
+        executor.shutdown(wait=False)
+        events.put(None)
+
+    def _read_events(self, events):
+        """Раздаёт сообщения рабочих процессов очередям ждущих задач"""
+        while True:
+            try:
+                message = events.get()
+            except Exception:
+                # Процесс, убитый во время записи, оставил в канале оборванное сообщение
+                return
+            if message is None:
+                return
+            task_id, kind, payload = message
+            with self.lock:
+                task_queue = self.tasks.get(task_id)
+            if task_queue is not None:
+                task_queue.put((kind, payload))
+
+    def _call(self, func, ydl, args):
+        executor, events = self._start()
+        self.slot_available.acquire()
+        with self.lock:
+            slot = self.free_slots.pop()
+            task_id = next(self.ids)
+            task_queue = self.tasks[task_id] = queue.Queue()
+        self.cancelled[slot] = 0
+        self.rates[slot] = ydl.params.get('ratelimit') or 0
+        try:
+            future = executor.submit(func, task_id, slot, portable_params(ydl.params), *args)
+
+            def on_done(future):
+                # Процесс мог упасть, не отправив результат в канал
+                if future.cancelled() or future.exception() is not None:
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        self._discard(executor, events)
+                    task_queue.put((_DONE, (False, 'crash', str(future.exception() or 'задача отменена'))))
+
+            future.add_done_callback(on_done)
+            return self._wait(ydl, slot, task_queue)
+        finally:
+            with self.lock:
+                del self.tasks[task_id]
+                self.free_slots.append(slot)
+            self.slot_available.release()
+
+    def _wait(self, ydl, slot, task_queue):
+        """Обрабатывает сообщения задачи в вызывающем потоке до её завершения"""
+        hook_error = None
+        while True:
+            kind, payload = task_queue.get()
+            if kind == _LOG:
+                _forward_log(ydl, *payload)
+            elif kind == _PROGRESS:
+                self.rates[slot] = ydl.params.get('ratelimit') or 0
+                if hook_error is not None:
+                    continue
+                try:
+                    for hook in ydl.params.get('progress_hooks') or ():
+                        hook(payload)
+                except BaseException as e:
+                    hook_error = e
+                    self.cancelled[slot] = 1
+            elif kind == _DONE:
+                break
+
+        if hook_error is not None:
+            raise hook_error
+        return _unwrap(payload)
+
+
+def _forward_log(ydl, level, message):
+    """Передаёт сообщение рабочего процесса логгеру ydl или на экран"""
+    logger = ydl.params.get('logger')
+    if logger is not None:
+        getattr(logger, level)(message)
+    elif level in ('warning', 'error'):
+        ydl.to_stderr(message)
+    else:
+        ydl.to_screen(message)
+
+def _unwrap(result):
+    """Значение успешной задачи или исключение, соответствующее ошибке в процессе"""
+    if result[0]:
+        return result[1]
+    from yt_dlp.utils import DownloadCancelled, DownloadError
+
+    _, kind, message = result
+    if kind == 'cancelled':
+        raise DownloadCancelled(message)
+    if kind == 'os':
+        raise OSError(message)
+    raise DownloadError(message)
+
+
+class _PipeLogger:
+    """Логгер yt-dlp в рабочем процессе: отправляет сообщения в канал"""
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+
+    def debug(self, msg):
+        _events.put((self.task_id, _LOG, ('debug', msg)))
+
+    def info(self, msg):
+        _events.put((self.task_id, _LOG, ('info', msg)))
+
+    def warning(self, msg):
+        _events.put((self.task_id, _LOG, ('warning', msg)))
+
+    def error(self, msg):
+        _events.put((self.task_id, _LOG, ('error', msg)))
+
+
+def _init_worker(events, cancelled, rates):
+    global _events, _cancelled, _rates, _ydl_pool
+    _events = events
+    _cancelled = cancelled
+    _rates = rates
+    # Процесс выполняет одну задачу за раз, ему достаточно одного «тёплого» экземпляра
+    _ydl_pool = YoutubeDLPool(max_idle=1)
+
+def _extract(task_id, slot, ydl_opts, url):
+    return _run_task(task_id, slot, ydl_opts,
+                     lambda ydl: ydl.sanitize_info(ydl.extract_info(url, download=False)))
+
+def _process(task_id, slot, ydl_opts, info):
+    def run(ydl):
+        ydl.process_info(info)
+        return ydl.sanitize_info(info)
+    return _run_task(task_id, slot, ydl_opts, run)
+
+def _run_task(task_id, slot, ydl_opts, func):
+    """Выполняет func(ydl) и отправляет результат в канал вслед за сообщениями задачи"""
+    from yt_dlp.utils import DownloadCancelled
+
+    def progress_hook(d):
+        if _cancelled[slot]:
+            raise DownloadCancelled("Скачивание отменено")
+        ydl.params['ratelimit'] = _rates[slot] or None
+        _events.put((task_id, _PROGRESS, {key: d[key] for key in PROGRESS_KEYS if key in d}))
+
+    try:
+        with _ydl_pool.lease(ydl_opts, [progress_hook], _PipeLogger(task_id)) as ydl:
+            result = (True, func(ydl))
+    except DownloadCancelled as e:
+        result = (False, 'cancelled', str(e))
+    except OSError as e:
+        result = (False, 'os', str(e))
+    except Exception as e:
+        result = (False, 'error', str(e))
+    _events.put((task_id, _DONE, result))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Канал прогресса между потоком загрузки и интерфейсом
+Поток загрузки только сохраняет последнее состояние и новые строки лога,
+а интерфейс забирает их с фиксированной частотой. Так частота обновлений
+экрана не зависит от скорости сети и числа сообщений yt-dlp
+"""
+
+import threading
+from collections import deque
+
+# Максимальное число строк лога, ожидающих выдачи интерфейсу
+MAX_PENDING_LINES = 500
+
+
+class ProgressSnapshot:
+    """Состояние загрузки в числах"""
+
+    __slots__ = ('status', 'downloaded', 'total', 'speed', 'eta')
+
+    def __init__(self, status, downloaded=0, total=None, speed=None, eta=None):
+        self.status = status
+        self.downloaded = downloaded
+        self.total = total
+        self.speed = speed
+        self.eta = eta
+
+    @classmethod
+    def from_hook(cls, d):
+        """Создаёт состояние из словаря progress_hooks yt-dlp"""
+        return cls(d['status'],
+                   d.get('downloaded_bytes') or 0,
+                   d.get('total_bytes') or d.get('total_bytes_estimate'),
+                   d.get('speed'),
+                   d.get('eta'))
+
+    @property
+    def fraction(self):
+        """Доля скачанного от 0 до 1 или None, если размер неизвестен"""
+        if not self.total:
+            return None
+        return min(1.0, self.downloaded / self.total)
+
+
+class ProgressChannel:
+    """Потокобезопасный канал: последнее состояние прогресса и ограниченный буфер строк лога"""
+
+    def __init__(self, max_pending_lines=MAX_PENDING_LINES):
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.changed = False
+        self.lines = deque(maxlen=max_pending_lines)
+        self.dropped = 0
+
+    def progress_hook(self, d):
+        """progress_hook для yt-dlp: перезаписывает последнее состояние"""
+        snapshot = ProgressSnapshot.from_hook(d)
+        with self.lock:
+            self.snapshot = snapshot
+            self.changed = True
+
+    def log(self, message):
+        """Добавляет строку лога; при переполнении отбрасываются самые старые"""
+        with self.lock:
+            if len(self.lines) == self.lines.maxlen:
+                self.dropped += 1
+            self.lines.append(message)
+
+    def drain(self):
+        """
+        Забирает накопленное с прошлого вызова
+
+        Возвращает кортеж (новое состояние или None, список строк лога, число отброшенных строк)
+        """
+        with self.lock:
+            snapshot = self.snapshot if self.changed else None
+            self.changed = False
+            lines = list(self.lines)
+            self.lines.clear()
+            dropped, self.dropped = self.dropped, 0
+        return snapshot, lines, dropped
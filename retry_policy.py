@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Повторные попытки сетевых запросов и автоматы защиты хостов (circuit breaker)
+Встроенные загрузчики повторяют не всю задачу, а часть файла или фрагмент:
+повторный запрос Range начинается с последнего полученного байта, поэтому уже
+полученные данные не теряются. Пауза между попытками растёт экспоненциально
+со случайным разбросом, чтобы повторы многих соединений не совпадали по времени.
+Автомат хоста размыкается после серии ошибок подряд: новые запросы к этому узлу
+CDN ждут окончания паузы, затем проходит один пробный запрос
+"""
+
+import asyncio
+import http.client
+import random
+import socket
+import ssl
+import threading
+import time
+import urllib.error
+from urllib.parse import urlsplit
+
+# Число повторов подряд без продвижения, после которого ошибка считается окончательной
+DEFAULT_RETRIES = 10
+# Пауза перед первым повтором и наибольшая пауза, секунд
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+# Наибольшая пауза, которую можно запросить заголовком Retry-After, секунд
+MAX_RETRY_AFTER = 300
+# HTTP-коды временных ошибок, после которых запрос стоит повторить
+RETRY_CODES = (408, 425, 429, 500, 502, 503, 504)
+# Сетевые ошибки, после которых запрос стоит повторить. Прочие OSError (например,
+# нехватка места на диске) повтором не исправить
+NETWORK_ERRORS = (urllib.error.URLError, http.client.HTTPException, ConnectionError, TimeoutError,
+                  socket.timeout, socket.gaierror, ssl.SSLError, asyncio.TimeoutError,
+                  asyncio.IncompleteReadError)
+# Ошибок подряд, после которых автомат хоста размыкается
+FAILURE_THRESHOLD = 5
+# Первая пауза разомкнутого автомата и наибольшая (удваивается после неудачной пробы), секунд
+OPEN_SECONDS = 5.0
+MAX_OPEN_SECONDS = 60.0
+# Если результат пробного запроса не сообщён за это время, разрешается новая проба
+TRIAL_TIMEOUT = 60.0
+# Интервал проверки, пока пробный запрос не завершился, секунд
+TRIAL_POLL = 0.5
+
+
+def is_retryable(error):
+    """Временная ли ошибка: сбой сети, обрыв соединения, тайм-аут или код из RETRY_CODES"""
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code in RETRY_CODES
+    return isinstance(error, NETWORK_ERRORS)
+
+def is_host_failure(error=None, status=None):
+    """Говорит ли ошибка или код ответа о сбое самого хоста (а не о запрете или отсутствии файла)"""
+    if status is not None:
+        return status >= 500 or status == 429
+    return is_retryable(error)
+
+def host_key(url):
+    """Ключ автомата: хост и порт ссылки"""
+    return urlsplit(url).netloc.lower()
+
+def _retry_after(error):
+    headers = getattr(error, 'headers', None)
+    value = headers.get('Retry-After') if headers is not None else None
+    if value and value.strip().isdigit():
+        return min(int(value), MAX_RETRY_AFTER)
+    return None
+
+
+class RetryPolicy:
+    """
+    Сколько раз и с какими паузами повторять запрос
+
+    Число попыток считается подряд без продвижения: если повтор получил
+    новые данные, счётчик сбрасывается, поэтому редкие обрывы длинной загрузки
+    не исчерпывают лимит
+    """
+
+    def __init__(self, retries=DEFAULT_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error, attempt):
+        """attempt — номер неудачной попытки подряд, начиная с 1"""
+        return attempt <= self.retries and is_retryable(error)
+
+    def delay(self, attempt, error=None):
+        """Пауза перед повтором: половина экспоненциальной паузы фиксирована, половина случайна"""
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        delay = backoff / 2 + random.uniform(0, backoff / 2)
+        retry_after = _retry_after(error)
+        return max(delay, retry_after) if retry_after else delay
+
+    def call(self, func, *args, on_retry=None):
+        """Вызывает func(*args), повторяя при временных ошибках; on_retry(ошибка, пауза) — перед паузой"""
+        attempt = 0
+        while True:
+            try:
+                return func(*args)
+            except Exception as e:
+                attempt += 1
+                if not self.should_retry(e, attempt):
+                    raise
+                delay = self.delay(attempt, e)
+                if on_retry is not None:
+                    on_retry(e, delay)
+                time.sleep(delay)
+
+    async def call_async(self, func, *args, on_retry=None):
+        """То же для сопрограммы func в цикле событий asyncio"""
+        attempt = 0
+        while True:
+            try:
+                return await func(*args)
+            except Exception as e:
+                attempt += 1
+                if not self.should_retry(e, attempt):
+                    raise
+                delay = self.delay(attempt, e)
+                if on_retry is not None:
+                    on_retry(e, delay)
+                await asyncio.sleep(delay)
+
+    def sleep_function(self, n):
+        """Пауза для retry_sleep_functions yt-dlp (n — номер повтора с 0)"""
+        return self.delay(n + 1)
+
+    def ydl_opts(self):
+        """Опции yt-dlp с тем же числом повторов и паузами для его собственного загрузчика"""
+        return {
+            'retries': self.retries,
+            'fragment_retries': self.retries,
+            'retry_sleep_functions': {'http': self.sleep_function, 'fragment': self.sleep_function},
+        }
+
+
+class CircuitBreaker:
+    """
+    Автомат одного хоста
+
+    Замкнут, пока ошибок подряд меньше threshold. После этого размыкается
+    на open_seconds: запросы ждут. Затем пропускает один пробный запрос —
+    успех замыкает автомат, ошибка снова размыкает его на вдвое больший срок
+    """
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, open_seconds=OPEN_SECONDS,
+                 max_open_seconds=MAX_OPEN_SECONDS):
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.next_open_seconds = open_seconds
+        self.failures = 0
+        self.opened_until = 0.0
+        self.trial_started = None
+
+    def delay(self, now):
+        """0, если запрос можно выполнить сейчас, иначе сколько секунд подождать"""
+        if self.failures < self.threshold:
+            return 0
+        if now < self.opened_until:
+            return self.opened_until - now
+        if self.trial_started is None or now - self.trial_started > TRIAL_TIMEOUT:
+            self.trial_started = now
+            return 0
+        return TRIAL_POLL
+
+    def success(self):
+        self.failures = 0
+        self.trial_started = None
+        self.next_open_seconds = self.open_seconds
+
+    def failure(self, now):
+        self.failures += 1
+        # Ошибки запросов, начатых до размыкания, паузу не продлевают
+        if self.failures < self.threshold or now < self.opened_until:
+            return
+        self.opened_until = now + self.next_open_seconds
+        self.next_open_seconds = min(self.max_open_seconds, self.next_open_seconds * 2)
+        self.trial_started = None
+
+
+class HostBreakers:
+    """Автоматы всех хостов процесса; потокобезопасны"""
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, open_seconds=OPEN_SECONDS,
+                 max_open_seconds=MAX_OPEN_SECONDS):
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.lock = threading.Lock()
+        self.breakers = {}
+
+    def delay(self, host):
+        """Сколько ждать перед запросом к host (0 — можно сейчас); см. CircuitBreaker.delay"""
+        with self.lock:
+            breaker = self.breakers.get(host)
+            return breaker.delay(time.monotonic()) if breaker is not None else 0
+
+    def wait(self, host):
+        """Блокирует поток, пока автомат хоста не пропустит запрос"""
+        while True:
+            delay = self.delay(host)
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    async def wait_async(self, host):
+        """То же для цикла событий asyncio"""
+        while True:
+            delay = self.delay(host)
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def success(self, host):
+        with self.lock:
+            breaker = self.breakers.get(host)
+            if breaker is not None:
+                breaker.success()
+
+    def failure(self, host):
+        with self.lock:
+            breaker = self.breakers.get(host)
+            if breaker is None:
+                breaker = self.breakers[host] = CircuitBreaker(self.threshold, self.open_seconds,
+                                                               self.max_open_seconds)
+            breaker.failure(time.monotonic())
+
+    def record(self, host, status):
+        """Учитывает ответ хоста с кодом status"""
+        if is_host_failure(status=status):
+            self.failure(host)
+        else:
+            self.success(host)
+
+
+# Политика повторов по умолчанию (один экземпляр: её опции yt-dlp входят в ключ пула YoutubeDL)
+DEFAULT_POLICY = RetryPolicy()
+# Автоматы хостов процесса
+BREAKERS = HostBreakers()
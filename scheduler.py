@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Очередь задач на скачивание: приоритет, сначала короткие, старение
+Задача встаёт в очередь после извлечения информации, когда известен ожидаемый
+объём, и ждёт одного из слотов скачивания. Слоты выдаются сначала по явному
+приоритету, а внутри приоритета — по «сроку»: времени постановки в очередь плюс
+объёму, делённому на скорость старения AGING_RATE. Поэтому клипы обгоняют
+многочасовые трансляции, но большая задача ждёт не дольше, чем её объём
+«отрабатывается» старением: всё, что поставлено в очередь позже её срока,
+пропускается после неё. Срок вычисляется один раз, поэтому очередь — обычная куча
+"""
+
+import asyncio
+import heapq
+import itertools
+import statistics
+import threading
+import time
+from collections import deque
+
+from transfer_control import DownloadCancelled
+
+# Скорость старения, байт в секунду ожидания: задача на 1 ГиБ ждёт не дольше
+# примерно 17 минут сверх задачи нулевого объёма, поставленной одновременно с ней
+AGING_RATE = 1024 * 1024
+# Объём задачи, для которой его не удалось оценить
+UNKNOWN_SIZE = 256 * 1024 * 1024
+# Сколько задач на один слот извлекают информацию заранее, чтобы было из чего выбирать
+LOOKAHEAD = 2
+# Сколько последних ожиданий хранится для медианы и 95-го перцентиля
+WAIT_SAMPLES = 1000
+
+
+class Ticket:
+    """Место задачи в очереди JobScheduler"""
+
+    def __init__(self, key, priority, size, on_grant):
+        self.key = key
+        self.priority = priority
+        self.size = size
+        self.on_grant = on_grant
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.left = False
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+class JobScheduler:
+    """
+    Слоты скачивания для задач одного процесса; потокобезопасен
+
+    Потоки, которые сами извлекают информацию перед enter(), занимают на это время
+    extract_slots. enter() ставит задачу в очередь, wait() или wait_async() ждут слота,
+    leave() освобождает слот или убирает задачу из очереди. stats() — глубина
+    очереди и статистика ожидания
+    """
+
+    def __init__(self, slots, aging_rate=AGING_RATE):
+        self.slots = max(1, slots)
+        self.aging_rate = aging_rate
+        self.lock = threading.Lock()
+        self.heap = []
+        self.order = itertools.count()
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.granted_total = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        # Одновременных извлечений информации не больше, чем слотов: задачи, извлекающие
+        # её заранее, не отнимают процессор у тех, что уже дождались слота
+        self.extract_slots = threading.BoundedSemaphore(self.slots)
+
+    def enter(self, priority=0, size=None, on_grant=None):
+        """
+        Ставит задачу с приоритетом priority (больше — раньше) и ожидаемым объёмом size в очередь
+
+        on_grant() вызывается под блокировкой очереди, когда задаче выдан слот
+        """
+        size = size or UNKNOWN_SIZE
+        now = time.monotonic()
+        key = (-priority, now + size / self.aging_rate, next(self.order))
+        ticket = Ticket(key, priority, size, on_grant)
+        with self.lock:
+            heapq.heappush(self.heap, ticket)
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            self._dispatch()
+        return ticket
+
+    def wait(self, ticket, control=None):
+        """
+        Блокирует поток до выдачи слота
+
+        control (transfer_control.TransferControl) прерывает ожидание отменой: задача
+        уходит из очереди и вызывается DownloadCancelled
+        """
+        granted = threading.Event()
+        with self.lock:
+            if ticket.granted_at is not None:
+                return
+            ticket.on_grant = granted.set
+        if control is not None:
+            control.add_listener(granted.set)
+        try:
+            granted.wait()
+        finally:
+            if control is not None:
+                control.remove_listener(granted.set)
+        if ticket.granted_at is None:
+            self.leave(ticket)
+            raise DownloadCancelled("Скачивание отменено")
+
+    async def wait_async(self, ticket):
+        """То же для цикла событий asyncio; отмена сопрограммы убирает задачу из очереди"""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def on_grant():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        with self.lock:
+            if ticket.granted_at is not None:
+                return
+            ticket.on_grant = on_grant
+        try:
+            await granted
+        except asyncio.CancelledError:
+            self.leave(ticket)
+            raise
+
+    def leave(self, ticket):
+        """Освобождает слот задачи или убирает её из очереди; повторный вызов ничего не делает"""
+        with self.lock:
+            if ticket.left:
+                return
+            ticket.left = True
+            if ticket.granted_at is not None:
+                self.running -= 1
+            else:
+                # Из кучи задача удаляется, когда дойдёт до её вершины
+                self.queued -= 1
+            self._dispatch()
+
+    def stats(self):
+        """Глубина очереди, занятые слоты и время ожидания слота (секунд) последних задач"""
+        with self.lock:
+            waits = sorted(self.waits)
+            now = time.monotonic()
+            oldest = min((t.enqueued_at for t in self.heap if not t.left), default=None)
+            return {
+                'slots': self.slots,
+                'queued': self.queued,
+                'running': self.running,
+                'max_queued': self.max_queued,
+                'granted_total': self.granted_total,
+                'wait_median': statistics.median(waits) if waits else None,
+                'wait_p95': waits[int(len(waits) * 0.95)] if waits else None,
+                'wait_max': waits[-1] if waits else None,
+                'wait_sum': sum(waits),
+                'wait_count': len(waits),
+                'oldest_wait': now - oldest if oldest is not None else None,
+            }
+
+    def prometheus_metrics(self):
+        """Метрики очереди для metrics.MetricsRegistry.add_collector"""
+        stats = self.stats()
+        quantiles = [('', [('quantile', '0.5')], stats['wait_median'] or 0),
+                     ('', [('quantile', '0.95')], stats['wait_p95'] or 0),
+                     ('_sum', [], f"{stats['wait_sum']:.6f}"), ('_count', [], stats['wait_count'])]
+        return [
+            ('scheduler_queued', 'gauge', "Задачи, ожидающие слота скачивания", [('', [], stats['queued'])]),
+            ('scheduler_running', 'gauge', "Занятые слоты скачивания", [('', [], stats['running'])]),
+            ('scheduler_oldest_wait_seconds', 'gauge', "Ожидание самой давней задачи в очереди, секунд",
+             [('', [], f"{stats['oldest_wait'] or 0:.3f}")]),
+            ('scheduler_wait_seconds', 'summary',
+             f"Ожидание слота последними {WAIT_SAMPLES} задачами, секунд", quantiles),
+        ]
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self.heap and self.running < self.slots:
+            ticket = heapq.heappop(self.heap)
+            if ticket.left:
+                continue
+            self.queued -= 1
+            self.running += 1
+            self.granted_total += 1
+            ticket.granted_at = now
+            self.waits.append(now - ticket.enqueued_at)
+            if ticket.on_grant is not None:
+                ticket.on_grant()
+        # Задачи, ушедшие из очереди, не копятся в куче, пока все слоты заняты
+        if self.heap and len(self.heap) > 2 * self.queued + self.slots:
+            self.heap = [t for t in self.heap if not t.left]
+            heapq.heapify(self.heap)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Многопоточное скачивание одного файла по частям (HTTP Range)
+Используется для прогрессивных MP4, которые CDN отдаёт одним файлом
+"""
+
+import os
+import re
+import time
+import threading
+
+from content_store import ContentHasher
+from file_sink import FileSink
+from metrics import METRICS
+from retry_policy import DEFAULT_POLICY
+from session_pool import HTTP_POOL
+from transfer_control import DownloadCancelled, TransferControl, TransferPaused, remove_partial
+
+# Число параллельных соединений по умолчанию
+DEFAULT_CONNECTIONS = 4
+# Файлы меньше этого размера на части не делятся
+MIN_SEGMENT_SIZE = 1024 * 1024
+# Размер блока чтения из сокета
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+)')
+
+
+class RangeNotSupported(DownloadCancelled):
+    """Сервер ответил на запрос Range всем файлом, а не его частью (206)"""
+
+
+def is_supported(info):
+    """Проверяет, что выбранный yt-dlp формат — один прогрессивный HTTP-файл"""
+    return (info.get('protocol') in ('http', 'https')
+            and bool(info.get('url'))
+            and not info.get('requested_formats')
+            and not info.get('is_live'))
+
+def format_bytes(num):
+    """Человекочитаемый размер в байтах"""
+    if num is None:
+        return 'Неизвестно'
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(num) < 1024 or unit == 'GiB':
+            return f"{num:.2f}{unit}" if unit != 'B' else f"{num:.0f}B"
+        num /= 1024.0
+
+def progress_dict(status, filename, downloaded, total_size, started, estimated=False):
+    """Словарь прогресса в формате progress_hooks yt-dlp"""
+    elapsed = max(time.monotonic() - started, 1e-6)
+    speed = downloaded / elapsed
+    eta = None
+    if total_size and speed:
+        eta = max(0, int((total_size - downloaded) / speed))
+    percent = min(100.0, downloaded * 100.0 / total_size) if total_size else None
+
+    return {
+        'status': status,
+        'filename': filename,
+        'downloaded_bytes': downloaded,
+        'total_bytes_estimate' if estimated else 'total_bytes': total_size,
+        'elapsed': elapsed,
+        'speed': speed,
+        'eta': eta,
+        '_percent_str': f"{percent:.1f}%" if percent is not None else 'Неизвестно',
+        '_speed_str': f"{format_bytes(speed)}/s",
+        '_eta_str': f"{eta // 60:02d}:{eta % 60:02d}" if eta is not None else 'Неизвестно',
+    }
+
+def plan_segments(total_size, connections, min_segment_size=MIN_SEGMENT_SIZE):
+    """
+    Делит файл на диапазоны байтов для параллельного скачивания
+
+    Возвращает список пар [start, end] (end включительно)
+    """
+    if total_size <= 0:
+        return []
+    count = max(1, min(connections, total_size // min_segment_size or 1))
+    step = total_size // count
+    segments = []
+    for i in range(count):
+        start = i * step
+        end = total_size - 1 if i == count - 1 else start + step - 1
+        segments.append([start, end])
+    return segments
+
+def probe_range_support(url, headers=None, timeout=30):
+    """
+    Запрашивает первый байт файла и определяет размер и поддержку Range
+
+    Возвращает кортеж (total_size или None, supports_ranges)
+    """
+    request_headers = dict(headers or {})
+    request_headers['Range'] = 'bytes=0-0'
+    with HTTP_POOL.open(url, request_headers, timeout) as response:
+        if response.status == 206:
+            match = CONTENT_RANGE_RE.search(response.headers.get('Content-Range', ''))
+            if match:
+                # Дочитываем единственный байт, чтобы соединение вернулось в пул
+                response.read()
+                return int(match.group(3)), True
+        length = response.headers.get('Content-Length')
+        return (int(length) if length and length.isdigit() else None), False
+
+
+class SegmentedDownloader:
+    """
+    Скачивает файл в несколько соединений, записывая части сразу на свои места
+
+    Прогресс каждой части передаётся в on_checkpoint(downloaded, total_size, state);
+    сохранённый state можно передать как resume_state, чтобы продолжить загрузку
+    из существующего .part-файла запросами Range. Скорость всех соединений
+    ограничивается общим throttle (bandwidth.JobThrottle), а запись на диск
+    выполняется по fsync_policy (file_sink.FsyncPolicy). С hash_content=True
+    по ходу записи считается хеш содержимого (content_store), он доступен
+    в content_hash после скачивания. Временные ошибки соединения повторяются
+    по retry_policy (retry_policy.RetryPolicy) для каждой части отдельно.
+    control (transfer_control.TransferControl) ставит загрузку на паузу с закрытием
+    соединений и отменяет её, удаляя .part-файл
+    """
+
+    def __init__(self, url, filename, headers=None, connections=DEFAULT_CONNECTIONS,
+                 progress_hooks=None, timeout=30, resume_state=None, on_checkpoint=None,
+                 throttle=None, fsync_policy=None, hash_content=False, retry_policy=None, control=None):
+        self.url = url
+        self.filename = filename
+        self.headers = dict(headers or {})
+        self.connections = max(1, connections)
+        self.progress_hooks = list(progress_hooks or [])
+        self.timeout = timeout
+        self.resume_state = resume_state
+        self.on_checkpoint = on_checkpoint
+        self.throttle = throttle
+        self.fsync_policy = fsync_policy
+        self.retry_policy = retry_policy or DEFAULT_POLICY
+        self.control = control or TransferControl()
+        self.hasher = ContentHasher() if hash_content else None
+        self.content_hash = None
+        self.total_size = None
+        self.segments = []
+        self.downloaded = 0
+        self.started = None
+        self.lock = threading.Lock()
+        self.abort = threading.Event()
+
+    def download(self):
+        """Скачивает файл и возвращает его размер в байтах"""
+        tmp_filename = self.filename + '.part'
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.started = time.monotonic()
+        self.control.add_listener(self.abort.set)
+        try:
+            self._download_part(tmp_filename)
+        except Exception:
+            if self.control.discards_partial:
+                remove_partial(self.filename)
+            raise
+        finally:
+            self.control.remove_listener(self.abort.set)
+
+        os.replace(tmp_filename, self.filename)
+        if self.hasher is not None:
+            self.content_hash = self.hasher.hexdigest(os.path.getsize(self.filename))
+        self._report('finished')
+        return self.downloaded
+
+    def _download_part(self, tmp_filename):
+        """Скачивает файл в tmp_filename"""
+        self.control.wait()
+        self.total_size, supports_ranges = self.retry_policy.call(probe_range_support, self.url, self.headers,
+                                                                  self.timeout)
+
+        completed = False
+        if supports_ranges and self.total_size:
+            self.segments = self._resumed_segments(tmp_filename)
+            sink = FileSink(tmp_filename, self.fsync_policy, resume=bool(self.segments), hasher=self.hasher)
+            try:
+                if self.segments:
+                    self.downloaded = sum(done for _, _, done in self.segments)
+                    for start, _, done in self.segments:
+                        sink.hash_existing(start, done)
+                else:
+                    # Заранее выделяем место под весь файл, чтобы потоки писали по своим смещениям
+                    self.segments = [[start, end, 0] for start, end in plan_segments(self.total_size, self.connections)]
+                    sink.preallocate(self.total_size)
+                self._run_segments(sink)
+                completed = True
+            finally:
+                sink.close(completed)
+        else:
+            # Сервер не поддерживает Range — качаем одним потоком с начала
+            sink = FileSink(tmp_filename, self.fsync_policy, hasher=self.hasher)
+            try:
+                if self.total_size:
+                    sink.preallocate(self.total_size)
+                self._fetch(sink, None)
+                # Content-Length мог не совпасть с телом ответа
+                sink.truncate(self.downloaded)
+                completed = True
+            finally:
+                sink.close(completed)
+
+    def stream(self, sink):
+        """
+        Скачивает файл одним соединением и передаёт байты в sink (stream_sink) по мере получения
+
+        Части по смещениям здесь не подходят: получатель читает поток строго по порядку.
+        Возвращает число переданных байт
+        """
+        self.started = time.monotonic()
+        with HTTP_POOL.open(self.url, self.headers, self.timeout) as response:
+            length = response.headers.get('Content-Length')
+            self.total_size = int(length) if length and length.isdigit() else None
+            self._copy(response, sink)
+        self._report('finished')
+        return self.downloaded
+
+    def _resumed_segments(self, tmp_filename):
+        """Части из сохранённого состояния, если оно соответствует файлу на сервере и на диске"""
+        state = self.resume_state
+        if not state or state.get('total_size') != self.total_size:
+            return None
+        if not os.path.exists(tmp_filename) or os.path.getsize(tmp_filename) != self.total_size:
+            return None
+        return [list(segment) for segment in state.get('segments') or []] or None
+
+    def _run_segments(self, sink):
+        errors = []
+
+        def worker(segment):
+            try:
+                self._fetch(sink, segment)
+            except BaseException as e:
+                errors.append(e)
+                self.abort.set()
+
+        threads = [threading.Thread(target=worker, args=(segment,), daemon=True)
+                   for segment in self.segments if segment[0] + segment[2] <= segment[1]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self._checkpoint(force=True)
+        if errors:
+            raise errors[0]
+
+    def _fetch(self, sink, segment):
+        """
+        Скачивает часть [start, end, done] (или весь файл, если segment is None) в sink (FileSink)
+
+        После временной ошибки часть продолжается запросом Range с первого
+        незаписанного байта; счётчик попыток сбрасывается, если повтор продвинулся.
+        После паузы часть продолжается так же. Файл без поддержки Range приходится скачивать заново
+        """
+        attempt = 0
+        while True:
+            done = segment[2] if segment is not None else 0
+            try:
+                self._fetch_once(sink, segment)
+                return
+            except TransferPaused:
+                if segment is None:
+                    with self.lock:
+                        self.downloaded = 0
+                self.control.wait()
+            except Exception as e:
+                if segment is not None and segment[0] + segment[2] > segment[1]:
+                    # Ошибка после последнего байта части
+                    return
+                attempt = 1 if segment is not None and segment[2] > done else attempt + 1
+                if not self.retry_policy.should_retry(e, attempt):
+                    raise
+                METRICS.count_retry('segment')
+                if segment is None:
+                    with self.lock:
+                        self.downloaded = 0
+                if self.abort.wait(self.retry_policy.delay(attempt, e)):
+                    raise DownloadCancelled("Скачивание прервано")
+
+    def _fetch_once(self, sink, segment):
+        headers = dict(self.headers)
+        if segment is not None:
+            start, end, done = segment
+            headers['Range'] = f'bytes={start + done}-{end}'
+
+        with self.control.open(self.url, headers, self.timeout) as response:
+            if segment is not None and response.status != 206:
+                raise RangeNotSupported("Сервер перестал поддерживать загрузку по частям")
+            if segment is None and self.total_size is None:
+                length = response.headers.get('Content-Length')
+                self.total_size = int(length) if length and length.isdigit() else None
+
+            writer = sink.writer(0 if segment is None else segment[0] + segment[2])
+            try:
+                self._copy(response, writer, segment)
+            finally:
+                # Остаток буфера полученных данных записывается и при ошибке соединения
+                flushed = writer.flush()
+                if segment is not None:
+                    with self.lock:
+                        segment[2] += flushed
+
+    def _copy(self, response, out, segment=None):
+        """
+        Переносит тело ответа в out блоками CHUNK_SIZE, учитывая прогресс и лимит скорости
+
+        В состояние части (segment) засчитываются только байты, которые out
+        (file_sink.SegmentWriter) уже передал ОС: они не пропадут при аварийном
+        завершении процесса и корректно продолжаются после перезапуска
+        """
+        while True:
+            if self.abort.is_set():
+                raise DownloadCancelled("Скачивание прервано")
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            flushed = out.write(chunk)
+            if self.throttle:
+                self.throttle.consume(len(chunk))
+            with self.lock:
+                self.downloaded += len(chunk)
+                if segment is not None:
+                    segment[2] += flushed
+            self._report('downloading')
+            self._checkpoint()
+
+    def _checkpoint(self, force=False):
+        if not self.on_checkpoint or not self.segments:
+            return
+        with self.lock:
+            state = {
+                'total_size': self.total_size,
+                'segments': [list(segment) for segment in self.segments],
+            }
+            downloaded = self.downloaded
+        self.on_checkpoint(downloaded, self.total_size, state, force)
+
+    def _report(self, status):
+        if not self.progress_hooks:
+            return
+        with self.lock:
+            downloaded = self.downloaded
+        d = progress_dict(status, self.filename, downloaded, self.total_size, self.started)
+        for hook in self.progress_hooks:
+            hook(d)
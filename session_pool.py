@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Пулы переиспользуемых сетевых сессий
+- HTTPConnectionPool: keep-alive соединения к VK и CDN для встроенных загрузчиков
+- YoutubeDLPool: «тёплые» экземпляры YoutubeDL с уже инициализированными
+  экстракторами, cookie и соединениями
+Оба пула потокобезопасны и переиспользуют ресурсы между задачами
+"""
+
+import socket
+import ssl
+import sys
+import threading
+import http.client
+import urllib.error
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urljoin
+
+from retry_policy import BREAKERS, host_key
+
+# Максимальное число простаивающих соединений к одному хосту
+MAX_IDLE_PER_HOST = 16
+# Максимальное число переходов по редиректам
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+# Ошибки, означающие, что сервер закрыл простаивающее keep-alive соединение
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                           ConnectionResetError, BrokenPipeError)
+
+
+class PooledResponse:
+    """Ответ сервера; после полного чтения соединение возвращается в пул"""
+
+    def __init__(self, pool, key, conn, response, url):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.aborted = False
+
+    def read(self, amt=None):
+        try:
+            data = self.response.read(amt)
+            if not data and self.aborted and self.response.length != 0:
+                raise ConnectionAbortedError("Соединение закрыто до конца ответа")
+            if amt and not data and self.response.length:
+                # http.client при чтении по amt байт не сообщает о закрытии соединения до конца тела
+                raise http.client.IncompleteRead(b'', self.response.length)
+        except (OSError, http.client.HTTPException):
+            # Обрыв посреди тела — тоже сбой хоста для его автомата (но не закрытие самой программой);
+            # соединение в пул не возвращается
+            if not self.aborted:
+                BREAKERS.failure(host_key(self.url))
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            raise
+        if self.conn is not None and self.response.isclosed():
+            self._release()
+        return data
+
+    def geturl(self):
+        return self.url
+
+    def abort(self):
+        """
+        Прерывает ответ из другого потока (пауза, отмена загрузки)
+
+        Чтение, ожидающее данных, сразу завершается ошибкой; соединение закрывается
+        """
+        self.aborted = True
+        conn = self.conn
+        sock = conn.sock if conn is not None else None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        """Закрывает ответ; недочитанное соединение нельзя переиспользовать, оно закрывается"""
+        if self.conn is None:
+            return
+        if self.response.isclosed():
+            self._release()
+        else:
+            self.conn.close()
+            self.conn = None
+
+    def _release(self):
+        conn, self.conn = self.conn, None
+        if self.response.will_close or self.aborted:
+            conn.close()
+        else:
+            self.pool._put(self.key, conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HTTPConnectionPool:
+    """Пул keep-alive соединений HTTP/1.1, сгруппированных по хосту"""
+
+    def __init__(self, max_idle_per_host=MAX_IDLE_PER_HOST):
+        self.max_idle_per_host = max_idle_per_host
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.ssl_context = ssl.create_default_context()
+
+    def open(self, url, headers=None, timeout=30):
+        """
+        Выполняет GET-запрос и возвращает PooledResponse
+
+        Редиректы обрабатываются автоматически, ответы с кодом 4xx/5xx
+        вызывают urllib.error.HTTPError, как и urllib.request.urlopen.
+        Пока автомат хоста разомкнут (retry_policy.BREAKERS), запрос ждёт
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            host = host_key(url)
+            BREAKERS.wait(host)
+            try:
+                response = self._request(url, headers or {}, timeout)
+            except (OSError, http.client.HTTPException):
+                BREAKERS.failure(host)
+                raise
+            BREAKERS.record(host, response.status)
+            if response.status in REDIRECT_CODES and response.headers.get('Location'):
+                response.read()
+                response.close()
+                url = urljoin(url, response.headers['Location'])
+                continue
+            if response.status >= 400:
+                body = response.read()
+                response.close()
+                raise urllib.error.HTTPError(url, response.status, response.reason,
+                                             response.headers, None) from _body_error(body)
+            return response
+        raise urllib.error.URLError(f"Слишком много редиректов: {url}")
+
+    def clear(self):
+        """Закрывает все простаивающие соединения"""
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+    def _request(self, url, headers, timeout):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        while True:
+            conn, reused = self._get(key, timeout)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                # Сервер закрыл простаивавшее соединение — пробуем новое
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            return PooledResponse(self, key, conn, response, url)
+
+    def _get(self, key, timeout):
+        with self.lock:
+            connections = self.idle.get(key)
+            conn = connections.pop() if connections else None
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+
+        scheme, host, port = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=timeout, context=self.ssl_context), False
+        if scheme == 'http':
+            return http.client.HTTPConnection(host, port, timeout=timeout), False
+        raise urllib.error.URLError(f"Неподдерживаемая схема URL: {scheme}")
+
+    def _put(self, key, conn):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle_per_host:
+                connections.append(conn)
+                return
+        conn.close()
+
+
+def _body_error(body):
+    """Исключение с началом тела ответа об ошибке (для диагностики)"""
+    return Exception(body[:200].decode('utf-8', 'replace')) if body else None
+
+
+# Общий пул соединений процесса
+HTTP_POOL = HTTPConnectionPool()
+
+
+class _Dispatcher:
+    """
+    Передаёт события yt-dlp обработчикам текущей задачи
+
+    Пул создаёт YoutubeDL с одним постоянным progress_hook и логгером,
+    а обработчики конкретной задачи подставляются на время аренды экземпляра
+    """
+
+    def __init__(self, quiet=False):
+        self.hooks = []
+        self.logger = None
+        # yt-dlp с логгером передаёт ему вывод на экран независимо от quiet
+        self.quiet = quiet
+
+    def progress_hook(self, d):
+        for hook in self.hooks:
+            hook(d)
+
+    def debug(self, msg):
+        if self.logger:
+            self.logger.debug(msg)
+        elif not self.quiet and not msg.startswith('[debug] '):
+            print(msg)
+
+    def info(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+        elif not self.quiet:
+            print(msg)
+
+    def warning(self, msg):
+        if self.logger:
+            self.logger.warning(msg)
+        else:
+            print(msg, file=sys.stderr)
+
+    def error(self, msg):
+        if self.logger:
+            self.logger.error(msg)
+        else:
+            print(msg, file=sys.stderr)
+
+
+class YoutubeDLPool:
+    """Пул экземпляров YoutubeDL, сгруппированных по набору опций"""
+
+    def __init__(self, yt_dlp=None, max_idle=8):
+        self.yt_dlp = yt_dlp
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    @contextmanager
+    def lease(self, ydl_opts, progress_hooks=(), logger=None):
+        """
+        Выдаёт YoutubeDL с опциями ydl_opts в монопольное пользование на время блока with
+
+        progress_hooks и logger действуют только в пределах этой аренды
+        """
+        key = repr(sorted(ydl_opts.items()))
+        with self.lock:
+            instances = self.idle.get(key)
+            ydl, dispatcher = instances.pop() if instances else (None, None)
+
+        if ydl is None:
+            if self.yt_dlp is None:
+                import yt_dlp
+                self.yt_dlp = yt_dlp
+            dispatcher = _Dispatcher(bool(ydl_opts.get('quiet')))
+            opts = dict(ydl_opts, progress_hooks=[dispatcher.progress_hook], logger=dispatcher)
+            ydl = self.yt_dlp.YoutubeDL(opts)
+
+        dispatcher.hooks = list(progress_hooks)
+        dispatcher.logger = logger
+        reusable = False
+        try:
+            yield ydl
+            reusable = True
+        except Exception:
+            # Ошибка задачи не портит экземпляр, его можно переиспользовать
+            reusable = True
+            raise
+        finally:
+            dispatcher.hooks = []
+            dispatcher.logger = None
+            ydl.params['ratelimit'] = ydl_opts.get('ratelimit')
+            if reusable:
+                self._put(key, ydl, dispatcher)
+            else:
+                ydl.close()
+
+    def close(self):
+        """Закрывает все простаивающие экземпляры"""
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for instances in idle.values():
+            for ydl, _ in instances:
+                ydl.close()
+
+    def _put(self, key, ydl, dispatcher):
+        with self.lock:
+            instances = self.idle.setdefault(key, [])
+            if len(instances) < self.max_idle:
+                instances.append((ydl, dispatcher))
+                return
+        ydl.close()
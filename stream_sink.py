@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Приёмники потокового режима: байты видео передаются получателю по мере скачивания
+Получатель — stdout, именованный канал (или обычный файл) либо запущенная программа,
+читающая stdin. При необходимости поток перепаковывается через ffmpeg на лету.
+Запись в приёмник последовательная, поэтому загрузчики передают ему данные строго по порядку
+"""
+
+import os
+import sys
+import shutil
+import subprocess
+import threading
+
+from segmented_download import CHUNK_SIZE
+
+# Форматы перепаковки: имя → аргументы вывода ffmpeg. MP4 пишется фрагментированным:
+# обычному MP4 нужен индекс в начале файла, а записать его можно только после всех данных
+REMUX_FORMATS = {
+    'mpegts': ['-f', 'mpegts'],
+    'mp4': ['-bsf:a', 'aac_adtstoasc', '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-f', 'mp4'],
+    'mkv': ['-f', 'matroska'],
+}
+
+
+class StreamError(Exception):
+    """Поток нельзя передать получателю: он закрыл канал, завершился или недоступен ffmpeg"""
+
+
+class StreamSink:
+    """
+    Приёмник, пишущий в stdout ('-'), именованный канал или файл
+
+    Канал открывается при первой записи: открытие FIFO ждёт читателя, а к этому
+    моменту информация о видео уже извлечена
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self.out = None
+        self.written = 0
+        if target == '-':
+            # Буфер stdout запоминается сразу: потом sys.stdout перенаправляют в stderr
+            self.out = sys.stdout.buffer
+
+    def __str__(self):
+        return 'stdout' if self.target == '-' else self.target
+
+    def write(self, data):
+        """Передаёт очередную порцию байт получателю"""
+        if not data:
+            return
+        if self.out is None:
+            self.out = self._open()
+        try:
+            self.out.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            self._abandon()
+            raise StreamError(f"Получатель потока ({self}) закрыл канал")
+        self.written += len(data)
+
+    def write_file(self, path):
+        """Передаёт получателю содержимое готового файла"""
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                self.write(chunk)
+
+    def close(self):
+        """Завершает поток: получатель видит конец данных"""
+        if self.out is None:
+            return
+        try:
+            if self.target == '-':
+                self.out.flush()
+            else:
+                self.out.close()
+        except (BrokenPipeError, ConnectionResetError):
+            self._abandon()
+
+    def _open(self):
+        try:
+            return open(self.target, 'wb')
+        except OSError as e:
+            raise StreamError(f"Не удалось открыть {self.target}: {e}")
+
+    def _abandon(self):
+        if self.target == '-':
+            # Иначе Python при выходе повторно сбросит буфер в закрытый канал и выведет ошибку
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, self.out.fileno())
+            os.close(devnull)
+
+
+class ProcessSink(StreamSink):
+    """Приёмник, передающий поток на stdin запущенной команды (например, 'mpv -' или 'ffplay -')"""
+
+    def __init__(self, command):
+        super().__init__(command)
+        self.process = None
+
+    def __str__(self):
+        return f"«{self.target}»"
+
+    def close(self):
+        """Закрывает stdin команды и ждёт её завершения; StreamError, если она завершилась с ошибкой"""
+        if self.process is None:
+            return
+        super().close()
+        code = self.process.wait()
+        if code != 0:
+            raise StreamError(f"Команда «{self.target}» завершилась с кодом {code}")
+
+    def _open(self):
+        try:
+            self.process = subprocess.Popen(self.target, shell=True, stdin=subprocess.PIPE)
+        except OSError as e:
+            raise StreamError(f"Не удалось запустить «{self.target}»: {e}")
+        return self.process.stdin
+
+    def _abandon(self):
+        pass
+
+
+class RemuxSink:
+    """
+    Перепаковка потока через ffmpeg без перекодирования
+
+    ffmpeg читает исходный поток со stdin, а отдельный поток программы передаёт
+    его вывод следующему приёмнику
+    """
+
+    def __init__(self, sink, remux_format):
+        self.sink = sink
+        self.remux_format = remux_format
+        self.written = 0
+        self.process = None
+        self.pump = None
+        self.error = None
+        # Ошибка уже передана пишущему в write и при закрытии не повторяется
+        self.failed = False
+
+    def __str__(self):
+        return f"ffmpeg ({self.remux_format}) → {self.sink}"
+
+    def write(self, data):
+        if not data:
+            return
+        if self.process is None:
+            self._start()
+        try:
+            if self.error is not None:
+                raise self.error
+            try:
+                self.process.stdin.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                # ffmpeg завершился: либо закрыт канал получателя, либо поток не удалось разобрать
+                self.pump.join()
+                raise self.error or StreamError("ffmpeg прервал перепаковку потока")
+        except StreamError:
+            self.failed = True
+            raise
+        self.written += len(data)
+
+    def write_file(self, path):
+        StreamSink.write_file(self, path)
+
+    def close(self):
+        """Дожидается, пока ffmpeg передаст остаток потока, и закрывает следующий приёмник"""
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            self.pump.join()
+            code = self.process.wait()
+            if self.error is None and code != 0:
+                self.error = StreamError(f"ffmpeg завершился с кодом {code}")
+        try:
+            self.sink.close()
+        finally:
+            if self.error is not None and not self.failed:
+                raise self.error
+
+    def _start(self):
+        ffmpeg = shutil.which('ffmpeg')
+        if not ffmpeg:
+            raise StreamError("Для перепаковки потока нужен ffmpeg")
+        command = [ffmpeg, '-loglevel', 'error', '-i', 'pipe:0', '-c', 'copy',
+                   *REMUX_FORMATS[self.remux_format], 'pipe:1']
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.pump = threading.Thread(target=self._pump, daemon=True)
+        self.pump.start()
+
+    def _pump(self):
+        try:
+            while True:
+                chunk = self.process.stdout.read1(CHUNK_SIZE)
+                if not chunk:
+                    return
+                self.sink.write(chunk)
+        except StreamError as e:
+            self.error = e
+            # Закрытие вывода останавливает ffmpeg, и запись в его stdin прерывается
+            self.process.stdout.close()
+
+
+def open_sink(target=None, command=None, remux_format=None):
+    """
+    Создаёт приёмник потока: target — '-' (stdout) или путь к каналу/файлу,
+    command — команда, получающая поток на stdin; remux_format — ключ REMUX_FORMATS
+    """
+    sink = ProcessSink(command) if command else StreamSink(target)
+    if remux_format:
+        if not shutil.which('ffmpeg'):
+            raise StreamError("Для перепаковки потока нужен ffmpeg")
+        sink = RemuxSink(sink, remux_format)
+    return sink
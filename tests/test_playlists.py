@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Распознавание ссылок на плейлисты и видеозаписи владельца
+Запуск: python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from playlists import MAX_DEPTH, is_playlist_url, iter_playlist, playlist_url
+from vk_video_downloader import normalize_vk_url
+
+
+class PlaylistUrlTest(unittest.TestCase):
+
+    def test_playlists(self):
+        self.assertEqual(playlist_url("https://vk.com/video/playlist/-123_4"),
+                         "https://vk.com/video/playlist/-123_4")
+        self.assertEqual(playlist_url("https://vk.com/videos-123"), "https://vk.com/video/@club123")
+        self.assertEqual(playlist_url("vk.com/videos-123?section=album_4"),
+                         "https://vk.com/video/playlist/-123_4")
+        self.assertTrue(is_playlist_url("https://vkvideo.ru/@club1"))
+
+    def test_single_video(self):
+        self.assertFalse(is_playlist_url("https://vk.com/video-123_456"))
+        self.assertFalse(is_playlist_url("-123_456"))
+
+    def test_video_in_modal_window(self):
+        # Видео, открытое поверх страницы видеозаписей, — одно видео, а не весь канал
+        for url, video in (("https://vk.com/videos-123?z=video-123_456", "https://vk.com/video-123_456"),
+                           ("https://vk.com/video/@club1?z=video-1_2", "https://vk.com/video-1_2"),
+                           ("https://vkvideo.ru/@club1?z=clip-1_2%2Fpl_cat", "https://vk.com/clip-1_2")):
+            with self.subTest(url=url):
+                self.assertFalse(is_playlist_url(url))
+                self.assertEqual(normalize_vk_url(url), video)
+
+
+class NestedPlaylistYDL:
+    """Заменяет YoutubeDL: каждый плейлист содержит одно видео и ссылку на следующий плейлист"""
+
+    def __init__(self):
+        self.warnings = []
+
+    def extract_info(self, url, download=False, process=False):
+        level = int(url.rsplit('_', 1)[1])
+        return {'_type': 'playlist', 'entries': [
+            {'_type': 'url', 'url': f"https://vk.com/video-1_{level}"},
+            {'_type': 'url', 'url': f"https://vk.com/video/playlist/-1_{level + 1}"},
+        ]}
+
+    def report_warning(self, message):
+        self.warnings.append(message)
+
+
+class IterPlaylistTest(unittest.TestCase):
+
+    def test_too_deeply_nested_playlist_is_skipped(self):
+        ydl = NestedPlaylistYDL()
+        urls = list(iter_playlist(ydl, "https://vk.com/video/playlist/-1_0"))
+        self.assertEqual(urls, [f"https://vk.com/video-1_{level}" for level in range(MAX_DEPTH + 1)])
+        self.assertEqual(len(ydl.warnings), 1)
+        self.assertIn(f"video/playlist/-1_{MAX_DEPTH + 1}", ydl.warnings[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
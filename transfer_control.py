@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Пауза и отмена загрузки на уровне соединений
+Пауза не держит поток загрузки внутри обработчика прогресса с открытым
+соединением: ответы, которые читаются в этот момент, закрываются, а загрузчики
+ждут продолжения без соединений и затем запрашивают Range с первого
+незаписанного байта. Отмена закрывает соединения сразу, не дожидаясь
+следующего блока данных, и загрузчики удаляют недокачанные .part-файлы.
+Прерывание при закрытии программы останавливает загрузку так же, как отмена,
+но .part-файл и задача в журнале сохраняются для продолжения при следующем запуске
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+from session_pool import HTTP_POOL
+
+
+class DownloadCancelled(Exception):
+    """Скачивание прервано: одна из частей завершилась ошибкой или загрузку отменили"""
+
+
+class TransferPaused(Exception):
+    """Соединение закрыто паузой; загрузку нужно продолжить после TransferControl.resume()"""
+
+
+class TransferControl:
+    """
+    Пауза и отмена одной задачи скачивания; методы можно вызывать из любого потока
+
+    Встроенные загрузчики открывают запросы через open() и при TransferPaused
+    ждут в wait(). Загрузчик yt-dlp запускается через run_external(): его
+    соединения недоступны, поэтому пауза прерывает его из progress_hook, а после
+    продолжения он дозагружает свой .part-файл сам
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = threading.Event()
+        self.running.set()
+        self.cancelled = False
+        # Отмена из-за закрытия программы: недокачанные файлы не удаляются
+        self.interrupted = False
+        self.external = False
+        self.responses = set()
+        self.listeners = []
+
+    @property
+    def paused(self):
+        return not self.running.is_set()
+
+    def pause(self):
+        self.running.clear()
+        self._abort_responses()
+
+    def resume(self):
+        self.running.set()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            listeners = list(self.listeners)
+        self.running.set()
+        self._abort_responses()
+        for callback in listeners:
+            callback()
+
+    def interrupt(self):
+        """Останавливает загрузку при закрытии программы, сохраняя её для продолжения"""
+        self.interrupted = True
+        self.cancel()
+
+    @property
+    def discards_partial(self):
+        """True, если загрузку отменил пользователь и недокачанный файл нужно удалить"""
+        return self.cancelled and not self.interrupted
+
+    def add_listener(self, callback):
+        """callback() вызывается при отмене, например, чтобы прервать паузы между повторами"""
+        with self.lock:
+            self.listeners.append(callback)
+            cancelled = self.cancelled
+        if cancelled:
+            callback()
+
+    def remove_listener(self, callback):
+        with self.lock:
+            self.listeners.remove(callback)
+
+    def wait(self):
+        """Блокирует поток, пока задача на паузе; DownloadCancelled, если она отменена"""
+        self.running.wait()
+        if self.cancelled:
+            raise DownloadCancelled("Скачивание отменено")
+
+    def check(self):
+        """DownloadCancelled, если задача отменена; TransferPaused, если она на паузе"""
+        if self.cancelled:
+            raise DownloadCancelled("Скачивание отменено")
+        if self.paused:
+            raise TransferPaused("Скачивание приостановлено")
+
+    @contextmanager
+    def open(self, url, headers=None, timeout=30):
+        """
+        HTTP_POOL.open, ответ которого закрывается паузой и отменой
+
+        Ошибка чтения закрытого так ответа превращается в TransferPaused или DownloadCancelled
+        """
+        self.wait()
+        with HTTP_POOL.open(url, headers, timeout) as response:
+            with self.lock:
+                self.responses.add(response)
+            # Пауза могла наступить, пока запрос отправлялся
+            if self.paused or self.cancelled:
+                response.abort()
+            try:
+                yield response
+            except Exception:
+                if response.aborted:
+                    self.check()
+                    raise TransferPaused("Скачивание приостановлено")
+                raise
+            finally:
+                with self.lock:
+                    self.responses.discard(response)
+
+    def run_external(self, func, *args):
+        """
+        Выполняет func(*args) — загрузку сторонним загрузчиком (yt-dlp)
+
+        На время выполнения progress_hook прерывает загрузку при паузе; после
+        продолжения func вызывается снова. Возвращает результат func
+        """
+        while True:
+            self.wait()
+            self.external = True
+            try:
+                return func(*args)
+            except TransferPaused:
+                continue
+            finally:
+                self.external = False
+
+    def progress_hook(self, d):
+        """Обработчик прогресса yt-dlp: прерывает отменённую загрузку и загрузку из run_external на паузе"""
+        if self.cancelled:
+            raise DownloadCancelled("Скачивание отменено")
+        if self.external and self.paused:
+            raise TransferPaused("Скачивание приостановлено")
+
+    def _abort_responses(self):
+        with self.lock:
+            responses = list(self.responses)
+        for response in responses:
+            response.abort()
+
+
+def remove_partial(filename):
+    """Удаляет недокачанный .part-файл и служебный .ytdl-файл yt-dlp для filename"""
+    for path in (filename + '.part', filename + '.ytdl'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
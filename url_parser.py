@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Быстрый разбор больших списков ссылок на видео VK
+Каждая строка разбирается одним заранее скомпилированным регулярным выражением
+в компактную запись VideoRef; повторы отбрасываются, некорректные строки
+передаются в обработчик вместо исключения
+
+Запуск из командной строки печатает уникальные нормализованные ссылки:
+    python url_parser.py links.txt > videos.txt
+"""
+
+import re
+import sys
+
+# Ссылка на видео или клип VK: vk.com, m.vk.com, vk.ru, vkvideo.ru,
+# в том числе с ID в параметрах (?z=video-1_2) и после других разделов пути
+URL_RE = re.compile(
+    r'(?:https?://)?(?:[\w-]+\.)*(?:vk\.com|vk\.ru|vkvideo\.ru)/'
+    r'(?:[^\s#]*?[/=])?(video|clip)(-?\d+)_(\d+)(?!\d)',
+    re.IGNORECASE)
+# ID без домена: "-123_456", "video-123_456", "clip-123_456"
+BARE_ID_RE = re.compile(r'(video|clip)?(-?\d+)_(\d+)', re.IGNORECASE)
+
+
+class VideoRef:
+    """Ссылка на видео VK: ID владельца, ID видео и вид ('video' или 'clip')"""
+
+    __slots__ = ('owner_id', 'video_id', 'kind')
+
+    def __init__(self, owner_id, video_id, kind='video'):
+        self.owner_id = owner_id
+        self.video_id = video_id
+        self.kind = kind
+
+    @property
+    def url(self):
+        """Нормализованная ссылка, как у normalize_vk_url"""
+        return f"https://vk.com/{self.kind}{self.owner_id}_{self.video_id}"
+
+    @property
+    def archive_key(self):
+        """Ключ архива скачанных видео (см. download_archive)"""
+        return f"vk {self.owner_id}_{self.video_id}"
+
+    def __eq__(self, other):
+        if not isinstance(other, VideoRef):
+            return NotImplemented
+        return (self.kind, self.owner_id, self.video_id) == (other.kind, other.owner_id, other.video_id)
+
+    def __hash__(self):
+        return hash((self.kind, self.owner_id, self.video_id))
+
+    def __repr__(self):
+        return f"VideoRef({self.owner_id}, {self.video_id}, {self.kind!r})"
+
+
+def _match(text):
+    """Совпадение регулярного выражения для ссылки или ID либо None"""
+    return URL_RE.match(text) or BARE_ID_RE.fullmatch(text)
+
+def parse_video_ref(text):
+    """Разбирает одну ссылку или ID видео в VideoRef; возвращает None, если это не видео VK"""
+    match = _match(text.strip()) if text else None
+    if match is None:
+        return None
+    kind, owner_id, video_id = match.groups()
+    return VideoRef(int(owner_id), int(video_id), kind.lower() if kind else 'video')
+
+def parse_lines(lines, on_invalid=None):
+    """
+    Лениво разбирает строки в уникальные VideoRef
+
+    Пустые строки и комментарии (#) пропускаются; для строк, в которых нет
+    ссылки на видео VK, вызывается on_invalid(номер строки, строка)
+    """
+    seen = set()
+    # Локальные ссылки заметно ускоряют цикл на миллионах строк
+    match_url = URL_RE.match
+    match_id = BARE_ID_RE.fullmatch
+    seen_add = seen.add
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+        match = match_url(line) or match_id(line)
+        if match is None:
+            if on_invalid is not None:
+                on_invalid(number, line)
+            continue
+        # Повторы отсекаются по найденным группам, не создавая лишних объектов
+        key = match.groups()
+        if key in seen:
+            continue
+        seen_add(key)
+        kind, owner_id, video_id = key
+        ref = VideoRef(int(owner_id), int(video_id), kind.lower() if kind else 'video')
+        # Та же ссылка могла встретиться в другой записи ("-1_2" и "video-1_2")
+        alias = (ref.kind, owner_id, video_id)
+        if alias != key:
+            if alias in seen:
+                continue
+            seen_add(alias)
+        yield ref
+
+def parse_file(path, on_invalid=None):
+    """Как parse_lines, но читает строки из файла или stdin ('-')"""
+    stream = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8', errors='replace')
+    try:
+        yield from parse_lines(stream, on_invalid)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+if __name__ == "__main__":
+    invalid = 0
+
+    def report_invalid(number, line):
+        global invalid
+        invalid += 1
+        print(f"Строка {number}: не ссылка на видео VK: {line[:200]}", file=sys.stderr)
+
+    count = 0
+    out = sys.stdout
+    for source in sys.argv[1:] or ['-']:
+        for ref in parse_file(source, report_invalid):
+            out.write(ref.url + '\n')
+            count += 1
+    print(f"Уникальных видео: {count}, некорректных строк: {invalid}", file=sys.stderr)
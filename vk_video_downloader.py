@@ -6,20 +6,65 @@
 Требует установки библиотеки yt-dlp: pip install yt-dlp
 """
 
+import os
 import sys
+import time
+import argparse
+import http.client
+import multiprocessing
+import statistics
 import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
+import catalog
+import segmented_download
+import fragment_download
+from metadata_cache import MetadataCache, DEFAULT_TTL
+from download_archive import DownloadArchive, video_key, info_key
+import job_journal
+from bandwidth import BandwidthLimiter, parse_rate
+from file_sink import parse_fsync_policy
+from content_store import ContentStore, manifest_key
+from retry_policy import DEFAULT_POLICY, DEFAULT_RETRIES, RetryPolicy
+from transfer_control import remove_partial
+from session_pool import YoutubeDLPool
+from url_parser import parse_video_ref
+from playlists import is_playlist_url, iter_playlist
+from process_pool import WorkerProcessPool, default_processes
+from scheduler import LOOKAHEAD, JobScheduler
+from format_policy import (COMPAT_OPTS, FormatPolicy, TransferBudget, BudgetExceeded, parse_size,
+                           predicted_bytes)
+from stream_sink import REMUX_FORMATS, StreamError, open_sink
+from metrics import METRICS, serve_metrics
+
+# Папка для служебных файлов (кэш, архив загрузок и т.п.)
+DATA_DIR = os.path.join(os.path.expanduser('~'), '.vk_video_downloader')
+
+# Количество параллельных загрузок в пакетном режиме по умолчанию
+DEFAULT_WORKERS = 4
+# Ответы CDN на подписанную ссылку, которая истекла или отозвана: информацию о видео нужно извлечь заново
+STALE_URL_STATUSES = (401, 403, 404, 410)
+
 def normalize_vk_url(url):
     """Нормализует URL или ID видео VK в стандартный формат"""
     if not url:
         return None
+    
+    # Ссылки с ID видео в пути или параметрах, в том числе на видео в окне поверх списка (?z=video-1_2)
+    ref = parse_video_ref(url)
+    if ref is not None:
+        return ref.url
         
     # Для vkvideo.ru
     if "vkvideo.ru" in url:
         path = urlparse(url).path.strip('/')
         if path.startswith('video-'):
             video_id = path[6:]  # Убираем префикс 'video-'
+            if video_id.count('_') != 1:
+                return None  # Некорректный ID видео
             owner_id, video_id = video_id.split('_')
             return f"https://vk.com/video-{owner_id}_{video_id}"
         
@@ -41,12 +86,8 @@ def normalize_vk_url(url):
         
     return url
 
-def download_vk_video(video_url):
-    """Скачивает видео из VK по его URL"""
-    if not video_url:
-        print("Ошибка: Не указана ссылка на видео")
-        return False
-    
+def import_yt_dlp():
+    """Импортирует yt-dlp, при необходимости устанавливая его. Возвращает модуль или None"""
     try:
         import yt_dlp
     except ImportError:
@@ -56,36 +97,962 @@ def download_vk_video(video_url):
             import yt_dlp
         except Exception as e:
             print(f"Ошибка при установке yt-dlp: {e}")
-            return False
-    
-    normalized_url = normalize_vk_url(video_url)
+            return None
+    return yt_dlp
+
+def build_ydl_opts(output_dir=None, format_policy=None, retry_policy=None):
+    """
+    Базовые опции yt-dlp, общие для всех режимов скачивания
+
+    format_policy (format_policy.FormatPolicy) заменяет выбор лучшего формата;
+    число повторов и паузы загрузчика yt-dlp берутся из retry_policy (retry_policy.RetryPolicy)
+    """
+    outtmpl = '%(title)s.%(ext)s'
+    if output_dir:
+        outtmpl = os.path.join(output_dir, outtmpl)
+    ydl_opts = {
+        'format': format_policy if format_policy else 'best',
+        'outtmpl': outtmpl,
+        'noplaylist': True,
+        **(retry_policy or DEFAULT_POLICY).ydl_opts(),
+    }
+    if format_policy:
+        ydl_opts['compat_opts'] = COMPAT_OPTS
+    return ydl_opts
+
+def metadata_cache_key(ydl, video_url):
+    """Ключ кэша метаданных: выбранный формат зависит от политики выбора"""
+    fmt = ydl.params.get('format')
+    return video_url if fmt in (None, 'best') else f"{video_url} {fmt!r}"
+
+def report_prediction(ydl, video_url, info):
+    """
+    Выводит выбранный формат и ожидаемый объём загрузки; возвращает объём или None
+
+    Размер цельного файла без сведений о размере узнаётся запросом первого байта
+    (соединение остаётся в пуле и переиспользуется при скачивании)
+    """
+    predicted = predicted_bytes(info)
+    if predicted is None and segmented_download.is_supported(info):
+        try:
+            predicted, _ = segmented_download.probe_range_support(info['url'], _request_headers(ydl, info))
+        except (OSError, http.client.HTTPException):
+            predicted = None
+        if predicted:
+            info['filesize'] = predicted
+    resolution = f"{info['height']}p" if info.get('height') else info.get('resolution') or '?'
+    ydl.to_screen(f"[format] {video_url}: формат {info.get('format_id')} ({resolution}), "
+                  f"ожидаемый объём {segmented_download.format_bytes(predicted)}")
+    return predicted
+
+def _cookie_header(ydl, url):
+    """Cookie-заголовок yt-dlp для прямого запроса к CDN"""
+    get_cookie_header = getattr(ydl.cookiejar, 'get_cookie_header', None)
+    return get_cookie_header(url) if get_cookie_header else None
+
+def _request_headers(ydl, info):
+    """HTTP-заголовки выбранного формата вместе с cookie yt-dlp"""
+    headers = dict(info.get('http_headers') or {})
+    cookies = _cookie_header(ydl, info['url']) if info.get('url') else None
+    if cookies:
+        headers['Cookie'] = cookies
+    return headers
+
+def is_stale_url_error(error):
+    """
+    True, если ошибка скачивания — ответ HTTP об истёкшей или отозванной ссылке
+
+    Просматривает цепочку исключений, включая исходную ошибку внутри DownloadError
+    yt-dlp. Ошибки файловой системы и прочие сбои сюда не относятся
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        # urllib.error.HTTPError — code, HTTPError yt-dlp — status
+        status = getattr(error, 'status', None) or getattr(error, 'code', None)
+        if isinstance(status, int) and status in STALE_URL_STATUSES:
+            return True
+        exc_info = getattr(error, 'exc_info', None)
+        error = exc_info[1] if exc_info else (error.__cause__ or error.__context__)
+    return False
+
+def fetch_video(ydl, video_url, connections=segmented_download.DEFAULT_CONNECTIONS, cache=None,
+                journal_entry=None, throttle=None, process_pool=None, on_prediction=None, sink=None,
+                fsync_policy=None, hash_content=False, retry_policy=None, control=None):
+    """
+    Извлекает информацию о видео и скачивает выбранный формат
+
+    Если передан кэш метаданных, информация о видео берётся из него без повторного
+    извлечения; если CDN отвечает на закэшированные ссылки, что они истекли или
+    отозваны (см. is_stale_url_error), запись сбрасывается и извлечение повторяется.
+    process_pool (process_pool.WorkerProcessPool) выносит извлечение и постобработку
+    в рабочие процессы. Перед скачиванием выводится
+    ожидаемый объём и вызывается on_prediction(байты или None); исключение в нём
+    отменяет скачивание. Если передан sink (stream_sink), видео передаётся в него
+    вместо файла (см. stream_info), иначе файл пишется по fsync_policy с хешем
+    содержимого при hash_content (см. download_info). Временные сетевые ошибки
+    повторяются по retry_policy, пауза и отмена — через control (см. download_info).
+    Возвращает info-словарь yt-dlp
+    """
+    from yt_dlp.utils import DownloadError
+
+    cache_key = metadata_cache_key(ydl, video_url)
+    info = cache.get(cache_key) if cache else None
+    if info is not None:
+        ydl.to_screen(f"[cache] {video_url}: информация о видео взята из кэша")
+        predicted = report_prediction(ydl, video_url, info)
+        if on_prediction is not None:
+            on_prediction(predicted)
+            on_prediction = None
+        try:
+            if sink is not None:
+                return stream_info(ydl, info, sink, throttle, process_pool)
+            return download_info(ydl, info, connections, journal_entry, throttle, process_pool, fsync_policy,
+                                 hash_content, retry_policy, control)
+        except (DownloadError, OSError) as e:
+            if control is not None and control.cancelled:
+                raise
+            if not is_stale_url_error(e):
+                # Нехватка места, нет прав и прочие ошибки не исправить повторным извлечением
+                raise
+            if sink is not None and sink.written:
+                # Начало видео уже передано получателю, повторить поток с нуля нельзя
+                raise
+            # Подписанные ссылки могли быть отозваны раньше срока
+            ydl.to_screen(f"[cache] Ошибка скачивания по ссылкам из кэша ({e}), повторное извлечение")
+            cache.invalidate(cache_key)
+            METRICS.count_retry('cache')
+
+    info = extract_video_info(ydl, video_url, process_pool)
+    if cache:
+        cache.put(cache_key, ydl.sanitize_info(info))
+    predicted = report_prediction(ydl, video_url, info)
+    if on_prediction is not None:
+        on_prediction(predicted)
+    if sink is not None:
+        return stream_info(ydl, info, sink, throttle, process_pool)
+    return download_info(ydl, info, connections, journal_entry, throttle, process_pool, fsync_policy,
+                         hash_content, retry_policy, control)
+
+def extract_video_info(ydl, video_url, process_pool=None):
+    """Информация о видео от yt-dlp, в рабочем процессе, если передан process_pool"""
+    if process_pool is not None:
+        return process_pool.extract(ydl, video_url)
+    return ydl.extract_info(video_url, download=False)
+
+def download_info(ydl, info, connections=segmented_download.DEFAULT_CONNECTIONS, journal_entry=None,
+                  throttle=None, process_pool=None, fsync_policy=None, hash_content=False, retry_policy=None,
+                  control=None):
+    """
+    Скачивает формат, выбранный yt-dlp в info-словаре
+
+    Прогрессивные HTTP-файлы качаются по частям в несколько соединений,
+    фрагменты HLS/DASH — параллельно с адаптивным окном. Остальные форматы
+    передаются загрузчику yt-dlp. Если передана запись журнала задач, в неё
+    пишется прогресс, а прерванная ранее загрузка продолжается из .part-файла.
+    throttle (bandwidth.JobThrottle) ограничивает скорость загрузки. Загрузчик
+    yt-dlp с постпроцессорами выполняется в рабочем процессе, если передан process_pool.
+    fsync_policy (file_sink.FsyncPolicy) задаёт сброс на диск для встроенных загрузчиков,
+    а с hash_content=True они по ходу записи считают хеш содержимого (info['content_hash']).
+    Встроенные загрузчики повторяют части и фрагменты по retry_policy (retry_policy.RetryPolicy).
+    control (transfer_control.TransferControl) ставит загрузку на паузу с закрытием соединений
+    и отменяет её с удалением .part-файла; для загрузчика yt-dlp среди обработчиков
+    прогресса ydl должен быть control.progress_hook. Возвращает info-словарь yt-dlp
+    """
+    filename = ydl.prepare_filename(info)
+    hooks = ydl.params.get('progress_hooks') or []
+    resume_state = None
+    on_checkpoint = None
+    if journal_entry is not None:
+        resume_state = journal_entry.resume_state_for(info.get('format_id'), filename)
+        journal_entry.set_target(info.get('format_id'), filename)
+        on_checkpoint = journal_entry.checkpoint
+
+    if connections > 1 and (segmented_download.is_supported(info) or fragment_download.is_supported(info)):
+        if os.path.exists(filename):
+            ydl.to_screen(f"[download] {filename} уже скачан")
+            info['filepath'] = filename
+            return info
+
+    if connections > 1 and segmented_download.is_supported(info):
+        if resume_state:
+            ydl.to_screen(f"[download] Продолжение прерванной загрузки: {filename}")
+        else:
+            ydl.to_screen(f"[download] Скачивание в {connections} соединения: {filename}")
+        downloader = segmented_download.SegmentedDownloader(
+            info['url'], filename, _request_headers(ydl, info), connections, hooks,
+            resume_state=resume_state, on_checkpoint=on_checkpoint, throttle=throttle,
+            fsync_policy=fsync_policy, hash_content=hash_content, retry_policy=retry_policy, control=control)
+        downloader.download()
+        info['filepath'] = filename
+        info['content_hash'] = downloader.content_hash
+        return info
+
+    if connections > 1 and fragment_download.is_supported(info):
+        try:
+            downloader = fragment_download.FragmentDownloader.from_info(
+                info, filename, _request_headers(ydl, info), hooks,
+                resume_state=resume_state, on_checkpoint=on_checkpoint, throttle=throttle,
+                fsync_policy=fsync_policy, hash_content=hash_content, retry_policy=retry_policy,
+                control=control)
+        except fragment_download.UnsupportedStream as e:
+            ydl.to_screen(f"[download] Параллельная загрузка фрагментов недоступна: {e}")
+        else:
+            ydl.to_screen(f"[download] Параллельная загрузка {len(downloader.fragment_urls)} фрагментов: {filename}")
+            downloader.download()
+            info['filepath'] = filename
+            info['content_hash'] = downloader.content_hash
+            return info
+
+    # Загрузчик yt-dlp сам продолжает .part-файлы; прогресс в журнал пишет
+    # JournalEntry.progress_hook из progress_hooks
+    process_info = ydl.process_info if process_pool is None else lambda info: process_pool.process(ydl, info)
+    if control is not None:
+        process_info = _controlled(process_info, control, filename)
+    if throttle is None:
+        process_info(info)
+        return info
+
+    # yt-dlp читает ratelimit из params при каждой проверке скорости,
+    # поэтому доля загрузки обновляется прямо во время скачивания
+    def set_ratelimit(rate):
+        ydl.params['ratelimit'] = rate
+
+    throttle.add_listener(set_ratelimit)
+    throttle.set_active(True)
+    try:
+        process_info(info)
+    finally:
+        throttle.set_active(False)
+        throttle.remove_listener(set_ratelimit)
+    return info
+
+def _controlled(process_info, control, filename):
+    """process_info, которую control приостанавливает и отменяет (с удалением .part-файла yt-dlp)"""
+    def run(info):
+        try:
+            return control.run_external(process_info, info)
+        except Exception:
+            if control.discards_partial:
+                remove_partial(filename)
+            raise
+    return run
+
+def stream_info(ydl, info, sink, throttle=None, process_pool=None):
+    """
+    Передаёт формат, выбранный yt-dlp, в приёмник sink (stream_sink) по мере скачивания
+
+    Цельный файл качается одним соединением по порядку, фрагменты HLS/DASH —
+    параллельно и передаются по порядку; файл на диске не создаётся. Остальные
+    форматы (зашифрованные, склеиваемые) сначала скачиваются загрузчиком yt-dlp
+    во временную папку и передаются после этого. Возвращает info-словарь yt-dlp
+    """
+    filename = ydl.prepare_filename(info)
+    hooks = ydl.params.get('progress_hooks') or []
+
+    if segmented_download.is_supported(info):
+        ydl.to_screen(f"[stream] Передача в {sink}: {filename}")
+        downloader = segmented_download.SegmentedDownloader(
+            info['url'], filename, _request_headers(ydl, info), 1, hooks, throttle=throttle)
+        downloader.stream(sink)
+        return info
+
+    if fragment_download.is_supported(info):
+        try:
+            downloader = fragment_download.FragmentDownloader.from_info(
+                info, filename, _request_headers(ydl, info), hooks, throttle=throttle)
+        except fragment_download.UnsupportedStream as e:
+            ydl.to_screen(f"[stream] Параллельная загрузка фрагментов недоступна: {e}")
+        else:
+            ydl.to_screen(f"[stream] Передача {len(downloader.fragment_urls)} фрагментов в {sink}: {filename}")
+            downloader.stream(sink)
+            return info
+
+    ydl.to_screen(f"[stream] Формат передаётся в {sink} после скачивания загрузчиком yt-dlp")
+    outtmpl = ydl.params['outtmpl']
+    with tempfile.TemporaryDirectory(prefix='vk_stream_') as tmp_dir:
+        ydl.params['outtmpl'] = dict(outtmpl, default=os.path.join(tmp_dir, 'stream.%(ext)s'))
+        try:
+            download_info(ydl, info, 1, None, throttle, process_pool)
+        finally:
+            ydl.params['outtmpl'] = outtmpl
+        sink.write_file(info.pop('filepath'))
+    return info
+
+def open_metadata_cache(ttl=DEFAULT_TTL):
+    """Открывает кэш метаданных в папке DATA_DIR; при ошибке возвращает None"""
+    try:
+        return MetadataCache(os.path.join(DATA_DIR, 'metadata_cache.sqlite3'), ttl)
+    except Exception as e:
+        print(f"Кэш метаданных недоступен: {e}")
+        return None
+
+def open_download_archive(path=None):
+    """Открывает архив скачанных видео (по умолчанию в папке DATA_DIR)"""
+    return DownloadArchive(path or os.path.join(DATA_DIR, 'archive.txt'))
+
+def open_job_journal():
+    """Открывает журнал задач в папке DATA_DIR; при ошибке возвращает None"""
+    try:
+        return job_journal.JobJournal(os.path.join(DATA_DIR, 'jobs.sqlite3'))
+    except Exception as e:
+        print(f"Журнал задач недоступен: {e}")
+        return None
+
+class DownloadSettings:
+    """Общие настройки и служебные хранилища для всех задач скачивания"""
+
+    def __init__(self, output_dir=None, connections=segmented_download.DEFAULT_CONNECTIONS,
+                 cache=None, archive=None, journal=None, limiter=None, ydl_pool=None, process_pool=None,
+                 format_policy=None, budget=None, sink=None, fsync_policy=None, content_store=None,
+                 retry_policy=None, scheduler=None):
+        self.output_dir = output_dir
+        self.connections = connections
+        self.cache = cache
+        self.archive = archive
+        self.journal = journal
+        self.limiter = limiter
+        self.ydl_pool = ydl_pool
+        self.process_pool = process_pool
+        self.format_policy = format_policy
+        self.budget = budget
+        # Приёмник потокового режима (stream_sink): видео передаётся в него вместо файла
+        self.sink = sink
+        # Когда сбрасывать скачиваемые файлы на диск (file_sink.FsyncPolicy)
+        self.fsync_policy = fsync_policy
+        # Хранилище с дедупликацией одинаковых файлов (content_store.ContentStore)
+        self.content_store = content_store
+        # Повторы после временных сетевых ошибок (retry_policy.RetryPolicy; None — по умолчанию)
+        self.retry_policy = retry_policy
+        # Очередь на слоты скачивания по приоритету и объёму (scheduler.JobScheduler; None — по порядку)
+        self.scheduler = scheduler
+
+
+def download_vk_video(video_url, settings=None):
+    """Скачивает видео из VK по его URL"""
+    if not video_url:
+        print("Ошибка: Не указана ссылка на видео")
+        return False
+
+    settings = settings or DownloadSettings()
+    job_metrics = METRICS.job(video_url)
+    with job_metrics.phase('normalize'):
+        normalized_url = normalize_vk_url(video_url)
+    if (settings.archive is not None and settings.sink is None
+            and video_key(normalized_url) in settings.archive):
+        job_metrics.finish(JobResult.SKIPPED)
+        print(f"Видео уже было скачано ранее: {normalized_url}")
+        return True
+
+    yt_dlp = import_yt_dlp()
+    if yt_dlp is None:
+        job_metrics.finish(JobResult.FAILED, error_class_name='YtDlpUnavailable')
+        return False
+
     if not normalized_url:
+        job_metrics.finish(JobResult.FAILED, error_class_name='InvalidURL')
         print("Не удалось получить корректный URL видео")
         return False
-    
+
     print(f"Начинаем скачивание видео: {normalized_url}")
-    
+
+    result = _download_job(yt_dlp, normalized_url, settings.output_dir, settings, quiet=False,
+                           metrics=job_metrics)
+    if result.status == JobResult.OK:
+        print(f"Видео успешно скачано: {result.message}")
+        return True
+    print(f"Ошибка при скачивании видео: {result.message}")
+    return False
+
+
+class JobResult:
+    """Результат обработки одной ссылки в пакетном режиме"""
+    OK = 'ok'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    def __init__(self, url, status, bytes_downloaded=0, seconds=0.0, message='', predicted_bytes=None):
+        self.url = url
+        self.status = status
+        self.bytes_downloaded = bytes_downloaded
+        self.seconds = seconds
+        self.message = message
+        # Ожидаемый объём выбранного формата, если он известен
+        self.predicted_bytes = predicted_bytes
+
+
+def read_urls(source):
+    """Читает ссылки из файла или stdin ('-'), пропуская пустые строки и комментарии"""
+    stream = sys.stdin if source == '-' else open(source, 'r', encoding='utf-8')
     try:
-        ydl_opts = {
-            'format': 'best',
-            'outtmpl': '%(title)s.%(ext)s',
-            'noplaylist': True,
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(normalized_url, download=True)
-            print(f"Видео успешно скачано: {info['title']}.{info.get('ext', 'mp4')}")
-            return True
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def split_priority(line):
+    """
+    Ссылка и приоритет из строки пакетного файла вида «ссылка [приоритет]»
+
+    Приоритет — целое число, больше — раньше; без него 0
+    """
+    parts = line.split()
+    if len(parts) == 2 and parts[1].lstrip('+-').isdigit():
+        return parts[0], int(parts[1])
+    return line, 0
+
+def _download_job(yt_dlp, video_url, output_dir, settings, quiet=True, progress_hooks=(),
+                  on_prediction=None, metrics=None, control=None, priority=0):
+    """
+    Скачивает одно видео и возвращает JobResult; в message — имя файла или текст ошибки
+
+    progress_hooks — дополнительные обработчики прогресса в формате yt-dlp;
+    on_prediction(байты или None) вызывается перед скачиванием с ожидаемым объёмом.
+    Если задан бюджет settings.budget и объём в него не помещается, задача пропускается.
+    Если задан планировщик settings.scheduler, скачивание ждёт слота с приоритетом priority.
+    Длительность этапов записывается в metrics (metrics.JobMetrics, по умолчанию новая
+    задача общего реестра METRICS). control (transfer_control.TransferControl) ставит
+    задачу на паузу и отменяет её
+    """
+    started = time.monotonic()
+    finished_bytes = {}
+    plan = {'predicted': None, 'reserved': 0, 'ticket': None, 'extracting': None}
+    metrics = metrics or METRICS.job(video_url)
+    metrics.begin()
+
+    def end_extracting():
+        if plan['extracting'] is not None:
+            plan['extracting'].release()
+            plan['extracting'] = None
+
+    def prediction_hook(predicted):
+        metrics.extracted()
+        end_extracting()
+        plan['predicted'] = predicted
+        if on_prediction is not None:
+            on_prediction(predicted)
+        if settings.budget is not None:
+            settings.budget.reserve(predicted)
+            plan['reserved'] = predicted or 0
+        if settings.scheduler is not None:
+            plan['ticket'] = settings.scheduler.enter(priority, predicted)
+            settings.scheduler.wait(plan['ticket'], control)
+            metrics.scheduled()
+
+    def progress_hook(d):
+        # Запоминаем итоговый размер каждого скачанного файла
+        if d['status'] == 'finished':
+            finished_bytes[d.get('filename')] = d.get('total_bytes') or d.get('downloaded_bytes') or 0
+
+    # Поток нельзя продолжить после перезапуска, поэтому в журнал он не записывается
+    journal = settings.journal if settings.sink is None else None
+    journal_entry = journal.begin(video_url, output_dir) if journal else None
+    hooks = [progress_hook, metrics.progress_hook, *progress_hooks]
+    if journal_entry is not None:
+        hooks.append(journal_entry.progress_hook)
+    if control is not None:
+        hooks.append(control.progress_hook)
+    ydl_opts = build_ydl_opts(output_dir, settings.format_policy, settings.retry_policy)
+    if quiet:
+        ydl_opts.update({'quiet': True, 'noprogress': True})
+    if settings.ydl_pool is not None:
+        session = settings.ydl_pool.lease(ydl_opts, hooks)
+    else:
+        session = yt_dlp.YoutubeDL(dict(ydl_opts, progress_hooks=hooks))
+
+    throttle = settings.limiter.register() if settings.limiter else None
+    if settings.scheduler is not None:
+        plan['extracting'] = settings.scheduler.extract_slots
+        plan['extracting'].acquire()
+    try:
+        with session as ydl:
+            info = fetch_video(ydl, video_url, settings.connections, settings.cache,
+                               journal_entry, throttle, settings.process_pool, prediction_hook,
+                               settings.sink, settings.fsync_policy, settings.content_store is not None,
+                               settings.retry_policy, control)
+    except BudgetExceeded as e:
+        if journal_entry is not None:
+            journal_entry.finish(job_journal.CANCELLED)
+        metrics.finish(JobResult.SKIPPED, e)
+        return JobResult(video_url, JobResult.SKIPPED, 0, time.monotonic() - started, str(e),
+                         plan['predicted'])
     except Exception as e:
-        print(f"Ошибка при скачивании видео: {e}")
-        return False
+        # Прерванная закрытием программы задача остаётся в журнале незавершённой
+        if journal_entry is not None and not (control is not None and control.interrupted):
+            cancelled = control is not None and control.cancelled
+            journal_entry.finish(job_journal.CANCELLED if cancelled else job_journal.FAILED)
+        downloaded = sum(finished_bytes.values())
+        metrics.finish(JobResult.FAILED, e, downloaded)
+        if plan['reserved']:
+            # Нескачанная часть резерва возвращается в бюджет пакета
+            settings.budget.release(max(0, plan['reserved'] - downloaded))
+        return JobResult(video_url, JobResult.FAILED, downloaded, time.monotonic() - started, str(e),
+                         plan['predicted'])
+    finally:
+        if throttle is not None:
+            throttle.close()
+        end_extracting()
+        if plan['ticket'] is not None:
+            settings.scheduler.leave(plan['ticket'])
+
+    if journal_entry is not None:
+        journal_entry.finish(job_journal.DONE)
+    if settings.archive is not None and settings.sink is None:
+        settings.archive.add(video_key(video_url), info_key(info))
+    if settings.sink is None:
+        store_content(settings, video_url, info, quiet)
+    metrics.finish(JobResult.OK, bytes_downloaded=sum(finished_bytes.values()))
+    return JobResult(video_url, JobResult.OK, sum(finished_bytes.values()),
+                     time.monotonic() - started, f"{info['title']}.{info.get('ext', 'mp4')}",
+                     plan['predicted'])
+
+def store_content(settings, video_url, info, quiet=True):
+    """
+    Добавляет скачанный файл в хранилище settings.content_store, если оно задано
+
+    Ошибка хранилища не отменяет успешное скачивание и только выводится
+    """
+    store = settings.content_store
+    filepath = info.get('filepath')
+    if store is None or not filepath or not os.path.exists(filepath):
+        return
+    try:
+        deduplicated = store.add(filepath, manifest_key(video_url, info), info.get('content_hash'))
+    except OSError as e:
+        print(f"Не удалось добавить {filepath} в хранилище: {e}")
+        return
+    if deduplicated and not quiet:
+        print(f"Такое видео уже есть в хранилище, файл заменён ссылкой на него: {filepath}")
+
+def expand_playlists(items, settings):
+    """
+    Раскрывает плейлисты во входном наборе по мере чтения: (ссылка, папка, приоритет, ошибка)
+
+    items — строки «ссылка [приоритет]» (см. split_priority) или пары (ссылка,
+    папка для сохранения); видео плейлиста получают его приоритет. Списки видео
+    запрашиваются через пул settings.ydl_pool
+    """
+    for item in items:
+        raw_url, output_dir = item if isinstance(item, tuple) else (item, settings.output_dir)
+        raw_url, priority = split_priority(raw_url)
+        if not is_playlist_url(raw_url):
+            yield raw_url, output_dir, priority, None
+            continue
+        ydl_opts = dict(build_ydl_opts(output_dir, retry_policy=settings.retry_policy), quiet=True,
+                        noprogress=True)
+        try:
+            with settings.ydl_pool.lease(ydl_opts) as ydl:
+                for entry_url in iter_playlist(ydl, raw_url):
+                    yield entry_url, output_dir, priority, None
+        except Exception as e:
+            yield raw_url, output_dir, priority, f"Не удалось получить список видео: {e}"
+
+def download_batch(urls, workers=DEFAULT_WORKERS, settings=None, engine=None):
+    """
+    Скачивает набор видео пулом из workers параллельных потоков в одном процессе
+
+    urls: итерируемый набор строк «ссылка или ID [приоритет]» (либо пар (ссылка,
+    папка для сохранения)), читается лениво. Плейлисты, альбомы и видеозаписи сообществ раскрываются
+    постранично по мере скачивания. Видео из архива settings.archive пропускаются
+    без сетевых запросов. Перед скачиванием каждого видео печатается ожидаемый
+    объём; задачи сверх бюджета settings.budget пропускаются. С планировщиком
+    settings.scheduler информацию заранее извлекают LOOKAHEAD задач на поток, а
+    скачивают workers из них — по приоритету строки и ожидаемому объёму (см.
+    scheduler). Если передан engine (async_engine.AsyncEngine), задачи
+    выполняются им в одном цикле событий вместо пула потоков
+    Возвращает список JobResult в порядке входных ссылок
+    """
+    yt_dlp = import_yt_dlp()
+    if yt_dlp is None:
+        return []
+
+    settings = settings or DownloadSettings()
+    archive = settings.archive
+    workers = max(1, workers)
+    # Скачивают workers задач; с планировщиком остальные потоки заранее извлекают информацию
+    threads = workers * (1 + LOOKAHEAD) if settings.scheduler is not None else workers
+    if settings.ydl_pool is None:
+        # Экземпляры YoutubeDL и их соединения переиспользуются между задачами пакета
+        settings.ydl_pool = YoutubeDLPool(yt_dlp, max_idle=threads)
+    results = []
+    seen = set()
+    print_lock = threading.Lock()
+    # Ограничиваем число ещё не обработанных задач, чтобы не вычитывать весь список в память
+    pending = threading.BoundedSemaphore(threads + workers)
+
+    def report_prediction(index, url):
+        def on_prediction(predicted):
+            with print_lock:
+                print(f"[{index}] ожидаемый объём {segmented_download.format_bytes(predicted)}: {url}")
+        return on_prediction
+
+    def run(index, url, output_dir, priority, job_metrics):
+        try:
+            result = _download_job(yt_dlp, url, output_dir, settings,
+                                   on_prediction=report_prediction(index, url), metrics=job_metrics,
+                                   priority=priority)
+        finally:
+            pending.release()
+        with print_lock:
+            print(f"[{index}] {result.status}: {url} ({result.seconds:.1f} с)")
+        return result
+
+    def submit_to_engine(index, url, output_dir, priority, job_metrics):
+        def done(future):
+            pending.release()
+            if not future.cancelled() and future.exception() is None:
+                result = future.result()
+                with print_lock:
+                    print(f"[{index}] {result.status}: {url} ({result.seconds:.1f} с)")
+
+        job = engine.submit(url, output_dir, on_prediction=report_prediction(index, url),
+                            metrics=job_metrics, priority=priority)
+        job.future.add_done_callback(done)
+        return job.future
+
+    def rejected(job_metrics, result, error_class=None):
+        """Задача, завершённая без скачивания"""
+        job_metrics.finish(result.status, result.message if error_class else None, 0, error_class)
+        return result
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = []
+        for index, (raw_url, output_dir, priority, error) in enumerate(expand_playlists(urls, settings), 1):
+            job_metrics = METRICS.job(raw_url)
+            if error:
+                futures.append(rejected(job_metrics, JobResult(raw_url, JobResult.FAILED, message=error),
+                                        'PlaylistError'))
+                continue
+            with job_metrics.phase('normalize'):
+                ref = parse_video_ref(raw_url)
+                normalized_url = ref.url if ref is not None else normalize_vk_url(raw_url)
+            if not normalized_url:
+                futures.append(rejected(job_metrics, JobResult(raw_url, JobResult.FAILED,
+                                                               message="Некорректный URL"), 'InvalidURL'))
+                continue
+            if normalized_url in seen:
+                futures.append(rejected(job_metrics, JobResult(normalized_url, JobResult.SKIPPED,
+                                                               message="Дубликат")))
+                continue
+            if archive is not None and video_key(normalized_url) in archive:
+                futures.append(rejected(job_metrics, JobResult(normalized_url, JobResult.SKIPPED,
+                                                               message="Уже скачано")))
+                continue
+            seen.add(normalized_url)
+            pending.acquire()
+            if engine is not None:
+                futures.append(submit_to_engine(index, normalized_url, output_dir, priority, job_metrics))
+            else:
+                futures.append(executor.submit(run, index, normalized_url, output_dir, priority, job_metrics))
+
+        for item in futures:
+            results.append(item if isinstance(item, JobResult) else item.result())
+
+    return results
+
+def catalog_batch(urls, path, workers=DEFAULT_WORKERS, settings=None):
+    """
+    Строит каталог видео без скачивания: по строке JSON на каждое видео в файле path
+
+    urls — итерируемый набор ссылок, читается лениво; плейлисты раскрываются.
+    Информация извлекается в workers потоках (через кэш метаданных settings.cache,
+    если он есть). Если файл уже есть, каталог продолжается с первой ненаписанной
+    строки (см. catalog.build_catalog). Возвращает (новых записей, из них с ошибкой)
+    """
+    yt_dlp = import_yt_dlp()
+    if yt_dlp is None:
+        return 0, 0
+
+    settings = settings or DownloadSettings()
+    workers = max(1, workers)
+    if settings.ydl_pool is None:
+        settings.ydl_pool = YoutubeDLPool(yt_dlp, max_idle=workers)
+    ydl_opts = dict(build_ydl_opts(retry_policy=settings.retry_policy), quiet=True, noprogress=True)
+
+    def items():
+        for raw_url, _, _, error in expand_playlists(urls, settings):
+            ref = parse_video_ref(raw_url)
+            normalized_url = ref.url if ref is not None else normalize_vk_url(raw_url)
+            if error or not normalized_url:
+                yield raw_url, error or "Некорректный URL"
+            else:
+                yield normalized_url, None
+
+    def extract(url):
+        job_metrics = METRICS.job(url)
+        job_metrics.begin()
+        try:
+            with settings.ydl_pool.lease(ydl_opts) as ydl:
+                cache_key = metadata_cache_key(ydl, url)
+                info = settings.cache.get(cache_key) if settings.cache else None
+                if info is None:
+                    info = extract_video_info(ydl, url, settings.process_pool)
+                    if settings.cache:
+                        info = ydl.sanitize_info(info)
+                        settings.cache.put(cache_key, info)
+        except Exception as e:
+            job_metrics.finish(JobResult.FAILED, e)
+            raise
+        job_metrics.extracted()
+        job_metrics.finish(JobResult.OK)
+        return info
+
+    def report(index, record):
+        print(f"[{index}] {'failed' if 'error' in record else 'ok'}: {record['url']}")
+
+    writer = catalog.CatalogWriter(path)
+    if writer.done:
+        print(f"В каталоге {path} уже {writer.done} записей, продолжаем со следующей ссылки")
+    try:
+        return catalog.build_catalog(items(), extract, writer, workers, on_record=report)
+    finally:
+        writer.close()
+
+def print_batch_summary(results, scheduler=None):
+    """Печатает сводку по результатам пакетного скачивания и, если задан scheduler, по очереди слотов"""
+    print("\nИтоги пакетного скачивания:")
+    print(f"{'Статус':<8} {'Ожидалось':>14} {'Байт':>14} {'Секунд':>9}  URL")
+    for result in results:
+        predicted = '' if result.predicted_bytes is None else result.predicted_bytes
+        print(f"{result.status:<8} {predicted:>14} {result.bytes_downloaded:>14} {result.seconds:>9.1f}  {result.url}")
+        if result.status != JobResult.OK and result.message:
+            print(f"{'':<49}{result.message}")
+
+    counts = {status: 0 for status in (JobResult.OK, JobResult.FAILED, JobResult.SKIPPED)}
+    for result in results:
+        counts[result.status] += 1
+    total_bytes = sum(result.bytes_downloaded for result in results)
+    total_predicted = sum(result.predicted_bytes or 0 for result in results)
+    total_seconds = sum(result.seconds for result in results)
+    print(f"\nУспешно: {counts[JobResult.OK]}, ошибок: {counts[JobResult.FAILED]}, "
+          f"пропущено: {counts[JobResult.SKIPPED]}, байт: {total_bytes} (ожидалось {total_predicted}), "
+          f"суммарное время: {total_seconds:.1f} с")
+    finished = [result.seconds for result in results if result.status == JobResult.OK]
+    if finished:
+        print(f"Время задачи: медиана {statistics.median(finished):.1f} с, наибольшее {max(finished):.1f} с")
+    if scheduler is not None:
+        stats = scheduler.stats()
+        if stats['wait_count']:
+            print(f"Ожидание слота скачивания: медиана {stats['wait_median']:.1f} с, "
+                  f"95% {stats['wait_p95']:.1f} с, наибольшее {stats['wait_max']:.1f} с; "
+                  f"наибольшая очередь: {stats['max_queued']}")
+
+def watch_rate_file(limiter, path, interval=1.0):
+    """
+    Следит за файлом с общим лимитом скорости ('5M', '0' — без ограничений)
+    и применяет его на лету. Работает в фоновом потоке
+    """
+    def watch():
+        last_mtime = None
+        while True:
+            try:
+                mtime = os.path.getmtime(path)
+                if mtime != last_mtime:
+                    last_mtime = mtime
+                    with open(path, 'r', encoding='utf-8') as f:
+                        rate = parse_rate(f.read())
+                    limiter.set_global_rate(rate)
+                    print(f"Общий лимит скорости: {f'{rate} байт/с' if rate else 'без ограничений'}")
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                print(f"Не удалось прочитать лимит скорости из {path}: {e}")
+            time.sleep(interval)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+def parse_args(argv=None):
+    """Разбирает аргументы командной строки"""
+    parser = argparse.ArgumentParser(description="Скачивание видео из VK")
+    parser.add_argument('url', nargs='?', help="ссылка на видео VK или ID видео")
+    parser.add_argument('-b', '--batch', metavar='FILE',
+                        help="файл со списком ссылок, по одной на строку ('-' — читать из stdin)")
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"число параллельных загрузок в пакетном режиме (по умолчанию {DEFAULT_WORKERS})")
+    parser.add_argument('-o', '--output-dir', help="папка для сохранения видео")
+    parser.add_argument('-n', '--connections', type=int, default=segmented_download.DEFAULT_CONNECTIONS,
+                        help="число соединений для скачивания одного файла по частям "
+                             f"(по умолчанию {segmented_download.DEFAULT_CONNECTIONS}); 1 — отключить "
+                             "параллельное скачивание частей и фрагментов")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="не использовать кэш информации о видео")
+    parser.add_argument('--archive', metavar='FILE',
+                        help="файл архива скачанных видео (по умолчанию ~/.vk_video_downloader/archive.txt)")
+    parser.add_argument('--no-archive', action='store_true',
+                        help="не пропускать и не запоминать уже скачанные видео")
+    parser.add_argument('--cache-ttl', type=int, default=DEFAULT_TTL,
+                        help=f"время жизни записей кэша в секундах (по умолчанию {DEFAULT_TTL})")
+    parser.add_argument('-r', '--limit-rate', type=parse_rate, metavar='RATE',
+                        help="общий лимит скорости всех загрузок, например 500K или 5M")
+    parser.add_argument('--job-limit-rate', type=parse_rate, metavar='RATE',
+                        help="лимит скорости одной загрузки")
+    parser.add_argument('--limit-rate-file', metavar='FILE',
+                        help="файл с общим лимитом скорости; изменения применяются во время работы")
+    parser.add_argument('--no-resume', action='store_true',
+                        help="не продолжать загрузки, прерванные при прошлом запуске")
+    parser.add_argument('--max-height', type=int, metavar='PIXELS',
+                        help="наибольшая высота кадра, например 480; выбирается лучший формат не выше неё")
+    parser.add_argument('--max-size', type=parse_size, metavar='SIZE',
+                        help="наибольший ожидаемый размер файла одного видео, например 300M")
+    parser.add_argument('--prefer-progressive', action='store_true',
+                        help="при одинаковом разрешении предпочитать цельный MP4 фрагментам HLS/DASH")
+    parser.add_argument('--cheapest-codec', action='store_true',
+                        help="при одинаковом разрешении выбирать формат с наименьшим объёмом")
+    parser.add_argument('--max-total', type=parse_size, metavar='SIZE',
+                        help="наибольший суммарный ожидаемый объём пакета; видео сверх него пропускаются")
+    parser.add_argument('--engine', choices=('threads', 'async'), default='threads',
+                        help="движок пакетного режима: пул потоков (по умолчанию) или asyncio, "
+                             "выполняющий все передачи в одном цикле событий")
+    parser.add_argument('--schedule', choices=('sjf', 'fifo'), default='sjf',
+                        help="порядок скачивания в пакетном и фоновом режимах: sjf (по умолчанию) — "
+                             "сначала больший приоритет из строки «ссылка приоритет», затем меньший "
+                             "ожидаемый объём со старением долго ждущих задач; fifo — по порядку ссылок")
+    parser.add_argument('--processes', type=int, nargs='?', const=default_processes(), metavar='N',
+                        help="извлекать информацию о видео и выполнять постобработку yt-dlp в N рабочих "
+                             "процессах (без N — по числу ядер процессора)")
+    parser.add_argument('--stream', metavar='TARGET',
+                        help="передавать видео по мере скачивания, не сохраняя файл: '-' — в stdout "
+                             "(сообщения выводятся в stderr), путь — в именованный канал или файл")
+    parser.add_argument('--pipe-to', metavar='COMMAND',
+                        help="запустить COMMAND и передавать видео ему на stdin по мере скачивания, "
+                             "например \"mpv -\"")
+    parser.add_argument('--remux', choices=sorted(REMUX_FORMATS),
+                        help="перепаковывать поток через ffmpeg в MPEG-TS, фрагментированный MP4 или MKV")
+    parser.add_argument('--fsync', type=parse_fsync_policy, default='never', metavar='POLICY',
+                        help="когда сбрасывать скачиваемые файлы на диск: never (по умолчанию, "
+                             "решает ОС), complete — перед завершением загрузки, объём (например 64M) — "
+                             "каждые N байт и перед завершением")
+    parser.add_argument('--dedup-store', metavar='DIR',
+                        help="хранилище с дедупликацией: одинаковые видео заменяются ссылками на один "
+                             "объект, а DIR/manifest.jsonl сопоставляет owner_id_video_id с хешем содержимого")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES, metavar='N',
+                        help="число повторов после временной сетевой ошибки подряд без продвижения "
+                             f"загрузки (по умолчанию {DEFAULT_RETRIES}); часть файла или фрагмент "
+                             "продолжается с последнего полученного байта")
+    parser.add_argument('--catalog', metavar='FILE',
+                        help="не скачивать видео, а записывать в FILE по строке JSON на каждое "
+                             "(название, длительность, владелец, форматы и их размеры); повторный "
+                             "запуск с тем же списком продолжает каталог с места остановки")
+    parser.add_argument('--metrics-jsonl', metavar='FILE',
+                        help="дописывать в FILE строку JSON с длительностью этапов на каждую задачу")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="отдавать метрики в формате Prometheus на http://127.0.0.1:PORT/metrics "
+                             "(в фоновом режиме они также доступны по адресу /metrics API)")
+    parser.add_argument('--serve', action='store_true',
+                        help="фоновый режим: принимать задачи через локальный HTTP/JSON API")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="адрес для фонового режима (по умолчанию 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8750,
+                        help="порт для фонового режима (по умолчанию 8750)")
+    args = parser.parse_args(argv)
+    if args.stream and args.pipe_to:
+        parser.error("--stream и --pipe-to нельзя использовать вместе")
+    if (args.stream or args.pipe_to) and (args.batch or args.serve):
+        parser.error("потоковый режим работает только с одним видео")
+    if args.catalog and (args.stream or args.pipe_to or args.serve):
+        parser.error("--catalog нельзя использовать вместе с потоковым и фоновым режимами")
+    if args.remux and not (args.stream or args.pipe_to):
+        parser.error("--remux используется вместе с --stream или --pipe-to")
+    return args
 
 if __name__ == "__main__":
-    video_url = sys.argv[1] if len(sys.argv) > 1 else input("Пожалуйста, вставьте ссылку на видео VK или ID видео:\n").strip()
-    
-    if video_url:
-        download_vk_video(video_url)
-    else:
-        print("Ссылка на видео не предоставлена. Программа завершает работу.")
-    
-    input("\nНажмите Enter для выхода...")
\ No newline at end of file
+    # Нужно для рабочих процессов в собранном PyInstaller exe
+    multiprocessing.freeze_support()
+    args = parse_args()
+    sink = None
+    if args.stream or args.pipe_to:
+        try:
+            sink = open_sink(args.stream, args.pipe_to, args.remux)
+        except StreamError as e:
+            sys.exit(str(e))
+        if args.stream == '-':
+            # stdout занят видео: сообщения программы и yt-dlp выводятся в stderr
+            sys.stdout = sys.stderr
+    settings = DownloadSettings(
+        output_dir=args.output_dir,
+        connections=args.connections,
+        cache=None if args.no_cache else open_metadata_cache(args.cache_ttl),
+        archive=None if args.no_archive or sink else open_download_archive(args.archive),
+        journal=open_job_journal(),
+        limiter=BandwidthLimiter(args.limit_rate, args.job_limit_rate),
+        process_pool=WorkerProcessPool(args.processes) if args.processes else None,
+        format_policy=FormatPolicy(args.max_height, args.max_size, args.prefer_progressive,
+                                   args.cheapest_codec),
+        budget=TransferBudget(args.max_total),
+        sink=sink,
+        fsync_policy=args.fsync,
+        content_store=ContentStore(args.dedup_store) if args.dedup_store and not sink else None,
+        retry_policy=RetryPolicy(args.retries),
+        scheduler=JobScheduler(args.workers) if args.schedule == 'sjf' and not sink else None,
+    )
+    if settings.scheduler is not None:
+        METRICS.add_collector(settings.scheduler.prometheus_metrics)
+    if args.limit_rate_file:
+        watch_rate_file(settings.limiter, args.limit_rate_file)
+    if args.metrics_jsonl:
+        METRICS.open_jsonl(args.metrics_jsonl)
+    if args.metrics_port:
+        serve_metrics(port=args.metrics_port)
+
+    if args.catalog:
+        # Каталог без скачивания: прерванные загрузки не продолжаются
+        started = time.monotonic()
+        urls = read_urls(args.batch) if args.batch else [
+            args.url or input("Пожалуйста, вставьте ссылку на видео или плейлист VK:\n").strip()]
+        written, failed = catalog_batch(urls, args.catalog, args.workers, settings)
+        print(f"\nЗаписано в каталог: {written}, из них с ошибкой: {failed}. "
+              f"Общее время: {time.monotonic() - started:.1f} с")
+        sys.exit(1 if failed else 0)
+
+    # Продолжаем загрузки, прерванные при прошлом запуске
+    unfinished = settings.journal.unfinished() if settings.journal and not (args.no_resume or sink) else []
+    if args.serve:
+        import daemon
+        daemon.serve(settings, args.host, args.port, args.workers, resume=unfinished)
+        sys.exit(0)
+    engine = None
+    if args.engine == 'async':
+        from async_engine import AsyncEngine
+        engine = AsyncEngine(settings, args.workers)
+    try:
+        if unfinished:
+            print(f"Найдено незавершённых загрузок: {len(unfinished)}. Продолжаем...")
+            print_batch_summary(download_batch(unfinished, args.workers, settings, engine), settings.scheduler)
+
+        if args.batch:
+            started = time.monotonic()
+            results = download_batch(read_urls(args.batch), args.workers, settings, engine)
+            print_batch_summary(results, settings.scheduler)
+            print(f"Общее время: {time.monotonic() - started:.1f} с")
+            sys.exit(1 if any(r.status == JobResult.FAILED for r in results) else 0)
+
+        video_url = args.url or input("Пожалуйста, вставьте ссылку на видео VK или ID видео:\n").strip()
+
+        if sink is not None:
+            if is_playlist_url(video_url):
+                sys.exit("Потоковый режим работает только с одним видео, а не с плейлистом")
+            ok = download_vk_video(video_url, settings)
+            try:
+                sink.close()
+            except StreamError as e:
+                print(e)
+                ok = False
+            sys.exit(0 if ok else 1)
+
+        if video_url and is_playlist_url(video_url):
+            # Плейлист скачивается так же, как пакет ссылок
+            print_batch_summary(download_batch([video_url], args.workers, settings, engine), settings.scheduler)
+        elif video_url:
+            download_vk_video(video_url, settings)
+        else:
+            print("Ссылка на видео не предоставлена. Программа завершает работу.")
+    finally:
+        if engine is not None:
+            # Поток цикла событий и пулы потоков останавливаются и при ошибке или Ctrl+C,
+            # иначе процесс не завершится; незавершённые загрузки остаются в журнале
+            engine.close()
+
+    input("\nНажмите Enter для выхода...")
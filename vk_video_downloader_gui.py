@@ -11,23 +11,53 @@
 import sys
 import os
 import subprocess
+import multiprocessing
 import re
+import threading
+import time
 import json
 import urllib.request
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                             QLabel, QLineEdit, QPushButton, QProgressBar, 
-                            QTextEdit, QFileDialog, QMessageBox, QStatusBar,
-                            QMenuBar, QMenu, QAction)
-from PyQt5.QtCore import QThread, pyqtSignal, QMutex, QWaitCondition, Qt
+                            QPlainTextEdit, QFileDialog, QMessageBox, QStatusBar,
+                            QMenuBar, QMenu, QAction, QSpinBox, QComboBox)
+from PyQt5.QtCore import QThread, pyqtSignal, Qt, QTimer
 from PyQt5.QtGui import QIcon
 
 # Импортируем функциональность из оригинального скрипта
-from vk_video_downloader import normalize_vk_url
+from vk_video_downloader import (normalize_vk_url, fetch_video, open_metadata_cache,
+                                 open_download_archive, open_job_journal, video_key, info_key,
+                                 build_ydl_opts, DownloadSettings, DEFAULT_WORKERS)
+import job_journal
+from bandwidth import BandwidthLimiter
+from session_pool import YoutubeDLPool
+from process_pool import WorkerProcessPool
+from format_policy import FormatPolicy
+from playlists import is_playlist_url, iter_playlist
+from progress_channel import ProgressChannel
+from download_manager_gui import DownloadManagerWindow
+from segmented_download import format_bytes
+from transfer_control import TransferControl
 from version import __version__
 
 # URL для проверки обновлений (API GitHub)
 UPDATE_URL = "https://api.github.com/repos/Fellmonkey/vk_video_downloader/releases/latest"
 
+# Период обновления прогресса и лога в интерфейсе, мс
+PROGRESS_REFRESH_MS = 100
+# Максимальное число строк в окне лога (старые строки удаляются)
+LOG_MAX_LINES = 2000
+# Шкала индикатора прогресса (десятые доли процента)
+PROGRESS_SCALE = 1000
+# Сколько секунд при закрытии окна ждать остановки загрузок
+SHUTDOWN_TIMEOUT = 10
+# Варианты наибольшего разрешения (None — лучшее доступное качество)
+QUALITY_CHOICES = (("Лучшее качество", None), ("До 1080p", 1080), ("До 720p", 720),
+                   ("До 480p", 480), ("До 360p", 360))
+
+# Регулярное выражение для удаления ANSI-кодов цветов
+ANSI_ESCAPE_RE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
 class UpdateCheckerThread(QThread):
     """Поток для проверки наличия обновлений"""
     update_available = pyqtSignal(str, str)
@@ -81,73 +111,98 @@ class UpdateCheckerThread(QThread):
             return False
 
 class DownloadThread(QThread):
-    """Отдельный поток для скачивания видео"""
-    progress_update = pyqtSignal(str)
+    """
+    Отдельный поток для скачивания видео
+
+    Прогресс и сообщения не отправляются сигналами, а складываются в
+    ProgressChannel, который интерфейс опрашивает с фиксированной частотой
+    """
     download_finished = pyqtSignal(bool, str)
     
-    def __init__(self, video_url, output_dir=None):
+    def __init__(self, video_url, output_dir=None, journal=None, limiter=None, ydl_pool=None,
+                 process_pool=None, format_policy=None, cache=None, archive=None, redownload=False):
         super().__init__()
         self.video_url = video_url
         self.output_dir = output_dir
-        self.mutex = QMutex()
-        self.pause_condition = QWaitCondition()
-        self.is_paused = False
-        self.is_cancelled = False
+        self.cache = cache
+        self.archive = archive
+        # Скачать видео, даже если оно уже есть в архиве
+        self.redownload = redownload
+        self.journal = journal
+        self.journal_entry = None
+        self.limiter = limiter
+        self.throttle = None
+        self.ydl_pool = ydl_pool
+        self.process_pool = process_pool
+        self.format_policy = format_policy
+        self.channel = ProgressChannel()
+        # Пауза закрывает соединения загрузки, отмена прерывает их сразу
+        self.control = TransferControl()
         self.ydl = None
         
     def run(self):
         try:
+            # Проверяем архив до любых сетевых запросов
+            if self.is_archived(normalize_vk_url(self.video_url)):
+                self.channel.log("Это видео уже было скачано ранее")
+                self.download_finished.emit(False, "Видео уже скачано ранее")
+                return
+
             # Импортируем yt-dlp внутри потока
             try:
                 import yt_dlp
             except ImportError:
-                self.progress_update.emit("yt-dlp не установлен. Установка...")
+                self.channel.log("yt-dlp не установлен. Установка...")
                 try:
                     subprocess.check_call([sys.executable, "-m", "pip", "install", "yt-dlp"])
-                    self.progress_update.emit("yt-dlp успешно установлен")
+                    self.channel.log("yt-dlp успешно установлен")
                     import yt_dlp
                 except Exception as e:
-                    self.progress_update.emit(f"Ошибка при установке yt-dlp: {e}")
+                    self.channel.log(f"Ошибка при установке yt-dlp: {e}")
                     self.download_finished.emit(False, "Ошибка установки yt-dlp")
                     return
             
             video_url = normalize_vk_url(self.video_url)
             
             if not video_url:
-                self.progress_update.emit("Неверный формат ID или URL видео")
+                self.channel.log("Неверный формат ID или URL видео")
                 self.download_finished.emit(False, "Неверный формат URL")
                 return
             
-            self.progress_update.emit(f"Начинаем скачивание видео: {video_url}")
+            # Плейлист проверяется по исходной ссылке: нормализация отбрасывает параметры (?section=album_4)
+            if is_playlist_url(self.video_url.strip()):
+                self.download_playlist(yt_dlp, self.video_url.strip())
+                return
             
-            # Настраиваем опции для yt-dlp
-            ydl_opts = {
-                'format': 'best',
-                'noplaylist': True,
-                'progress_hooks': [self.progress_hook],
-                'logger': MyLogger(self.progress_update),
-            }
+            self.channel.log(f"Начинаем скачивание видео: {video_url}")
             
-            # Устанавливаем директорию для скачивания, если указана
-            if self.output_dir:
-                ydl_opts['outtmpl'] = os.path.join(self.output_dir, '%(title)s.%(ext)s')
-            else:
-                ydl_opts['outtmpl'] = '%(title)s.%(ext)s'
+            # Записываем задачу в журнал, чтобы продолжить её после падения программы
+            if self.journal:
+                self.journal_entry = self.journal.begin(video_url, self.output_dir)
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            with self.open_session(yt_dlp) as ydl:
                 self.ydl = ydl
                 
                 # Проверка на отмену перед началом скачивания
                 if self.is_cancelled:
-                    self.progress_update.emit("Скачивание отменено")
+                    self.finish_journal_entry(job_journal.CANCELLED)
+                    self.channel.log("Скачивание отменено")
                     self.download_finished.emit(False, "Отменено пользователем")
                     return
                     
-                info = ydl.extract_info(video_url, download=True)
+                if self.limiter:
+                    self.throttle = self.limiter.register()
+                info = fetch_video(ydl, video_url, cache=self.cache,
+                                   journal_entry=self.journal_entry, throttle=self.throttle,
+                                   process_pool=self.process_pool, control=self.control)
+                self.finish_journal_entry(job_journal.DONE)
+                if self.archive is not None:
+                    self.archive.add(video_key(video_url), info_key(info))
                 
                 # Если скачивание было отменено во время загрузки
                 if self.is_cancelled:
-                    self.progress_update.emit("Скачивание отменено")
+                    self.finish_journal_entry(job_journal.CANCELLED)
+                    self.channel.log("Скачивание отменено")
                     self.download_finished.emit(False, "Отменено пользователем")
                     return
                 
@@ -157,94 +212,165 @@ class DownloadThread(QThread):
                 else:
                     full_path = os.path.abspath(filename)
                     
-                self.progress_update.emit(f"Видео успешно скачано: {filename}")
+                self.channel.log(f"Видео успешно скачано: {filename}")
                 self.download_finished.emit(True, full_path)
                 
         except Exception as e:
             if self.is_cancelled:
-                self.progress_update.emit("Скачивание отменено")
+                self.finish_journal_entry(job_journal.CANCELLED)
+                self.channel.log("Скачивание отменено")
                 self.download_finished.emit(False, "Отменено пользователем")
             else:
-                self.progress_update.emit(f"Ошибка при скачивании видео: {e}")
+                self.finish_journal_entry(job_journal.FAILED)
+                self.channel.log(f"Ошибка при скачивании видео: {e}")
                 self.download_finished.emit(False, str(e))
+        finally:
+            if self.throttle:
+                self.throttle.close()
+                self.throttle = None
+
+    def open_session(self, yt_dlp):
+        """Экземпляр YoutubeDL с обработчиками этого потока"""
+        # Опции yt-dlp с папкой для скачивания и выбранным качеством
+        ydl_opts = build_ydl_opts(self.output_dir, self.format_policy)
+        hooks = [self.progress_hook, self.channel.progress_hook, self.journal_progress_hook]
+        logger = MyLogger(self.channel)
+        
+        # Берём «тёплый» экземпляр YoutubeDL из пула, если он есть
+        if self.ydl_pool:
+            return self.ydl_pool.lease(ydl_opts, hooks, logger)
+        return yt_dlp.YoutubeDL(dict(ydl_opts, progress_hooks=hooks, logger=logger))
+    
+    def download_playlist(self, yt_dlp, playlist_url):
+        """Скачивает видео плейлиста по одному, запрашивая список постранично"""
+        self.channel.log(f"Начинаем скачивание плейлиста: {playlist_url}")
+        downloaded = skipped = failed = 0
+        last_path = None
+        
+        with self.open_session(yt_dlp) as ydl:
+            self.ydl = ydl
+            for video_url in iter_playlist(ydl, playlist_url):
+                if self.is_cancelled:
+                    break
+                if self.is_archived(normalize_vk_url(video_url)):
+                    skipped += 1
+                    continue
+                
+                self.channel.log(f"Скачиваем видео {downloaded + failed + 1}: {video_url}")
+                if self.journal:
+                    self.journal_entry = self.journal.begin(video_url, self.output_dir)
+                if self.limiter:
+                    self.throttle = self.limiter.register()
+                try:
+                    info = fetch_video(ydl, video_url, cache=self.cache,
+                                       journal_entry=self.journal_entry, throttle=self.throttle,
+                                       process_pool=self.process_pool, control=self.control)
+                except Exception as e:
+                    if self.is_cancelled:
+                        self.finish_journal_entry(job_journal.CANCELLED)
+                        break
+                    self.finish_journal_entry(job_journal.FAILED)
+                    self.channel.log(f"Ошибка при скачивании видео: {e}")
+                    failed += 1
+                    continue
+                finally:
+                    if self.throttle:
+                        self.throttle.close()
+                        self.throttle = None
+                
+                self.finish_journal_entry(job_journal.DONE)
+                if self.archive is not None:
+                    self.archive.add(video_key(normalize_vk_url(video_url)), info_key(info))
+                last_path = ydl.prepare_filename(info)
+                downloaded += 1
+        
+        self.channel.log(f"Плейлист обработан: скачано {downloaded}, пропущено {skipped}, ошибок {failed}")
+        if self.is_cancelled:
+            self.channel.log("Скачивание отменено")
+            self.download_finished.emit(False, "Отменено пользователем")
+        elif last_path:
+            self.download_finished.emit(True, os.path.abspath(last_path))
+        else:
+            self.download_finished.emit(False, f"Не скачано ни одного видео (пропущено {skipped}, ошибок {failed})")
+    
+    def is_archived(self, video_url):
+        """True, если видео уже скачано и повторное скачивание не запрошено"""
+        return not self.redownload and self.archive is not None and video_key(video_url) in self.archive
+
+    def journal_progress_hook(self, d):
+        """Передаёт прогресс в журнал текущей задачи"""
+        if self.journal_entry:
+            self.journal_entry.progress_hook(d)
+
+    def finish_journal_entry(self, state):
+        """Отмечает задачу в журнале завершённой"""
+        if state == job_journal.CANCELLED and self.control.interrupted:
+            # Прерванная закрытием программы задача продолжится при следующем запуске
+            self.journal_entry = None
+        if self.journal_entry:
+            self.journal_entry.finish(state)
+            self.journal_entry = None
+
+    @property
+    def is_cancelled(self):
+        return self.control.cancelled
 
     def progress_hook(self, d):
-        # Проверяем на паузу и отмену
-        self.mutex.lock()
-        if self.is_paused:
-            self.pause_condition.wait(self.mutex)
-        is_cancelled_now = self.is_cancelled
-        self.mutex.unlock()
-        
-        if is_cancelled_now:
-            raise Exception("Downloading cancelled by user")
-            
-        if d['status'] == 'downloading':
-            percent = d.get('_percent_str', 'Неизвестно')
-            speed = d.get('_speed_str', 'Неизвестно')
-            eta = d.get('_eta_str', 'Неизвестно')
-            self.progress_update.emit(f"Загрузка: {percent} | Скорость: {speed} | Осталось: {eta}")
+        # Прерывает загрузчик yt-dlp при паузе и отмене (встроенные загрузчики закрывают соединения сами)
+        self.control.progress_hook(d)
     
     def pause_download(self):
-        """Поставить скачивание на паузу"""
-        self.mutex.lock()
-        self.is_paused = True
-        self.mutex.unlock()
-        self.progress_update.emit("Скачивание приостановлено")
+        """Поставить скачивание на паузу: соединения закрываются, загрузка продолжится с того же байта"""
+        self.control.pause()
+        self.channel.log("Скачивание приостановлено")
         
     def resume_download(self):
         """Возобновить скачивание"""
-        self.mutex.lock()
-        self.is_paused = False
-        self.mutex.unlock()
-        self.pause_condition.wakeAll()
-        self.progress_update.emit("Скачивание возобновлено")
+        self.control.resume()
+        self.channel.log("Скачивание возобновлено")
         
     def cancel_download(self):
-        """Отменить скачивание"""
-        self.mutex.lock()
-        self.is_cancelled = True
-        self.is_paused = False
-        self.mutex.unlock()
-        self.pause_condition.wakeAll()
-        
-        # Пытаемся остановить yt-dlp, если он запущен
-        if self.ydl and hasattr(self.ydl, 'params') and hasattr(self.ydl.params, 'get'):
-            # Отменяем через флаг, который проверяется в progress_hook
-            self.progress_update.emit("Отменяем скачивание...")
+        """Отменить скачивание: соединения прерываются сразу, недокачанный файл удаляется"""
+        self.control.cancel()
+        self.channel.log("Отменяем скачивание...")
+
+    def interrupt_download(self):
+        """Прервать скачивание при закрытии программы, сохранив недокачанный файл и задачу в журнале"""
+        self.control.interrupt()
 
 
 # Функция удаления ANSI-кодов цветов из строки
 def strip_ansi_codes(s):
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    return ansi_escape.sub('', s)
+    return ANSI_ESCAPE_RE.sub('', s)
+
+
+def format_eta(seconds):
+    """Оставшееся время в виде ММ:СС или Ч:ММ:СС"""
+    if seconds is None:
+        return 'Неизвестно'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
 
 
 class MyLogger:
-    """Кастомный логгер для yt-dlp, передающий сообщения в сигнал Qt"""
-    def __init__(self, signal):
-        self.signal = signal
+    """Кастомный логгер для yt-dlp, передающий сообщения в канал прогресса"""
+    def __init__(self, channel):
+        self.channel = channel
         
     def debug(self, msg):
-        if msg.startswith('[download]'):
-            # Удаляем ANSI-коды из сообщения
-            clean_msg = strip_ansi_codes(msg)
-            self.signal.emit(clean_msg)
+        # Строки с процентами загрузки не нужны: прогресс показывается индикатором
+        if msg.startswith('[download]') and '%' not in msg:
+            self.channel.log(strip_ansi_codes(msg))
     
     def info(self, msg):
-        # Удаляем ANSI-коды из сообщения
-        clean_msg = strip_ansi_codes(msg)
-        self.signal.emit(clean_msg)
+        self.channel.log(strip_ansi_codes(msg))
     
     def warning(self, msg):
-        # Удаляем ANSI-коды из сообщения
-        clean_msg = strip_ansi_codes(msg)
-        self.signal.emit(f"Предупреждение: {clean_msg}")
+        self.channel.log(f"Предупреждение: {strip_ansi_codes(msg)}")
     
     def error(self, msg):
-        # Удаляем ANSI-коды из сообщения
-        clean_msg = strip_ansi_codes(msg)
-        self.signal.emit(f"Ошибка: {clean_msg}")
+        self.channel.log(f"Ошибка: {strip_ansi_codes(msg)}")
 
 
 class VKVideoDownloaderApp(QMainWindow):
@@ -256,6 +382,25 @@ class VKVideoDownloaderApp(QMainWindow):
         self.output_directory = None
         self.is_downloading = False
         self.is_paused = False
+        self.journal = open_job_journal()
+        # Кэш метаданных и архив одни на окно и общие для всех загрузок и менеджера загрузок
+        self.metadata_cache = open_metadata_cache()
+        self.archive = open_download_archive()
+        self.resume_queue = []
+        self.limiter = BandwidthLimiter()
+        self.ydl_pool = YoutubeDLPool(max_idle=1)
+        self.process_pool = None
+        # Единственный пул рабочих процессов: включение и выключение режима не создают новых пулов
+        self.worker_pool = None
+        self.download_manager = None
+        
+        # Прогресс и лог потока загрузки обновляются по таймеру, а не на каждый пакет данных
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(PROGRESS_REFRESH_MS)
+        self.refresh_timer.timeout.connect(self.refresh_progress)
+        
+        # Проверяем незавершённые загрузки после показа окна
+        QTimer.singleShot(0, self.check_unfinished_downloads)
         
     def initUI(self):
         # Настройка окна
@@ -277,6 +422,14 @@ class VKVideoDownloaderApp(QMainWindow):
         self.url_input.setPlaceholderText("Вставьте ссылку на видео ВКонтакте")
         url_layout.addWidget(url_label)
         url_layout.addWidget(self.url_input)
+        
+        # Наибольшее разрешение: меньшее качество экономит трафик и место на диске
+        self.quality_input = QComboBox()
+        for title, height in QUALITY_CHOICES:
+            self.quality_input.addItem(title, height)
+        self.quality_input.setToolTip("Наибольшее качество видео")
+        self.quality_input.currentIndexChanged.connect(self.sync_download_manager)
+        url_layout.addWidget(self.quality_input)
         main_layout.addLayout(url_layout)
         
         # Кнопки действий
@@ -318,9 +471,20 @@ class VKVideoDownloaderApp(QMainWindow):
         self.stop_button.clicked.connect(self.stop_download)
         self.stop_button.hide()  # Изначально скрыта
         
+        # Ограничение скорости, можно менять во время скачивания
+        self.rate_limit_input = QSpinBox()
+        self.rate_limit_input.setMinimumHeight(30)
+        self.rate_limit_input.setRange(0, 1000000)
+        self.rate_limit_input.setSingleStep(100)
+        self.rate_limit_input.setSuffix(" КБ/с")
+        self.rate_limit_input.setSpecialValueText("Без ограничения скорости")
+        self.rate_limit_input.setToolTip("Ограничение скорости скачивания (0 — без ограничения)")
+        self.rate_limit_input.valueChanged.connect(self.rate_limit_changed)
+        
         buttons_layout.addWidget(self.select_dir_button)
         buttons_layout.addWidget(self.action_button)
         buttons_layout.addWidget(self.stop_button)
+        buttons_layout.addWidget(self.rate_limit_input)
         main_layout.addLayout(buttons_layout)
         
         # Информация о выбранной директории
@@ -330,13 +494,14 @@ class VKVideoDownloaderApp(QMainWindow):
         # Индикатор прогресса
         self.progress_bar = QProgressBar()
         self.progress_bar.setTextVisible(False)
-        self.progress_bar.setRange(0, 0)  # Бесконечный прогресс
+        self.progress_bar.setRange(0, 0)  # Бесконечный прогресс, пока размер неизвестен
         self.progress_bar.hide()
         main_layout.addWidget(self.progress_bar)
         
         # Область для логов
-        self.log_area = QTextEdit()
+        self.log_area = QPlainTextEdit()
         self.log_area.setReadOnly(True)
+        self.log_area.setMaximumBlockCount(LOG_MAX_LINES)
         self.log_area.setStyleSheet("background-color: #f0f0f0; font-family: monospace;")
         main_layout.addWidget(self.log_area)
         
@@ -345,6 +510,49 @@ class VKVideoDownloaderApp(QMainWindow):
         self.setStatusBar(self.statusbar)
         self.statusbar.showMessage("Готово к работе")
     
+    def toggle_process_pool(self, enabled):
+        """Включает или выключает пул рабочих процессов для следующих загрузок"""
+        if enabled:
+            # Остановленный пул снова запускает процессы при первой задаче
+            if self.worker_pool is None:
+                self.worker_pool = WorkerProcessPool()
+            self.process_pool = self.worker_pool
+        else:
+            self.process_pool = None
+            self.stop_worker_pool()
+        self.sync_download_manager()
+    
+    def stop_worker_pool(self):
+        """
+        Останавливает процессы пула, если режим выключен
+
+        Остановка ждёт текущих задач пула, поэтому выполняется в отдельном потоке.
+        Если текущая загрузка снова обратится к пулу, процессы перезапустятся
+        и остановятся по её завершении
+        """
+        if self.worker_pool is not None and self.process_pool is None:
+            threading.Thread(target=self.worker_pool.close, daemon=True).start()
+    
+    def open_download_manager(self):
+        """Показывает окно менеджера загрузок, создавая его при первом открытии"""
+        if self.download_manager is None:
+            settings = DownloadSettings(cache=self.metadata_cache, archive=self.archive,
+                                        journal=self.journal, limiter=self.limiter)
+            self.download_manager = DownloadManagerWindow(settings, DEFAULT_WORKERS)
+            self.sync_download_manager()
+        self.download_manager.show()
+        self.download_manager.raise_()
+        self.download_manager.activateWindow()
+    
+    def sync_download_manager(self):
+        """Передаёт менеджеру загрузок папку, качество и пул процессов главного окна"""
+        if self.download_manager is None:
+            return
+        settings = self.download_manager.queue.settings
+        settings.output_dir = self.output_directory
+        settings.format_policy = FormatPolicy(max_height=self.quality_input.currentData())
+        settings.process_pool = self.process_pool
+    
     def create_menu_bar(self):
         """Создание верхнего меню"""
         menu_bar = QMenuBar(self)
@@ -359,6 +567,17 @@ class VKVideoDownloaderApp(QMainWindow):
         select_dir_action.triggered.connect(self.select_output_directory)
         file_menu.addAction(select_dir_action)
         
+        # Очередь из многих загрузок, идущих одновременно
+        download_manager_action = QAction("Менеджер загрузок...", self)
+        download_manager_action.triggered.connect(self.open_download_manager)
+        file_menu.addAction(download_manager_action)
+        
+        # Извлечение и постобработка в рабочих процессах, чтобы не нагружать поток интерфейса
+        process_pool_action = QAction("Извлекать в отдельных процессах", self)
+        process_pool_action.setCheckable(True)
+        process_pool_action.toggled.connect(self.toggle_process_pool)
+        file_menu.addAction(process_pool_action)
+        
         # Разделитель
         file_menu.addSeparator()
         
@@ -479,6 +698,38 @@ class VKVideoDownloaderApp(QMainWindow):
                          <p>Программа для скачивания видео из ВКонтакте</p>
                          <p>Создана с использованием Python, PyQt5 и yt-dlp</p>""")
     
+    def check_unfinished_downloads(self):
+        """Предлагает продолжить загрузки, прерванные при прошлом запуске"""
+        if not self.journal:
+            return
+        unfinished = self.journal.unfinished()
+        if not unfinished:
+            return
+        
+        reply = QMessageBox.question(self, "Незавершённые загрузки",
+                                     f"Найдено незавершённых загрузок: {len(unfinished)}.\n"
+                                     "Продолжить их?",
+                                     QMessageBox.Yes | QMessageBox.No)
+        if reply == QMessageBox.Yes:
+            self.resume_queue = list(unfinished)
+            self.start_next_resumed()
+        else:
+            # Отказ пользователя — больше не предлагаем эти загрузки
+            for url, output_dir in unfinished:
+                self.journal.begin(url, output_dir).finish(job_journal.CANCELLED)
+    
+    def start_next_resumed(self):
+        """Запускает следующую загрузку из очереди незавершённых"""
+        if not self.resume_queue or self.is_downloading:
+            return
+        url, output_dir = self.resume_queue.pop(0)
+        self.url_input.setText(url)
+        if output_dir:
+            self.output_directory = output_dir
+            self.dir_info_label.setText(f"Папка для сохранения: {output_dir}")
+        self.update_log(f"Продолжаем прерванную загрузку: {url}")
+        self.start_download()
+    
     def select_output_directory(self):
         """Выбор директории для сохранения видео"""
         dir_path = QFileDialog.getExistingDirectory(self, "Выберите папку для сохранения")
@@ -486,6 +737,7 @@ class VKVideoDownloaderApp(QMainWindow):
             self.output_directory = dir_path
             self.dir_info_label.setText(f"Папка для сохранения: {dir_path}")
             self.statusbar.showMessage(f"Выбрана папка: {dir_path}")
+            self.sync_download_manager()
     
     def action_button_clicked(self):
         """Обработчик нажатия основной кнопки действия"""
@@ -506,6 +758,17 @@ class VKVideoDownloaderApp(QMainWindow):
         if not url:
             QMessageBox.warning(self, "Ошибка", "Пожалуйста, введите URL видео")
             return
+        
+        # Уже скачанное видео можно скачать заново, если пользователь подтвердит
+        redownload = video_key(normalize_vk_url(url)) in self.archive
+        if redownload:
+            reply = QMessageBox.question(self, "Видео уже скачано",
+                                         "Это видео уже было скачано ранее.\nСкачать его заново?",
+                                         QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            if reply != QMessageBox.Yes:
+                self.statusbar.showMessage("Видео уже скачано ранее")
+                self.start_next_resumed()
+                return
             
         # Деактивируем элементы управления
         self.url_input.setEnabled(False)
@@ -522,14 +785,19 @@ class VKVideoDownloaderApp(QMainWindow):
         self.is_paused = False
         
         # Показываем индикатор прогресса
+        self.reset_progress_bar()
         self.progress_bar.show()
         self.statusbar.showMessage("Скачивание...")
         
         # Начинаем скачивание в отдельном потоке
-        self.download_thread = DownloadThread(url, self.output_directory)
-        self.download_thread.progress_update.connect(self.update_log)
+        format_policy = FormatPolicy(max_height=self.quality_input.currentData())
+        self.download_thread = DownloadThread(url, self.output_directory, self.journal,
+                                              self.limiter, self.ydl_pool, self.process_pool,
+                                              format_policy, self.metadata_cache, self.archive,
+                                              redownload)
         self.download_thread.download_finished.connect(self.download_complete)
         self.download_thread.start()
+        self.refresh_timer.start()
     
     def pause_download(self):
         """Поставить скачивание на паузу"""
@@ -560,16 +828,64 @@ class VKVideoDownloaderApp(QMainWindow):
                 self.download_thread.cancel_download()
                 self.statusbar.showMessage("Отмена загрузки...")
     
+    def rate_limit_changed(self, value):
+        """Применение нового ограничения скорости"""
+        self.limiter.set_global_rate(value * 1024 if value else None)
+        if value:
+            self.statusbar.showMessage(f"Ограничение скорости: {value} КБ/с")
+        else:
+            self.statusbar.showMessage("Скорость не ограничена")
+    
     def update_log(self, message):
         """Обновление лога с информацией"""
-        # Дополнительная обработка сообщения для удаления ANSI-кодов
-        message = strip_ansi_codes(message)
-        self.log_area.append(message)
+        self.log_area.appendPlainText(message)
         # Прокрутка к концу
         self.log_area.verticalScrollBar().setValue(self.log_area.verticalScrollBar().maximum())
+    
+    def refresh_progress(self):
+        """Забирает накопленные прогресс и сообщения потока загрузки"""
+        if not self.download_thread:
+            return
+        snapshot, lines, dropped = self.download_thread.channel.drain()
+        if dropped:
+            self.update_log(f"... пропущено сообщений: {dropped}")
+        if lines:
+            # Добавляем все строки одной операцией, чтобы не перерисовывать лог на каждую
+            self.update_log('\n'.join(lines))
+        if snapshot and snapshot.status == 'downloading':
+            self.show_progress(snapshot)
+    
+    def reset_progress_bar(self):
+        """Возвращает индикатор в режим неизвестного размера"""
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setTextVisible(False)
+    
+    def show_progress(self, snapshot):
+        """Отображает состояние загрузки в индикаторе и строке состояния"""
+        fraction = snapshot.fraction
+        if fraction is None:
+            self.reset_progress_bar()
+            percent = 'Неизвестно'
+        else:
+            percent = f"{fraction * 100:.1f}%"
+            if self.progress_bar.maximum() != PROGRESS_SCALE:
+                self.progress_bar.setRange(0, PROGRESS_SCALE)
+                self.progress_bar.setTextVisible(True)
+            self.progress_bar.setValue(int(fraction * PROGRESS_SCALE))
+            self.progress_bar.setFormat(percent)
+        
+        if not self.is_paused:
+            speed = f"{format_bytes(snapshot.speed)}/s" if snapshot.speed is not None else 'Неизвестно'
+            self.statusbar.showMessage(f"Загрузка: {percent} | {format_bytes(snapshot.downloaded)} из "
+                                       f"{format_bytes(snapshot.total)} | Скорость: {speed} | "
+                                       f"Осталось: {format_eta(snapshot.eta)}")
         
     def download_complete(self, success, message):
         """Обработка завершения скачивания"""
+        # Выводим сообщения, накопленные с последнего обновления
+        self.refresh_timer.stop()
+        self.refresh_progress()
+        
         # Скрываем прогресс-бар
         self.progress_bar.hide()
         
@@ -583,6 +899,7 @@ class VKVideoDownloaderApp(QMainWindow):
         self.select_dir_button.setEnabled(True)
         self.is_downloading = False
         self.is_paused = False
+        self.stop_worker_pool()
         
         if success:
             self.statusbar.showMessage("Скачивание успешно завершено")
@@ -603,12 +920,51 @@ class VKVideoDownloaderApp(QMainWindow):
         else:
             if "Отменено пользователем" in message:
                 self.statusbar.showMessage("Скачивание отменено пользователем")
+                self.resume_queue = []
+            elif "уже скачано" in message:
+                self.statusbar.showMessage("Видео уже скачано ранее")
+                QMessageBox.information(self, "Видео уже скачано",
+                                        "Это видео уже было скачано ранее")
             else:
                 self.statusbar.showMessage("Ошибка при скачивании")
                 QMessageBox.critical(self, "Ошибка", f"Не удалось скачать видео: {message}")
+        
+        # Продолжаем следующую прерванную загрузку, если они остались
+        self.start_next_resumed()
+    
+    def closeEvent(self, event):
+        """
+        Останавливает загрузки и закрывает хранилища при закрытии окна
+
+        Загрузки прерываются, а не отменяются: недокачанные файлы и записи журнала
+        с последним состоянием сохраняются, и при следующем запуске программа
+        предложит их продолжить
+        """
+        self.refresh_timer.stop()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        stopped = True
+        if self.download_thread is not None and self.download_thread.isRunning():
+            self.download_thread.download_finished.disconnect()
+            self.download_thread.interrupt_download()
+            stopped = self.download_thread.wait(int(SHUTDOWN_TIMEOUT * 1000))
+        if self.download_manager is not None:
+            stopped = self.download_manager.queue.shutdown(max(0, deadline - time.monotonic())) and stopped
+            self.download_manager.close()
+        # Пулы и хранилища, которые ещё нужны не успевшим остановиться потокам, закроются с процессом
+        if stopped:
+            if self.worker_pool is not None:
+                self.worker_pool.close()
+            self.ydl_pool.close()
+            if self.metadata_cache:
+                self.metadata_cache.close()
+            if self.journal:
+                self.journal.close()
+        super().closeEvent(event)
 
 
 if __name__ == "__main__":
+    # Нужно для рабочих процессов в собранном PyInstaller exe
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     app.setStyle('Fusion')  # Используем стиль Fusion для единообразия на разных платформах
     